@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Benchmark for KBDI.calculate_net_rainfall
+
+Compares the single-pass net rainfall kernel against the original multi-pass
+np.where implementation (kept below as legacy_net_rainfall) on the bundled
+station csv files and on a synthetic grid. The results must be bit-identical.
+
+usage:
+    python benchmarks/bench_net_rainfall.py [--days 3650] [--rows 100] [--cols 100]
+"""
+import argparse
+import datetime
+import os
+import time
+
+import numpy as np
+
+from kbdiffdi.features import feature
+from kbdiffdi.indices import kbdi
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kbdiffdi", "data")
+
+STATIONS = {"George.csv": 2,        # column index of the yyyymmdd date column
+            "Knysna.csv": 1,
+            "Plett.csv": 2,
+            "PortElizabeth.csv": 2}
+
+
+def legacy_net_rainfall(prcp_data):
+    """
+    the original implementation of KBDI.calculate_net_rainfall. The state arrays are
+    shaped like a single day of data and `and` is replaced with `&` so that it runs on grids.
+    """
+    threshold = 5.08
+    net_rainfall = np.zeros(shape=prcp_data.shape)
+    daily_prcp = prcp_data
+    running_total = np.zeros(shape=prcp_data.shape[1:])
+    consec = np.zeros(shape=prcp_data.shape[1:], dtype=bool)
+    already_subtracted = np.zeros(shape=prcp_data.shape[1:], dtype=bool)
+    n=0
+    while n < len(daily_prcp):
+        running_total += daily_prcp[n]
+        net_rainfall[n] = np.where(daily_prcp[n] == 0, 0, net_rainfall[n])
+        running_total = np.where(daily_prcp[n] == 0, 0, running_total)
+        already_subtracted = np.where(daily_prcp[n] == 0, False, already_subtracted)
+        if n > 0:
+            consec = np.where((daily_prcp[n] > 0) & (daily_prcp[n-1] > 0), True, False)
+        net_rainfall[n] = np.where((daily_prcp[n] > 0) & (consec == True) & (already_subtracted == True), daily_prcp[n], net_rainfall[n])
+        running_total = np.where((daily_prcp[n] > 0) & (consec == True) & (already_subtracted == True), 0, running_total)
+        net_rainfall[n] = np.where((daily_prcp[n] > threshold) & (consec == True) & (already_subtracted == False), running_total - threshold, net_rainfall[n])
+        already_subtracted = np.where((daily_prcp[n] > threshold) & (consec == True) & (already_subtracted == False), True, already_subtracted)
+        running_total = np.where((daily_prcp[n] > threshold) & (consec == True) & (already_subtracted == False), 0, running_total)
+        net_rainfall[n] = np.where((daily_prcp[n] > threshold) & (consec == False), daily_prcp[n] - threshold, net_rainfall[n])
+        already_subtracted = np.where((daily_prcp[n] > threshold) & (consec == False), True, already_subtracted)
+        running_total = np.where((daily_prcp[n] > threshold) & (consec == False), 0, running_total)
+        net_rainfall[n] = np.where((daily_prcp[n] < threshold) & (consec == False), 0, net_rainfall[n])
+        net_rainfall[n] = np.where((daily_prcp[n] < threshold) & (consec == True) & (running_total <= threshold) & (already_subtracted == False), 0, net_rainfall[n])
+        net_rainfall[n] = np.where((daily_prcp[n] < threshold) & (consec == True) & (running_total > threshold), running_total - threshold, net_rainfall[n])
+        already_subtracted = np.where((daily_prcp[n] < threshold) & (consec == True) & (running_total > threshold), True, already_subtracted)
+        running_total = np.where((daily_prcp[n] < threshold) & (consec == True) & (running_total > threshold), 0, running_total)
+        n+=1
+    return net_rainfall
+
+
+def load_station_rain(filename, date_col):
+    """ reads the rainfall column (the one after the date column) of a station csv """
+    indata = np.genfromtxt(filename, dtype=str, delimiter=",", skip_header=1, encoding="latin-1")
+    indata = indata[indata[:, date_col] != ""]
+    rain = indata[:, date_col + 1]
+    rain = np.where(rain == "", "nan", rain).astype(float)
+    return rain.reshape(-1, 1, 1, 1)
+
+
+def make_stack(data):
+    start = datetime.datetime(1900, 1, 1)
+    datelist = [start + datetime.timedelta(days=i) for i in range(len(data))]
+    stack = feature.RasterStack()
+    stack.create_sc_stack(data, datelist, None, "standard", 0, 0, 1, -1)
+    return stack
+
+
+def synthetic_rain(ndays, nrows, ncols, seed=0):
+    """ daily rain with about 30% wet days, wet spells, exact-threshold days and a few NaN cells """
+    rng = np.random.RandomState(seed)
+    wet = rng.rand(ndays, 1, nrows, ncols) < 0.3
+    amount = np.round(rng.gamma(0.8, 8.0, size=wet.shape), 1)
+    rain = np.where(wet, amount, 0.0)
+    rain[rng.rand(*rain.shape) < 0.001] = 5.08
+    rain[rng.rand(*rain.shape) < 0.0005] = np.nan
+    return rain
+
+
+def time_both(name, prcp_data):
+    k = kbdi.KBDI()
+    k.set_prcp(make_stack(prcp_data))
+    t0 = time.perf_counter()
+    expected = legacy_net_rainfall(k.prcp.data)
+    t_legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    k.calculate_net_rainfall()
+    t_new = time.perf_counter() - t0
+    identical = np.array_equal(expected, k.get_net_rainfall().data, equal_nan=True)
+    print("%-28s %10s %10.3f %10.3f %8.1fx %10s" % (name, str(prcp_data.shape[0]) + "x" + str(prcp_data[0].size),
+                                                   t_legacy, t_new, t_legacy / t_new, identical))
+    return identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark KBDI.calculate_net_rainfall")
+    parser.add_argument("--days", type=int, default=3650)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--cols", type=int, default=100)
+    args = parser.parse_args()
+
+    print("%-28s %10s %10s %10s %9s %10s" % ("input", "days x cells", "legacy (s)", "new (s)", "speedup", "identical"))
+    all_identical = True
+    for filename, date_col in sorted(STATIONS.items()):
+        rain = load_station_rain(os.path.join(DATA_DIR, filename), date_col)
+        all_identical &= time_both(filename, rain)
+    rain = synthetic_rain(args.days, args.rows, args.cols)
+    all_identical &= time_both("synthetic grid", rain)
+    if not all_identical:
+        raise SystemExit("net rainfall results differ from the legacy implementation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Accuracy check for running KBDI and FFDI in float32
+
+Runs KBDI -> drought factor -> FFDI on the bundled station csv files and on a
+synthetic grid, once with float64 inputs and once with float32 inputs (the dtype
+policy then keeps the whole pipeline in float32), and reports the largest
+differences. The check fails if a value is further than atol + rtol * |float64 value|
+from its float64 value:
+
+                            atol       rtol
+    KBDI inside 0 - 203.2   1e-3 mm    0
+    KBDI above 203.2        0          1e-5
+    drought factor          0.01       0        (ranges over 0 - 10)
+    FFDI                    0          1e-3
+
+KBDI is checked apart above its range because PortElizabeth.csv has some implausible
+temperature records that drive KBDI up to about 5e7 mm. There float32 is 15 mm
+off, which is within rounding of such values. The table reports the largest
+absolute KBDI difference inside the range, the largest relative KBDI difference above
+it, the largest absolute DF difference and the largest relative FFDI difference.
+Measured with the defaults: KBDI within 9e-4 mm inside the range and 5e-6 relative
+above it, DF within 7e-4 and FFDI within 2e-4 relative.
+
+usage:
+    python benchmarks/check_float32_accuracy.py [--days 3650] [--rows 100] [--cols 100]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from kbdiffdi.indices import kbdi
+from kbdiffdi.indices import ffdi
+
+from bench_net_rainfall import DATA_DIR, STATIONS, make_stack, synthetic_rain
+
+KBDI_RANGE = 203.2 # mm
+TOLERANCES = {"KBDI": (1e-3, 0), "KBDI above range": (0, 1e-5), "DF": (0.01, 0), "FFDI": (0, 1e-3)} # (atol, rtol)
+
+
+def load_station(filename, date_col):
+    """ reads the rain, temp, rel hum and wind (m/s, converted to km/h) columns after the date column of a station csv """
+    indata = np.genfromtxt(filename, dtype=str, delimiter=",", skip_header=1, encoding="latin-1")
+    indata = indata[indata[:, date_col] != ""]
+    columns = []
+    for i in range(1, 5):
+        column = indata[:, date_col + i]
+        columns.append(np.where(column == "", "nan", column).astype(float).reshape(-1, 1, 1, 1))
+    rain, temp, rel_hum, wind = columns
+    return rain, temp, rel_hum, wind * 3.6
+
+
+def synthetic_weather(ndays, nrows, ncols, seed=0):
+    rng = np.random.RandomState(seed)
+    rain = synthetic_rain(ndays, nrows, ncols, seed)
+    season = np.cos(np.arange(ndays) * 2 * np.pi / 365.25).reshape(-1, 1, 1, 1)
+    temp = 22 + 6 * season + rng.normal(0, 3, rain.shape)
+    rel_hum = np.clip(60 - 10 * season + rng.normal(0, 15, rain.shape), 5, 100)
+    wind = rng.gamma(2.0, 8.0, rain.shape)
+    return rain, temp, rel_hum, wind
+
+
+def run(rain, temp, rel_hum, wind, dtype):
+    stacks = [make_stack(data.astype(dtype)) for data in (rain, temp, rel_hum, wind)]
+    prcp, temp, rel_hum, wind = stacks
+    t0 = time.perf_counter()
+    out_kbdi = kbdi.KBDI().fit(temp, prcp)
+    out_ffdi, out_df = ffdi.FFDI().fit(out_kbdi, prcp, temp, wind, rel_hum)
+    seconds = time.perf_counter() - t0
+    return {"KBDI": out_kbdi.data, "DF": out_df.data, "FFDI": out_ffdi.data}, seconds
+
+
+def compare(name, inputs):
+    expected, t64 = run(*inputs, np.float64)
+    result, t32 = run(*inputs, np.float32)
+    ok = all(result[key].dtype == np.float32 for key in result)
+    above = expected["KBDI"] > KBDI_RANGE # the KBDI inside and above its range are checked apart
+    for out in (expected, result):
+        out["KBDI above range"] = out["KBDI"][above]
+        out["KBDI"] = out["KBDI"][~above]
+    errors = {}
+    for key in ["KBDI", "DF"]:
+        errors[key] = _nanmax(np.abs(result[key].astype(np.float64) - expected[key]))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for key in ["KBDI above range", "FFDI"]:
+            errors[key] = _nanmax(np.abs(result[key].astype(np.float64) - expected[key]) / np.abs(expected[key]))
+    for key in TOLERANCES:
+        atol, rtol = TOLERANCES[key]
+        ok &= bool(np.allclose(result[key], expected[key], rtol=rtol, atol=atol, equal_nan=True))
+    print("%-22s %10.2e %10.2e %10.2e %10.2e %9.3f %9.3f %5s" % (name, errors["KBDI"], errors["KBDI above range"], errors["DF"], errors["FFDI"], t64, t32, ok))
+    return ok
+
+
+def _nanmax(errors):
+    """ the largest error, 0 if there are none """
+    errors = errors[~np.isnan(errors)]
+    if len(errors) == 0:
+        return 0.
+    return errors.max()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check float32 KBDI/FFDI against float64")
+    parser.add_argument("--days", type=int, default=3650)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--cols", type=int, default=100)
+    args = parser.parse_args()
+
+    print("%-22s %10s %10s %10s %10s %9s %9s %5s" % ("input", "KBDI abs", "above rel", "DF abs", "FFDI rel", "f64 (s)", "f32 (s)", "ok"))
+    all_ok = True
+    for filename, date_col in sorted(STATIONS.items()):
+        all_ok &= compare(filename, load_station(os.path.join(DATA_DIR, filename), date_col))
+    all_ok &= compare("synthetic grid", synthetic_weather(args.days, args.rows, args.cols))
+    if not all_ok:
+        raise SystemExit("float32 results are not within tolerance of float64")
+
+
+if __name__ == "__main__":
+    main()
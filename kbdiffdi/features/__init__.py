@@ -1 +1,2 @@
-from .feature import *
\ No newline at end of file
+from .feature import *
+from .regrid import *
@@ -1,8 +1,13 @@
 import datetime
 import copy
+import json
+import weakref
 
 import numpy as np
 
+# the first bytes of a RasterStack file written by RasterStack.save_memmap()
+MEMMAP_MAGIC = b"KBDIFFDI_STACK1\n"
+
 class STFeatureStack:
 
     def __init__(self):
@@ -13,6 +18,9 @@ class STFeatureStack:
             a 3d array [timestep, row, col]
         datelist: list
             a list of python datetime objects
+        time_axis: numpy ndarray
+            the datelist as numpy datetime64[D], made from the datelist when it is
+            first needed (see get_datetime64()). Use it for vectorized time operations
         projection: string
             well known text representation of projection
             (maybe this should just be the EPSG number)
@@ -37,10 +45,15 @@ class STFeatureStack:
             the conclusion of the STFeatureStack. [llx, lly, end]
         mbc: list
             the minimum bounding cube [[ulx, uly, start], [llx, lly, end]]
+        dtype: numpy dtype
+            the dtype policy, the type the data is stored as (for example numpy.float32
+            to halve the memory of a large stack). None keeps the type of the input data
         """
 
         self.data = None
         self.datelist = None
+        self.time_axis = None
+        self.__time_axis_source = None # the datelist the time_axis was made from
 
         self.projection = None
         # (see http://cfconventions.org/Data/cf-conventions/cf-conventions-1.6/build/cf-conventions.html#time-coordinate) 
@@ -60,20 +73,142 @@ class STFeatureStack:
  
         self.mbc = None
 
+        self.dtype = None
+
     def set_projection(self, new_projection):
         self.projection = new_projection
 
     def set_calendar(self, new_calendar):
         self.calendar = new_calendar
 
-    def set_time_attributes(self, new_datelist):
+    def set_dtype(self, new_dtype):
+        """
+        sets the dtype policy. Data that is already in the stack is converted
+        (a memory-mapped stack is read into memory when its dtype changes)
+
+        parameters:
+        ------------
+        new_dtype: numpy dtype
+            the type to store the data as, or None to keep the type of the input data
+        """
+        self.dtype = None if new_dtype is None else np.dtype(new_dtype)
+        if self.data is not None and self.dtype is not None and self.data.dtype != self.dtype:
+            self.set_data(self.data)
+
+    def set_time_attributes(self, new_datelist, new_time_axis=None):
+        """
+        sets the datelist and the time bounds
+
+        parameters:
+        ------------
+        new_datelist: list or numpy ndarray
+            a list of python datetime objects, or a numpy datetime64 array
+            (which then also becomes the time_axis)
+        new_time_axis: numpy ndarray
+            the datelist as datetime64[D], if it is already known
+        """
+        if isinstance(new_datelist, np.ndarray):
+            new_time_axis = new_datelist.astype("datetime64[D]")
+            new_datelist = new_datelist.astype("datetime64[us]").tolist()
         self.datelist = new_datelist
+        if new_time_axis is not None:
+            self.time_axis = new_time_axis
+            self.__time_axis_source = self.datelist
         self.set_timebounds()
 
     def set_timebounds(self):
         self.start = self.datelist[0]
         self.end = self.datelist[-1]
 
+    def get_datetime64(self):
+        """
+        returns the datelist as a numpy datetime64[D] array (one value per day).
+        The array is made once and kept as the time_axis until the datelist changes
+        """
+        if self.__time_axis_source is not self.datelist or len(self.time_axis) != len(self.datelist):
+            # going through the proleptic Gregorian ordinals is much faster than letting
+            # numpy convert each datetime object. 719163 is the ordinal of 1970-01-01
+            ordinals = np.fromiter((date.toordinal() for date in self.datelist), dtype=np.int64, count=len(self.datelist))
+            self.time_axis = (ordinals - 719163).astype("datetime64[D]")
+            self.__time_axis_source = self.datelist
+        return self.time_axis
+
+    def get_years(self):
+        """
+        returns the year of every timestep as an int array
+        """
+        return self.get_datetime64().astype("datetime64[Y]").astype(np.int64) + 1970
+
+    def get_months(self):
+        """
+        returns the month (1-12) of every timestep as an int array
+        """
+        return self.get_datetime64().astype("datetime64[M]").astype(np.int64) % 12 + 1
+
+    def get_days(self):
+        """
+        returns the day of the month (1-31) of every timestep as an int array
+        """
+        time_axis = self.get_datetime64()
+        return (time_axis - time_axis.astype("datetime64[M]")).astype(np.int64) + 1
+
+    def get_days_of_year(self):
+        """
+        returns the day of the year (1-366) of every timestep as an int array
+        """
+        time_axis = self.get_datetime64()
+        return (time_axis - time_axis.astype("datetime64[Y]")).astype(np.int64) + 1
+
+    def get_date_index(self, date):
+        """
+        returns the index of the timestep at the given date. The datelist must be sorted.
+        For daily data without gaps this is O(1), otherwise it is a binary search
+
+        parameters:
+        ------------
+        date: datetime.datetime, datetime.date, numpy datetime64 or str ("YYYY-MM-DD")
+            the date to look up
+        returns:
+        ---------
+        index: int
+            the index of the date, or None if the date isn't in the stack
+        """
+        time_axis = self.get_datetime64()
+        date = np.datetime64(date, "D")
+        index = int((date - time_axis[0]).astype(np.int64)) # the index if there are no gaps
+        if index < 0 or index >= len(time_axis) or time_axis[index] != date:
+            index = int(np.searchsorted(time_axis, date))
+            if index == len(time_axis) or time_axis[index] != date:
+                print("error: " + str(date) + " is not in the stack")
+                return None
+        return index
+
+    def get_time_slice(self, start=None, end=None):
+        """
+        returns the slice of the timesteps from start to end (both included),
+        found with a binary search. The datelist must be sorted. The dates don't
+        have to be in the stack
+
+        parameters:
+        ------------
+        start: datetime.datetime, datetime.date, numpy datetime64 or str ("YYYY-MM-DD")
+            the first date. If None, the slice starts at the first timestep
+        end: datetime.datetime, datetime.date, numpy datetime64 or str ("YYYY-MM-DD")
+            the last date. If None, the slice ends at the last timestep
+        returns:
+        ---------
+        out: slice
+            a slice that can index the datelist and the first axis of the data
+        """
+        time_axis = self.get_datetime64()
+        first = 0
+        last = len(time_axis)
+        if start is not None:
+            first = int(np.searchsorted(time_axis, np.datetime64(start, "D"), side="left"))
+        if end is not None:
+            last = int(np.searchsorted(time_axis, np.datetime64(end, "D"), side="right"))
+        return slice(first, max(first, last))
+
     def set_space_attributes(self, new_mbrlist):
         """
         sets all the STFeatureStack's spatial attributes
@@ -118,13 +253,41 @@ class STFeatureStack:
         self.mbc = [self.origin, self.conclusion]
 
     def append_date(self, new_feature):
-        self.datelist.append(new_feature.date)
+        # build a new list rather than appending in place, the datelist may be
+        # shared with other stacks (see create_stack_like)
+        self.datelist = self.datelist + [new_feature.date]
         self.set_timebounds()
 
     def append_mbr(self, new_feature):
         new_mbrlist = np.append(self.mbrlist, [new_feature.mbr], axis=0)
         self.set_space_attributes(new_mbrlist)
 
+    def create_stack_like(self, parent, new_data):
+        """
+        makes this stack a result stack of the parent: it gets new_data and every other
+        attribute of the parent (datelist, mbr, projection, cell size, ...). The attributes
+        are shared with the parent, not copied, and new_data is used as is, so
+        no data is copied at all.
+
+        parameters:
+        ------------
+        parent: STFeatureStack
+            the stack the result was calculated from
+        new_data: numpy ndarray
+            the result data. It must have the same shape as the parent's data
+        returns:
+        ---------
+        None
+        """
+        new_data = np.asarray(new_data)
+        if new_data.shape != np.shape(parent.data):
+            print("error: the new data must have the same shape as the parent stack's data")
+            return
+        self.__dict__.update(parent.__dict__)
+        self.data = new_data
+        if self.dtype is not None: # the result keeps the type it was calculated in
+            self.dtype = new_data.dtype
+
     def is_empty(self):
         if self.data is None and self.datelist is None and self.projection is None and self.calendar is None and self.origin is None and self.conclusion is None and self.mbc is None and self.mbr is None:
             return True
@@ -170,6 +333,14 @@ class RasterStack(STFeatureStack):
 
         self.mbc = None
 
+        # append_STFeature grows these buffers, data and mbrlist are views on them
+        self.__buffer = None
+        self.__mbr_buffer = None
+
+        # the cells [layer, row, col] with at least one value that isn't NaN (see get_active_cells())
+        self.active_cells = None
+        self.__packed = None # (active_cells, packed stack) of the last pack_active_cells() call
+
         #self.rc = None # resolution consistent
         # not in use yet
         # are the cell_widths, and cell_heights between slices the same?
@@ -182,7 +353,9 @@ class RasterStack(STFeatureStack):
                         initx,
                         inity,
                         initcellwidth,
-                        initcellheight):
+                        initcellheight,
+                        initdtype=None,
+                        initcopy=True):
         """
         creates an STFeatureStack from the given input data (3d array).
         data must be space consistent in order to use this. It assumes all data
@@ -208,8 +381,19 @@ class RasterStack(STFeatureStack):
             the cell width
         initcellheight: float or int (must be negative!!)
             the cell height
+        initdtype: numpy dtype
+            the dtype policy (see set_dtype()). If None, the stack's policy is kept
+        initcopy: bool
+            if False, a numpy array of the stack's dtype is used as it is instead of
+            being copied, so the stack is a view on it (for example on shared memory)
         """
-        self.set_data(initdata)
+        if initdtype is not None:
+            self.set_dtype(initdtype)
+        if initcopy:
+            self.set_data(initdata)
+        else:
+            self.data = np.asarray(initdata, dtype=self.dtype)
+            self.__set_dimensions()
 
         self.sc = True
         #self.rc = True
@@ -227,11 +411,99 @@ class RasterStack(STFeatureStack):
         self.set_st_attributes()
 
     def set_data(self, new_data):
-        self.data = np.array(new_data)
-        self.nsteps = len(self.data)
-        self.nlayers = len(self.data[0])
-        self.nrows = len(self.data[0][0])
-        self.ncols = len(self.data[0][0][0])
+        self.data = np.array(new_data, dtype=self.dtype)
+        self.__set_dimensions()
+
+    def __set_dimensions(self):
+        # from the shape, so lazily read data (see create_lazy_stack()) isn't read
+        self.nsteps, self.nlayers, self.nrows, self.ncols = (int(n) for n in self.data.shape)
+        # the data changed, so the active cells have to be found again
+        self.active_cells = None
+        self.__packed = None
+
+    def create_stack_like(self, parent, new_data):
+        super().create_stack_like(parent, new_data)
+        # the active cells and the packed stack belong to the parent's data
+        self.active_cells = None
+        self.__packed = None
+        # and so do the append buffers, the result must not append into them
+        self.__buffer = None
+        self.__mbr_buffer = None
+
+    def get_active_cells(self):
+        """
+        returns the active cells of the stack, a boolean array [layer, row, col] that
+        is True for the cells with at least one value that isn't NaN. Cells outside
+        the active cells (sea, padding, no-data) are NaN at every timestep.
+        The active cells are found once and kept until the data changes.
+        """
+        if self.active_cells is None:
+            active_cells = np.zeros(self.data.shape[1:], dtype=bool)
+            start = 0
+            while start < self.nsteps: # a block of days at a time, to keep the temporaries small
+                stop = min(start + 256, self.nsteps)
+                active_cells |= ~np.all(np.isnan(self.data[start:stop]), axis=0)
+                start = stop
+            self.active_cells = active_cells
+        return self.active_cells
+
+    def pack_active_cells(self, active_cells):
+        """
+        returns a RasterStack of the given cells only, packed as a single row of cells
+        [timestep, 1, 1, n_active], so a calculation can skip every other cell.
+        The packed stack is kept, so packing again with the same active_cells array
+        (for example for KBDI and then FFDI) doesn't copy the data again.
+        See unpack_active_cells() for the way back.
+
+        parameters:
+        ------------
+        active_cells: numpy ndarray (bool)
+            the cells [layer, row, col] to keep (see get_active_cells())
+        returns:
+        ---------
+        out: RasterStack
+            the packed stack
+        """
+        if self.__packed is not None and self.__packed[0] is active_cells:
+            return self.__packed[1]
+        index = np.flatnonzero(active_cells)
+        packed_data = self.data.reshape(self.nsteps, -1)[:, index]
+        packed = RasterStack()
+        packed.create_sc_stack(packed_data.reshape(self.nsteps, 1, 1, len(index)),
+                               self.datelist,
+                               self.projection,
+                               self.calendar,
+                               0,
+                               0,
+                               1,
+                               -1,
+                               self.dtype)
+        self.__packed = (active_cells, packed)
+        return packed
+
+    def unpack_active_cells(self, active_cells, packed_data):
+        """
+        returns a RasterStack like this stack holding packed data (made with a stack
+        packed by pack_active_cells(active_cells)) scattered back to the grid.
+        Every cell that isn't active is NaN.
+
+        parameters:
+        ------------
+        active_cells: numpy ndarray (bool)
+            the cells [layer, row, col] the data was packed with
+        packed_data: numpy ndarray
+            the packed data [timestep, 1, 1, n_active]
+        returns:
+        ---------
+        out: RasterStack
+        """
+        packed_data = np.asarray(packed_data)
+        data = np.full(self.data.shape, np.nan, dtype=np.result_type(packed_data.dtype, np.float16))
+        data.reshape(self.nsteps, -1)[:, np.flatnonzero(active_cells)] = packed_data.reshape(self.nsteps, -1)
+        out = RasterStack()
+        out.create_stack_like(self, data)
+        out.active_cells = active_cells # the result can only have values in these cells
+        return out
 
 
     def create_stack_from_features(self, STFeatures):
@@ -248,16 +520,15 @@ class RasterStack(STFeatureStack):
         ---------
         None
         """
-        t = 0
-        sc = True # change to false if at any point NaN padding needs to happen
-        self.projection = STFeatures[t].projection
-        self.calendar = STFeatures[t].calendar
-        self.cell_width = STFeatures[t].cell_width
-        self.cell_height = STFeatures[t].cell_height
+        # first pass: check the features and gather the spatial and temporal attributes
+        self.projection = STFeatures[0].projection
+        self.calendar = STFeatures[0].calendar
+        self.cell_width = STFeatures[0].cell_width
+        self.cell_height = STFeatures[0].cell_height
         mbrlist = []
-        max_mbr = STFeatures[t].mbr
         datelist = []
-        
+        dtypes = []
+        t = 0
         while t < len(STFeatures):
             if t > 0: # ensure that the next feature to be appended has the same projection and calendar
                 if STFeatures[t].projection != self.projection or STFeatures[t].calendar != self.calendar:
@@ -265,50 +536,46 @@ class RasterStack(STFeatureStack):
                     print("error: not the same projection or calendar")
                     self.clear() # set all attributes to None
                     return
-            mbrlist.append(STFeatures[t].mbr)
-            if max_mbr != STFeatures[t].mbr and sc != False: # spatially inconsistent if mbrs don't match
-                sc = False
-            if STFeatures[t].mbr[0] < max_mbr[0]:
-                ulx = STFeatures[t].mbr[0]
-                max_mbr[0] = ulx
-            if STFeatures[t].mbr[1] > max_mbr[1]:
-                uly = STFeatures[t].mbr[1]
-                max_mbr[1] = uly
-            if STFeatures[t].mbr[2] > max_mbr[2]:
-                lrx = STFeatures[t].mbr[2]
-                max_mbr[2] = lrx
-            if STFeatures[t].mbr[3] < max_mbr[3]:
-                lry = STFeatures[t].mbr[3]
-                max_mbr[3] = lry
+            mbrlist.append(list(STFeatures[t].mbr))
             datelist.append(STFeatures[t].date)
+            dtypes.append(np.asarray(STFeatures[t].data).dtype)
             t+=1
         # now that the spatial and temporal attributes have been gathered,
         # now set the attributes of the STFeatureStack.
+        sc = mbrlist.count(mbrlist[0]) == len(mbrlist) # spatially inconsistent if mbrs don't match
         self.sc = sc
-        self.mbr = max_mbr
         self.set_all_attributes(mbrlist, datelist)
-        
-        # and now that the max_mbr is known, append data and pad
-        # if needed.
-        if sc == False:
-            new_data = self.__pad_data_to_mbr(STFeatures[0].data, STFeatures[0].cell_width, STFeatures[0].cell_height, STFeatures[0].mbr)
+
+        # second pass: now that the max mbr is known, allocate the final stack once
+        # and write every feature's data into its slot, padded with NaN if needed.
+        nlayers = len(STFeatures[0].data)
+        if not sc: # padding is done with NaN
+            dtypes.append(np.float64)
+        dtype = np.result_type(*dtypes) if self.dtype is None else self.dtype
+        if sc:
+            new_data = np.empty(shape=(len(STFeatures), nlayers, STFeatures[0].nrows, STFeatures[0].ncols), dtype=dtype)
         else:
-            new_data = np.array([STFeatures[0].data])
-        # iterate throught the features and append data while padding the raster if needed
-        t = 1
+            nrows, ncols = self.__shape_of_mbr(self.mbr)
+            new_data = np.full(shape=(len(STFeatures), nlayers, nrows, ncols), fill_value=np.nan, dtype=dtype)
+        t = 0
         while t < len(STFeatures):
-            if sc == False: # if space inconsistent, pad the rasters to the max mbr
-                padded_data = self.__pad_data_to_mbr(STFeatures[t].data, STFeatures[t].cell_width, STFeatures[t].cell_height, STFeatures[t].mbr)
-                new_data = np.append(new_data, padded_data, axis=0) # append the padded data to the new data stack
-            else:
-                new_data = np.append(new_data, [STFeatures[t].data], axis=0) # add a dimension to the feature_data
+            if sc:
+                new_data[t] = STFeatures[t].data
+            else: # if space inconsistent, place the raster at its offset in the max mbr
+                origin_row, origin_col = self.__offset_in_mbr(STFeatures[t].mbr, self.mbr)
+                new_data[t, :, origin_row: origin_row+STFeatures[t].nrows, origin_col: origin_col+STFeatures[t].ncols] = STFeatures[t].data
             STFeatures[t] = None # destroy the object
             t+=1
-        self.set_data(new_data)
+        self.data = new_data
+        self.__set_dimensions()
 
     def append_STFeature(self, new_STFeature):
         """
-        Appends a new STFeature Raster to the STFeatureStack
+        Appends a new STFeature Raster to the STFeatureStack.
+        The stack's data is a view on a larger buffer that has spare timesteps
+        (its capacity doubles whenever it is full), so appending a feature only
+        costs the size of that feature. The data already in the stack is only
+        re-padded when the new feature falls outside the stack's mbr.
 
         parameters:
         ------------
@@ -319,17 +586,25 @@ class RasterStack(STFeatureStack):
         ---------
         None
         """
-        if type(new_STFeature) != feature.Raster:
+        if type(new_STFeature) != Raster:
             print("error: cannot append a Vector STFeature to a Raster STFeature")
             return
         if self.is_empty():
-            self.set_data(new_STFeature.data)
+            self.set_projection(new_STFeature.projection)
+            self.set_calendar(new_STFeature.calendar)
+            self.cell_width = new_STFeature.cell_width
+            self.cell_height = new_STFeature.cell_height
+            self.set_data([new_STFeature.data])
+            self.sc = True
             self.set_all_attributes([new_STFeature.mbr], [new_STFeature.date])
         elif new_STFeature.projection != self.projection or new_STFeature.calendar != self.calendar:
             print("error: not the same projection or calendar")
             return
         elif new_STFeature.cell_width != self.cell_width or new_STFeature.cell_height != self.cell_height:
-            print("error: feature does not have the same cell resolution as the stack")
+            print("error: feature does not have the same cell resolution as the stack (see Regridder to resample it)")
+            return
+        elif len(new_STFeature.data) != self.nlayers:
+            print("error: feature does not have the same number of layers as the stack")
             return
         else:
             self.__append_data(new_STFeature) # pads data if needed
@@ -339,7 +614,7 @@ class RasterStack(STFeatureStack):
 
     def __append_data(self, new_feature):
         """
-        append the new_feature to the this STFeatureStack. Pad the stack data or the
+        append the new_feature's data to the this STFeatureStack. Pad the stack data or the
         new_feature's data if neccessary.
 
         parameters:
@@ -350,50 +625,423 @@ class RasterStack(STFeatureStack):
         ---------
         None
         """
+        max_mbr = [min(new_feature.mbr[0], self.mbr[0]),
+                   max(new_feature.mbr[1], self.mbr[1]),
+                   max(new_feature.mbr[2], self.mbr[2]),
+                   min(new_feature.mbr[3], self.mbr[3])]
+        grow = max_mbr != list(self.mbr) # the feature falls (partly) outside the stack
+        pad = max_mbr != list(new_feature.mbr) # the feature doesn't fill the stack
+        dtype = np.result_type(self.data.dtype, np.asarray(new_feature.data).dtype)
+        if grow or pad: # padding is done with NaN
+            dtype = np.result_type(dtype, np.float64)
+        if self.dtype is not None:
+            dtype = self.dtype
+
+        owns_buffer = self.__buffer is not None and self.data.base is self.__buffer
+        if not owns_buffer or self.nsteps == len(self.__buffer):
+            self.__reallocate(2 * self.nsteps, max_mbr, dtype)
+        elif grow or dtype != self.data.dtype:
+            self.__reallocate(len(self.__buffer), max_mbr, dtype)
+
+        # write the new feature into the next free timestep of the buffer
+        slot = self.__buffer[self.nsteps]
+        if pad:
+            slot.fill(np.nan)
+        origin_row, origin_col = self.__offset_in_mbr(new_feature.mbr, max_mbr)
+        slot[:, origin_row: origin_row+new_feature.nrows, origin_col: origin_col+new_feature.ncols] = new_feature.data
+        self.data = self.__buffer[:self.nsteps+1]
+        self.__set_dimensions()
+
+    def __reallocate(self, capacity, new_mbr, new_dtype):
+        """
+        moves the stack's data into a new buffer that can hold capacity timesteps
+        and covers new_mbr. If new_mbr is larger than the stack's mbr the data
+        is padded with NaN.
+        """
+        nrows, ncols = self.__shape_of_mbr(new_mbr)
+        new_buffer = np.empty((capacity, self.nlayers, nrows, ncols), dtype=new_dtype)
+        if nrows != self.nrows or ncols != self.ncols:
+            new_buffer[:self.nsteps].fill(np.nan)
+        origin_row, origin_col = self.__offset_in_mbr(self.mbr, new_mbr)
+        new_buffer[:self.nsteps, :, origin_row: origin_row+self.nrows, origin_col: origin_col+self.ncols] = self.data
+        self.__buffer = new_buffer
+        self.data = new_buffer[:self.nsteps]
+        self.__set_dimensions()
+
+    def __shape_of_mbr(self, mbr):
+        """
+        returns the number of rows and cols of a raster with the stack's cell size
+        covering the mbr
+        """
+        nrows = int(abs((mbr[1] - mbr[3] + abs(self.cell_height)) / self.cell_height))
+        ncols = int((mbr[2] - mbr[0] + self.cell_width) / self.cell_width)
+        return nrows, ncols
 
-        # check to see if this feature is all together smaller than or equal in extent to 
-        # the underlying stack data. If so, only the feature being appended needs to be padded
-        # otherwise, need to pad all data in the stack to the new mbr
-        if new_feature.mbr[0] >= self.mbr[0] and new_feature.mbr[1] <= self.mbr[1] and new_feature.mbr[2]  <= self.mbr[2] and new_feature.mbr[3] >= self.mbr[3]:
-            # pad feature data to the stack mbr
-            new_data = self.__pad_data_to_mbr(new_feature.data, new_feature.cell_width, new_feature.cell_height, new_feature.mbr)
-            new_data_stack = self.data
-            # finally, append the new_feature's data
-            new_data_stack = np.append(new_data_stack, new_data)
-        else:
-            new_data_stack = self.__pad_data_to_mbr(self.data[0], self.cell_width, self.cell_height, new_feature.mbr)
-            # pad stack data to the new maximum mbr given the new_feature mbr and the stack's mbr
-            t = 1
+    def __offset_in_mbr(self, inner_mbr, outer_mbr):
+        """
+        returns the row and col in a raster covering outer_mbr where
+        the upper left cell of inner_mbr is
+        """
+        origin_row = int(abs((outer_mbr[1] - inner_mbr[1]) / self.cell_height))
+        origin_col = int((inner_mbr[0] - outer_mbr[0]) / self.cell_width)
+        return origin_row, origin_col
+
+    def append_mbr(self, new_feature):
+        """
+        appends the new_feature's mbr to the mbrlist and grows the stack's mbr
+        to cover it. Like the data, the mbrlist is a view on a buffer with spare
+        rows, so this doesn't copy the whole mbrlist.
+        """
+        if self.mbrlist is None: # stacks made with create_sc_stack don't have an mbrlist
+            self.mbrlist = np.array([self.mbr] * (len(self.datelist) - 1))
+        n = len(self.mbrlist)
+        if self.__mbr_buffer is None or self.mbrlist.base is not self.__mbr_buffer or n == len(self.__mbr_buffer):
+            new_dtype = np.result_type(self.mbrlist.dtype, np.asarray(new_feature.mbr).dtype)
+            self.__mbr_buffer = np.empty((2 * n, 4), dtype=new_dtype)
+            self.__mbr_buffer[:n] = self.mbrlist
+        self.__mbr_buffer[n] = new_feature.mbr
+        self.mbrlist = self.__mbr_buffer[:n+1]
+        if not np.array_equal(self.mbrlist[0], self.mbrlist[n]): # not space consistent
+            self.sc = False
+        self.mbr = [min(new_feature.mbr[0], self.mbr[0]),
+                    max(new_feature.mbr[1], self.mbr[1]),
+                    max(new_feature.mbr[2], self.mbr[2]),
+                    min(new_feature.mbr[3], self.mbr[3])]
+
+    def create_memmap_stack(self,
+                            filename,
+                            initshape,
+                            initdatelist,
+                            initprojection,
+                            initcalendar,
+                            initx,
+                            inity,
+                            initcellwidth,
+                            initcellheight,
+                            initdtype=np.float64):
+        """
+        creates a space consistent RasterStack whose data is a memory-mapped file
+        instead of an in-memory array, so the stack can be larger than RAM. The data
+        starts as zeros and is written to the file as it is set (see flush()).
+        Like create_sc_stack(), but with the shape of the data instead of the data.
+
+        The file is a header (a json dict with the dates, mbr, cell size, dtype, ...)
+        followed by the raw C-contiguous data block. It can be opened again with
+        open_memmap_stack().
+
+        parameters:
+        ------------
+        filename: str
+            the full path and filename of the file to create. An existing file is overwritten
+        initshape: tuple
+            the shape of the data [timestep, layer, row, col]
+        initdatelist: list
+            list of datetime.datetime objects, one per timestep
+        initprojection: string
+            projection
+        initcalendar: string
+            calendar
+        initx: float or int
+            the upper left x coordinate of the RasterStack
+        inity: float or int
+            the upper left y coordinate of the RasterStack
+        initcellwidth: float or int
+            the cell width
+        initcellheight: float or int (must be negative!!)
+            the cell height
+        initdtype: numpy dtype
+            the type of the data
+        returns:
+        ---------
+        None
+        """
+        initshape = tuple(int(n) for n in initshape)
+        if len(initshape) != 4 or initshape[0] != len(initdatelist):
+            print("error: the shape must be [timestep, layer, row, col] with one timestep per date")
+            return
+        mbr = [initx, inity, initx + (initshape[3] * initcellwidth) - initcellwidth, inity + (initshape[2] * initcellheight) + abs(initcellheight)]
+        header = self.__memmap_header(initshape, np.dtype(initdtype), initdatelist, initprojection, initcalendar, initx, inity, initcellwidth, initcellheight, mbr, None, True)
+        with open(filename, "wb") as f:
+            offset = self.__write_memmap_header(f, header)
+            f.truncate(offset + int(np.prod(initshape)) * np.dtype(initdtype).itemsize) # the data block reads as zeros
+        self.open_memmap_stack(filename, mode="r+")
+
+    def open_memmap_stack(self, filename, mode="r"):
+        """
+        opens a RasterStack file written by create_memmap_stack() or save_memmap().
+        The data is memory-mapped, only the parts of it that are used are read from disk.
+
+        parameters:
+        ------------
+        filename: str
+            the full path and filename of the RasterStack file
+        mode: str
+            "r" to open the data read only, "r+" to be able to write into it,
+            "c" for copy-on-write (changes stay in memory)
+        returns:
+        ---------
+        None
+        """
+        with open(filename, "rb") as f:
+            if f.read(len(MEMMAP_MAGIC)) != MEMMAP_MAGIC:
+                print("error: " + str(filename) + " is not a RasterStack file")
+                return
+            header_length = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+            header = json.loads(f.read(header_length).decode("utf-8"))
+            offset = f.tell()
+        self.clear()
+        self.data = np.memmap(filename, dtype=np.dtype(header["dtype"]), mode=mode, offset=offset, shape=tuple(header["shape"]))
+        self.__set_dimensions()
+        self.set_projection(header["projection"])
+        self.set_calendar(header["calendar"])
+        self.x = header["x"]
+        self.y = header["y"]
+        self.cell_width = header["cell_width"]
+        self.cell_height = header["cell_height"]
+        self.sc = header["sc"]
+        self.mbr = header["mbr"]
+        if header["mbrlist"] is not None:
+            self.mbrlist = np.array(header["mbrlist"])
+        self.set_time_attributes([datetime.datetime.fromisoformat(date) for date in header["datelist"]])
+        self.set_st_attributes()
+
+    def save_memmap(self, filename):
+        """
+        writes the stack to a RasterStack file that can be opened with open_memmap_stack().
+        The data is written one timestep at a time, so it is never copied as a whole.
+
+        parameters:
+        ------------
+        filename: str
+            the full path and filename of the file to write. An existing file is overwritten
+        returns:
+        ---------
+        None
+        """
+        mbrlist = None
+        if self.mbrlist is not None:
+            mbrlist = np.asarray(self.mbrlist, dtype=float).tolist()
+        header = self.__memmap_header(self.data.shape, self.data.dtype, self.datelist, self.projection, self.calendar, self.x, self.y, self.cell_width, self.cell_height, self.mbr, mbrlist, self.sc)
+        with open(filename, "wb") as f:
+            self.__write_memmap_header(f, header)
+            t = 0
             while t < len(self.data):
-                new_data = self.__pad_data_to_mbr(self.data[t], self.cell_width, self.cell_height, new_feature.mbr)
-                new_data_stack = np.append(new_data_stack, new_data, axis=0)
+                f.write(np.ascontiguousarray(self.data[t]).tobytes())
                 t+=1
-            # finally, append the new_feature's data
-            feature_data = self.__pad_data_to_mbr(new_feature.data, new_feature.cell_width, new_feature.cell_height, new_feature.mbr)
-            new_data_stack = np.append(new_data_stack, feature_data, axis=0)
-        # finish by setting the stack's data
-        self.set_data(new_data_stack)
 
-    def __pad_data_to_mbr(self, input_data, input_cell_width, input_cell_height, input_mbr):
+    def flush(self):
+        """
+        writes any changes to the data of a memory-mapped stack to disk
+        """
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+    def create_lazy_stack(self,
+                          initdata,
+                          initdatelist,
+                          initprojection,
+                          initcalendar,
+                          initx,
+                          inity,
+                          initcellwidth,
+                          initcellheight):
+        """
+        creates a space consistent RasterStack whose data is read lazily, for example
+        a variable of a NetCDF file (see utilities.netcdf.load_netcdf()).
+        Like create_sc_stack(), but the data is kept as it is: nothing is read until
+        a part of it is used. sel_time(), sel_bbox() and get_time_chunks() return
+        stacks that are still lazy, load() reads the data into memory.
+
+        parameters:
+        ------------
+        initdata: array-like
+            the data [timestep, layer, row, col]. It must have a shape and a dtype,
+            support numpy basic slicing (slicing with slices gives array-like data
+            again, an integer index reads) and be readable with numpy.asarray()
+        initdatelist: list
+            list of datetime.datetime objects, one per timestep
+        initprojection: string
+            projection
+        initcalendar: string
+            calendar
+        initx: float or int
+            the upper left x coordinate of the RasterStack
+        inity: float or int
+            the upper left y coordinate of the RasterStack
+        initcellwidth: float or int
+            the cell width
+        initcellheight: float or int (must be negative!!)
+            the cell height
+        returns:
+        ---------
+        None
+        """
+        if len(initdata.shape) != 4 or initdata.shape[0] != len(initdatelist):
+            print("error: the data must be [timestep, layer, row, col] with one timestep per date")
+            return
+        self.clear()
+        self.data = initdata
+        self.__set_dimensions()
+        self.sc = True
+        self.set_projection(initprojection)
+        self.set_calendar(initcalendar)
+        self.x = initx
+        self.y = inity
+        self.cell_width = initcellwidth
+        self.cell_height = initcellheight
+        self.mbr = [self.x, self.y, self.x + (self.ncols * self.cell_width) - self.cell_width, self.y + (self.nrows * self.cell_height) + abs(self.cell_height)]
+        self.set_time_attributes(initdatelist)
+        self.set_st_attributes()
+
+    def is_lazy(self):
+        """
+        returns True if the data is read lazily (see create_lazy_stack())
+        """
+        return self.data is not None and not isinstance(self.data, np.ndarray)
+
+    def load(self):
+        """
+        reads lazily read data (see create_lazy_stack()) into memory. The calculations
+        need the data in memory, so a large lazy stack is best calculated a time
+        chunk at a time (see get_time_chunks() and indices.StreamingKBDIFFDI)
+        """
+        if self.is_lazy():
+            self.set_data(self.data)
+
+    def __memmap_header(self, shape, dtype, datelist, projection, calendar, x, y, cell_width, cell_height, mbr, mbrlist, sc):
+        """
+        returns the header of a RasterStack file as a dict that can be written as json
+        """
+        return {"shape": [int(n) for n in shape],
+                "dtype": np.dtype(dtype).str,
+                "datelist": [date.isoformat() for date in datelist],
+                "projection": projection,
+                "calendar": calendar,
+                "x": None if x is None else float(x),
+                "y": None if y is None else float(y),
+                "cell_width": float(cell_width),
+                "cell_height": float(cell_height),
+                "mbr": [float(value) for value in mbr],
+                "mbrlist": mbrlist,
+                "sc": bool(sc)}
+
+    def __write_memmap_header(self, f, header):
+        """
+        writes the magic bytes, the header length and the json header to the open file f.
+        The header is padded so the data block starts on a 64 byte boundary.
+        Returns the offset of the data block
+        """
+        header_bytes = json.dumps(header).encode("utf-8")
+        offset = len(MEMMAP_MAGIC) + 8 + len(header_bytes)
+        header_bytes += b" " * (-offset % 64)
+        f.write(MEMMAP_MAGIC)
+        f.write(np.array([len(header_bytes)], dtype="<u8").tobytes())
+        f.write(header_bytes)
+        return f.tell()
+
+    def get_time_chunks(self, ndays):
+        """
+        a generator that yields the stack in consecutive time chunks of ndays timesteps.
+        Every chunk is a view on this stack's data (see sel_time()), for a
+        memory-mapped stack nothing is read until the chunk's data is used.
+
+        parameters:
+        ------------
+        ndays: int
+            the number of timesteps per chunk (the last chunk may be shorter)
+        yields:
+        ---------
+        chunk: RasterStack
         """
-        When padding data, always pad to the maximum of the two input mbrs.
+        start = 0
+        while start < self.nsteps:
+            stop = min(start + ndays, self.nsteps)
+            yield self.__view(slice(start, stop), slice(None), slice(None))
+            start = stop
+
+    def sel_time(self, start=None, end=None):
         """
-        ulx = min(input_mbr[0], self.mbr[0])
-        uly = max(input_mbr[1], self.mbr[1])
-        lrx = max(input_mbr[2], self.mbr[2])
-        lry = min(input_mbr[3], self.mbr[3])
-        max_mbr = [ulx, uly, lrx, lry]
+        returns the timesteps from start to end (both included) as a RasterStack
+        whose data is a view on this stack's data, nothing is copied.
+        The datelist must be sorted.
 
-        target_nrows = int(abs((max_mbr[1] - max_mbr[3] + abs(input_cell_height)) / input_cell_height))
-        target_ncols = int((max_mbr[2] - max_mbr[0] + input_cell_width) / input_cell_width)
+        parameters:
+        ------------
+        start: datetime.datetime, datetime.date, numpy datetime64 or str ("YYYY-MM-DD")
+            the first date. If None, from the first timestep
+        end: datetime.datetime, datetime.date, numpy datetime64 or str ("YYYY-MM-DD")
+            the last date. If None, up to the last timestep
+        returns:
+        ---------
+        out: RasterStack
+            the selection, or None if no timestep is in the range
+        """
+        time_slice = self.get_time_slice(start, end)
+        if time_slice.start == time_slice.stop:
+            print("error: no timesteps between " + str(start) + " and " + str(end))
+            return None
+        return self.__view(time_slice, slice(None), slice(None))
 
-        new_data = np.zeros((len(input_data), target_nrows, target_ncols))
-        new_data.fill(np.nan)
+    def sel_bbox(self, ulx, uly, lrx, lry):
+        """
+        returns the cells inside the bounding box as a RasterStack whose data
+        is a view on this stack's data, nothing is copied. Like the mbr, the
+        bounding box is given by the upper left corners of its corner cells:
+        a cell is selected if its upper left corner is inside the box.
 
-        origin_row = int(abs((max_mbr[1] - input_mbr[1]) / input_cell_height))
-        origin_col = int((input_mbr[0] - max_mbr[0]) / input_cell_width)
-        new_data[:, origin_row: origin_row+len(input_data[0]), origin_col: origin_col+len(input_data[0][0])] = input_data
-        return np.array([new_data])
+        parameters:
+        ------------
+        ulx, uly: float or int
+            the upper left x and y coordinate of the bounding box
+        lrx, lry: float or int
+            the lower right x and y coordinate of the bounding box
+        returns:
+        ---------
+        out: RasterStack
+            the selection with its mbr set to the selected cells,
+            or None if no cell is inside the box
+        """
+        # the small tolerance keeps a coordinate right on a cell corner from being lost to rounding
+        first_col = max(int(np.ceil((ulx - self.mbr[0]) / self.cell_width - 1e-9)), 0)
+        last_col = min(int(np.floor((lrx - self.mbr[0]) / self.cell_width + 1e-9)), self.ncols - 1)
+        first_row = max(int(np.ceil((self.mbr[1] - uly) / abs(self.cell_height) - 1e-9)), 0)
+        last_row = min(int(np.floor((self.mbr[1] - lry) / abs(self.cell_height) + 1e-9)), self.nrows - 1)
+        if first_col > last_col or first_row > last_row:
+            print("error: no cells inside the bounding box")
+            return None
+        return self.__view(slice(None), slice(first_row, last_row + 1), slice(first_col, last_col + 1))
+
+    def __view(self, time_slice, row_slice, col_slice):
+        """
+        returns a RasterStack of the given timesteps, rows and cols whose data is a view
+        on this stack's data. The datelist, mbr, mbrlist, origin, ... are recomputed,
+        every other attribute is shared with this stack.
+        """
+        view = RasterStack()
+        view.__dict__.update(self.__dict__)
+        view.__buffer = None # the view must not append into this stack's buffer
+        view.__mbr_buffer = None
+        view.data = self.data[time_slice, :, row_slice, col_slice]
+        view.__set_dimensions()
+        first_row, _, _ = row_slice.indices(self.nrows)
+        first_col, _, _ = col_slice.indices(self.ncols)
+        if view.nrows != self.nrows or view.ncols != self.ncols:
+            ulx = self.mbr[0] + first_col * self.cell_width
+            uly = self.mbr[1] + first_row * self.cell_height
+            view.mbr = [ulx, uly, ulx + (view.ncols * self.cell_width) - self.cell_width, uly + (view.nrows * self.cell_height) + abs(self.cell_height)]
+            view.x = ulx
+            view.y = uly
+        if self.mbrlist is not None:
+            mbrlist = np.array(self.mbrlist[time_slice], dtype=float)
+            # clip the mbr of every timestep to the view
+            mbrlist[:,0] = np.maximum(mbrlist[:,0], view.mbr[0])
+            mbrlist[:,1] = np.minimum(mbrlist[:,1], view.mbr[1])
+            mbrlist[:,2] = np.minimum(mbrlist[:,2], view.mbr[2])
+            mbrlist[:,3] = np.maximum(mbrlist[:,3], view.mbr[3])
+            view.mbrlist = mbrlist
+        view.set_time_attributes(self.datelist[time_slice], self.get_datetime64()[time_slice])
+        view.set_st_attributes()
+        return view
 
     def clear(self):
         self.data = None
@@ -415,21 +1063,272 @@ class RasterStack(STFeatureStack):
         self.cell_height = None
         self.ncols = None
         self.nrows = None
+        self.dtype = None
+        self.__buffer = None
+        self.__mbr_buffer = None
 
 
 class VectorStack(STFeatureStack):
 
     def __init__(self):
+        """
+        a columnar stack of point stations: one array of station coordinates and
+        one [timestep, station] data block, so every station is calculated in
+        the same vectorized pass.
+
+        attributes of a VectorStack (besides those of an STFeatureStack):
+        -------------------------------------------------------------------
+        geoms: numpy ndarray
+            the [x, y] coordinates of every station, shape [station, 2]
+        names: list
+            the name of every station (or None)
+        nsteps: int
+            the number of timesteps
+        nstations: int
+            the number of stations
+        """
         super().__init__()
 
         self.geoms = None
+        self.names = None
+
+        self.nsteps = None
+        self.nstations = None
 
     """
-    methods for populating the RasterStack's attributes
+    methods for populating the VectorStack's attributes
     """
 
+    def create_stack(self,
+                     initdata,
+                     initdatelist,
+                     initprojection,
+                     initcalendar,
+                     initgeoms,
+                     initnames=None,
+                     initdtype=None):
+        """
+        creates a VectorStack from a [timestep, station] data block
+
+        parameters:
+        ------------
+        initdata: list or numpy ndarray
+            the input data. Must be a 2d array [timestep, station]
+        initdatelist: list or numpy ndarray
+            list of datetime.datetime objects (or a datetime64 array), one per timestep
+        initprojection: string
+            projection
+        initcalendar: string
+            calendar
+        initgeoms: list or numpy ndarray
+            the [x, y] coordinates of every station
+        initnames: list
+            the name of every station
+        initdtype: numpy dtype
+            the dtype policy (see set_dtype()). If None, the stack's policy is kept
+        returns:
+        ---------
+        None
+        """
+        if initdtype is not None:
+            self.set_dtype(initdtype)
+        initdata = np.asarray(initdata)
+        initgeoms = np.asarray(initgeoms, dtype=float).reshape(-1, 2)
+        if initdata.ndim != 2 or len(initdata) != len(initdatelist) or initdata.shape[1] != len(initgeoms):
+            print("error: the data must be [timestep, station] with one timestep per date and one geometry per station")
+            return
+        if initnames is not None and len(initnames) != len(initgeoms):
+            print("error: there must be one name per station")
+            return
+        self.set_data(initdata)
+        self.sc = True
+        self.set_projection(initprojection)
+        self.set_calendar(initcalendar)
+        self.geoms = initgeoms
+        self.names = None if initnames is None else list(initnames)
+        self.mbr = [np.min(initgeoms[:,0]), np.max(initgeoms[:,1]), np.max(initgeoms[:,0]), np.min(initgeoms[:,1])]
+        self.set_time_attributes(initdatelist)
+        self.set_st_attributes()
+
+    def create_stack_from_features(self, STFeatures):
+        """
+        creates a VectorStack from a list of point Vector STFeatures. Every distinct
+        date becomes a timestep and every distinct point becomes a station. A station
+        without a feature at a date is NaN. Each feature holds one value.
+
+        parameters:
+        ------------
+        STFeatures: list
+            point Vector STFeatures, all with the same projection and calendar
+        returns:
+        ---------
+        None
+        """
+        for vector in STFeatures:
+            if type(vector) != Vector or vector.geom["type"] != "Point":
+                print("error: a VectorStack can only be made from point Vector STFeatures")
+                return
+            if vector.projection != STFeatures[0].projection or vector.calendar != STFeatures[0].calendar:
+                print("error: not the same projection or calendar")
+                return
+        ordinals = np.array([vector.date.toordinal() for vector in STFeatures], dtype=np.int64)
+        points = np.array([vector.geom["coordinates"][:2] for vector in STFeatures], dtype=float)
+        days, t = np.unique(ordinals, return_inverse=True)
+        geoms, station = np.unique(points, axis=0, return_inverse=True)
+        data = np.full((len(days), len(geoms)), np.nan)
+        data[t.ravel(), station.ravel()] = [np.ravel(vector.data)[0] for vector in STFeatures]
+        # 719163 is the ordinal of 1970-01-01
+        self.create_stack(data, (days - 719163).astype("datetime64[D]"), STFeatures[0].projection, STFeatures[0].calendar, geoms)
+
+    def set_data(self, new_data):
+        self.data = np.asarray(new_data, dtype=self.dtype)
+        self.nsteps = len(self.data)
+        self.nstations = self.data.shape[1]
+
+    def get_station_index(self, name):
+        """
+        returns the index of the station with the given name, or None
+        """
+        if self.names is None or name not in self.names:
+            print("error: no station named " + str(name))
+            return None
+        return self.names.index(name)
+
+    def as_raster_stack(self):
+        """
+        returns the stations as a RasterStack with a single row of cells (one cell
+        per station), so they can go through the raster calculations at once.
+        See create_stack_from_raster() for the way back.
+        """
+        raster = RasterStack()
+        raster.create_sc_stack(self.data.reshape(self.nsteps, 1, 1, self.nstations),
+                               self.datelist,
+                               self.projection,
+                               self.calendar,
+                               0,
+                               0,
+                               1,
+                               -1,
+                               self.dtype)
+        return raster
+
+    def create_stack_from_raster(self, parent, raster_data):
+        """
+        makes this stack a VectorStack of the parent's stations holding the data of a
+        RasterStack made by parent.as_raster_stack() (for example the result of a calculation).
+        The attributes are shared with the parent, see create_stack_like()
+
+        parameters:
+        ------------
+        parent: VectorStack
+            the stack the raster was made from
+        raster_data: numpy ndarray
+            data with a single row of cells, one cell per station
+        returns:
+        ---------
+        None
+        """
+        self.create_stack_like(parent, np.reshape(raster_data, (parent.nsteps, parent.nstations)))
+
+    def clear(self):
+        self.data = None
+        self.datelist = None
+        self.projection = None
+        self.calendar = None
+        self.sc = None
+        self.tc = None
+        self.mbr = None
+        self.mbrlist = None
+        self.start = None 
+        self.end = None 
+        self.origin = None
+        self.conclusion = None
+        self.mbc = None
+        self.geoms = None
+        self.names = None
+        self.nsteps = None
+        self.nstations = None
+        self.dtype = None
+
+class FeatureMetadata:
+
+    __slots__ = ("projection", "calendar", "cell_width", "cell_height", "__weakref__")
+
+    # every distinct record in use, so features with the same metadata share one object.
+    # A record is dropped when the last feature using it is gone
+    records = weakref.WeakValueDictionary()
+
+    def __init__(self,
+                 initprojection = None,
+                 initcalendar = "standard",
+                 initcellwidth = None,
+                 initcellheight = None):
+        """
+        the projection, calendar and cell size of an STFeature. A record is shared by every
+        feature with the same metadata (see shared()), so it must not be changed: the
+        set_ methods of the features give them a different record instead.
+
+        attributes of a FeatureMetadata:
+        --------------------------------
+        projection: string
+            well known text representation of projection
+        calendar: string
+            the calendar the feature's date references
+        cell_width: float or int
+            the cell width (None for a Vector)
+        cell_height: float or int
+            the cell height (None for a Vector)
+        """
+        self.projection = initprojection
+        self.calendar = initcalendar
+        self.cell_width = initcellwidth
+        self.cell_height = initcellheight
+
+    @classmethod
+    def shared(cls, projection=None, calendar="standard", cell_width=None, cell_height=None):
+        """
+        returns the shared record with the given metadata, it is made on first use
+        """
+        key = (projection, calendar, cell_width, cell_height)
+        record = cls.records.get(key)
+        if record is None:
+            record = cls(projection, calendar, cell_width, cell_height)
+            cls.records[key] = record
+        return record
+
+    def replace(self, **changes):
+        """
+        returns the shared record with this record's metadata and the given changes
+        """
+        values = {"projection": self.projection, "calendar": self.calendar, "cell_width": self.cell_width, "cell_height": self.cell_height}
+        values.update(changes)
+        return FeatureMetadata.shared(**values)
+
+    def __copy__(self):
+        return self # records are never changed, so copies can share them
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self): # unpickle to the shared record
+        return (FeatureMetadata.shared, (self.projection, self.calendar, self.cell_width, self.cell_height))
+
+    def __str__(self):
+        return(str(type(self)) + " "
+               + "projection: " + str(self.projection) + " "
+               + "calendar: " + str(self.calendar) + " "
+               + "cell size: " + str((self.cell_width, self.cell_height)))
+
+    def __repr__(self):
+        return self.__str__()
+
 class STFeature:
 
+    # slots keep the per feature overhead small, the projection and calendar
+    # live in a shared FeatureMetadata. The __dict__ is only made when an
+    # attribute other than these is set on a feature
+    __slots__ = ("data", "z_info", "date", "metadata", "description", "__dict__")
+
     def __init__(self,
                  initdata,
                  initzinfo,
@@ -450,12 +1349,25 @@ class STFeature:
         self.z_info = initzinfo
         self.date = initdate
 
-        self.projection = initprojection
-        self.calendar = initcalendar
+        self.metadata = FeatureMetadata.shared(initprojection, initcalendar)
 
         self.description = initdescription
 
-        self.mbr = None
+    @property
+    def projection(self):
+        return self.metadata.projection
+
+    @projection.setter
+    def projection(self, new_projection):
+        self.set_projection(new_projection)
+
+    @property
+    def calendar(self):
+        return self.metadata.calendar
+
+    @calendar.setter
+    def calendar(self, new_calendar):
+        self.set_calendar(new_calendar)
 
     def set_data(self, new_data):
         self.data = new_data
@@ -467,10 +1379,10 @@ class STFeature:
         self.date = new_date
 
     def set_projection(self, new_projection):
-        self.projection = new_projection
+        self.metadata = self.metadata.replace(projection=new_projection)
 
     def set_calendar(self, new_calendar):
-        self.calendar = new_calendar
+        self.metadata = self.metadata.replace(calendar=new_calendar)
 
     def set_description(self, new_description):
         self.description = new_description
@@ -485,8 +1397,20 @@ class STFeature:
     def duplicate_feature(self):
         return copy.deepcopy(self)
 
+    def shallow_duplicate(self):
+        """
+        returns a copy of the feature that shares its data (and metadata record) with this
+        feature. The z_info is copied, so it can be changed on either feature
+        """
+        duplicate = copy.copy(self)
+        if isinstance(self.z_info, dict):
+            duplicate.z_info = dict(self.z_info)
+        return duplicate
+
 class Raster(STFeature):
 
+    __slots__ = ("x", "y", "nlayers", "nrows", "ncols")
+
     def __init__(self,
                  initdata,
                  initzinfo,
@@ -508,17 +1432,43 @@ class Raster(STFeature):
         self.y = inity
 
         # spatial coordinate info
-        self.cell_width = initcellwidth
-        self.cell_height = initcellheight
+        self.metadata = self.metadata.replace(cell_width=initcellwidth, cell_height=initcellheight)
         
         self.nlayers = len(self.data)
         self.nrows = len(self.data[0]) # the number of pixels in the y direction
         self.ncols = len(self.data[0][0]) # the number of pixels in the x direction
 
-        self.set_mbr()
-
-    def set_mbr(self):
-        self.mbr = [self.x, self.y, self.x + (self.ncols * self.cell_width) - self.cell_width, self.y + (self.nrows * self.cell_height) + abs(self.cell_height)]
+    @property
+    def cell_width(self):
+        return self.metadata.cell_width
+
+    @cell_width.setter
+    def cell_width(self, new_cell_width):
+        self.metadata = self.metadata.replace(cell_width=new_cell_width)
+
+    @property
+    def cell_height(self):
+        return self.metadata.cell_height
+
+    @cell_height.setter
+    def cell_height(self, new_cell_height):
+        self.metadata = self.metadata.replace(cell_height=new_cell_height)
+
+    @property
+    def mbr(self):
+        # computed from the position and shape rather than stored, to keep the feature small
+        return [self.x, self.y, self.x + (self.ncols * self.cell_width) - self.cell_width, self.y + (self.nrows * self.cell_height) + abs(self.cell_height)]
+
+    @mbr.setter
+    def mbr(self, new_mbr):
+        # the lower right corner follows from the upper left corner, the cell size and the shape
+        lrx = new_mbr[0] + (self.ncols * self.cell_width) - self.cell_width
+        lry = new_mbr[1] + (self.nrows * self.cell_height) + abs(self.cell_height)
+        if not np.allclose([new_mbr[2], new_mbr[3]], [lrx, lry]):
+            print("error: the mbr " + str(new_mbr) + " does not fit the cell size and shape of the raster, the lower right corner must be " + str([lrx, lry]))
+            return
+        self.x = new_mbr[0]
+        self.y = new_mbr[1]
 
     def set_data(self, new_data):
         self.data = new_data
@@ -565,6 +1515,8 @@ class Raster(STFeature):
 
 class Vector(STFeature):
 
+    __slots__ = ("geom", "mbr")
+
     def __init__(self,
                  initdata,
                  initzinfo,
@@ -574,6 +1526,7 @@ class Vector(STFeature):
                  initdescription,
                  initgeom):
         super().__init__(initdata,
+                         initzinfo,
                          initdate,
                          initprojection,
                          initcalendar,
@@ -0,0 +1,231 @@
+import numpy as np
+
+from kbdiffdi.features import feature
+
+class Regridder(object):
+
+    def __init__(self, initmethod="average"):
+        """
+        Resamples RasterStacks to a common grid and time axis.
+        The grids are axis aligned, so the weights are separable: every target row is
+        a weighted sum of a few source rows and every target col a weighted sum of a few
+        source cols. The weights of a source/target grid pair are computed once and cached,
+        then all timesteps and layers are resampled with a handful of vectorized gathers.
+        NaN cells are left out and the weights of the remaining cells are renormalised,
+        a target cell without any valid source cell is NaN.
+
+        attributes:
+        -----------
+        method: string
+            "average": the area weighted average of the source cells overlapping a
+                       target cell (block average when coarsening by a whole factor)
+            "nearest": the source cell under the centre of the target cell
+            "bilinear": bilinear interpolation between the centres of the 4 nearest source cells
+        weights: dict
+            the cached weights, {(method, source grid, target grid): (row weights, col weights)}
+        """
+        self.method = None
+        self.weights = {}
+        self.set_method(initmethod)
+
+    def set_method(self, newmethod):
+        if newmethod not in ("average", "nearest", "bilinear"):
+            print("error: unknown regrid method " + str(newmethod) + ", use average, nearest or bilinear")
+            return
+        self.method = newmethod
+
+    def clear(self):
+        """ drops the cached weights """
+        self.weights = {}
+
+    def get_weights(self, source, target):
+        """
+        returns the weights to resample the grid of source to the grid of target.
+        A grid is given by a RasterStack or a Raster (its mbr, cell size, nrows and ncols)
+
+        parameters:
+        ------------
+        source: feature.RasterStack or feature.Raster
+        target: feature.RasterStack or feature.Raster
+        returns:
+        ---------
+        row_weights: tuple
+            (index, weight), both [target nrows, k]: target row i is the sum over k of
+            weight[i, k] * source row index[i, k]
+        col_weights: tuple
+            (index, weight), both [target ncols, k], the same for the cols
+        """
+        source_grid = grid_of(source)
+        target_grid = grid_of(target)
+        key = (self.method, source_grid, target_grid)
+        if key not in self.weights:
+            source_x, source_y, source_width, source_height, source_nrows, source_ncols = source_grid
+            target_x, target_y, target_width, target_height, target_nrows, target_ncols = target_grid
+            row_weights = _axis_weights(self.method, source_y, source_height, source_nrows, target_y, target_height, target_nrows)
+            col_weights = _axis_weights(self.method, source_x, source_width, source_ncols, target_x, target_width, target_ncols)
+            self.weights[key] = (row_weights, col_weights)
+        return self.weights[key]
+
+    def regrid(self, stack, target, chunk_days=256):
+        """
+        resamples stack to the grid of target
+
+        parameters:
+        ------------
+        stack: feature.RasterStack
+            the stack to resample
+        target: feature.RasterStack or feature.Raster
+            the stack or raster whose grid (mbr, cell size, nrows and ncols) is used
+        chunk_days: int
+            the number of timesteps resampled at once, to keep the temporaries small
+        returns:
+        ---------
+        out: feature.RasterStack
+            a new stack on the target grid with the dates, projection, calendar and
+            dtype of stack, or None if the grids can't be matched
+        """
+        if stack.projection is not None and target.projection is not None and stack.projection != target.projection:
+            print("error: cannot regrid between projections " + str(stack.projection) + " and " + str(target.projection))
+            return None
+        if np.sign(stack.cell_width) != np.sign(target.cell_width) or np.sign(stack.cell_height) != np.sign(target.cell_height):
+            print("error: the cell_width and cell_height signs of the stack and the target differ")
+            return None
+        target_x, target_y, target_width, target_height, target_nrows, target_ncols = grid_of(target)
+        if grid_of(stack) == grid_of(target): # already on the target grid
+            data = stack.data
+        else:
+            (row_index, row_weight), (col_index, col_weight) = self.get_weights(stack, target)
+            dtype = np.result_type(stack.data.dtype, np.float32)
+            data = np.empty((stack.nsteps, stack.nlayers, target_nrows, target_ncols), dtype=dtype)
+            for start in range(0, stack.nsteps, chunk_days):
+                stop = min(start + chunk_days, stack.nsteps)
+                source = np.asarray(stack.data[start:stop], dtype=dtype)
+                valid = ~np.isnan(source)
+                total = _apply_weights(np.where(valid, source, 0), row_index, row_weight.astype(dtype), col_index, col_weight.astype(dtype))
+                weight = _apply_weights(valid.astype(dtype), row_index, row_weight.astype(dtype), col_index, col_weight.astype(dtype))
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    data[start:stop] = np.where(weight > 0, total / weight, np.nan)
+        out = feature.RasterStack()
+        out.create_sc_stack(data,
+                            stack.datelist,
+                            stack.projection,
+                            stack.calendar,
+                            target_x,
+                            target_y,
+                            target_width,
+                            target_height,
+                            stack.dtype)
+        return out
+
+    def align(self, stacks, target=None, datelist=None):
+        """
+        resamples the stacks to a common grid and time axis, so they can be used
+        together (for example the temperature and precipitation inputs of KBDI)
+
+        parameters:
+        ------------
+        stacks: list
+            list of feature.RasterStack, the datelists must be sorted
+        target: feature.RasterStack or feature.Raster
+            the stack or raster whose grid is used. If None, the grid of the first stack
+        datelist: list
+            list of datetime.datetime objects, the common time axis. A stack without
+            data on a date is NaN on that date. If None, the dates all stacks have
+        returns:
+        ---------
+        out: list
+            list of feature.RasterStack on the common grid and time axis
+        """
+        if target is None:
+            target = stacks[0]
+        if datelist is None:
+            dates = stacks[0].get_datetime64()
+            for stack in stacks[1:]:
+                dates = np.intersect1d(dates, stack.get_datetime64())
+            if len(dates) == 0:
+                print("error: the stacks do not have any date in common")
+                return None
+            datelist = list(dates.astype("datetime64[us]").astype(object))
+        else:
+            dates = np.array(datelist, dtype="datetime64[D]")
+        out = []
+        for stack in stacks:
+            out.append(self.regrid(_sel_dates(stack, datelist, dates), target))
+        return out
+
+
+def grid_of(raster):
+    """
+    returns the grid of a RasterStack or Raster as a tuple
+    (ulx, uly, cell_width, cell_height, nrows, ncols)
+    """
+    return (float(raster.mbr[0]), float(raster.mbr[1]), float(raster.cell_width), float(raster.cell_height), int(raster.nrows), int(raster.ncols))
+
+
+def _axis_weights(method, source_origin, source_size, source_n, target_origin, target_size, target_n):
+    """
+    returns the (index, weight) arrays [target_n, k] resampling one axis. The target cells
+    are expressed in the source's cell index space, where source cell i spans [i, i + 1]
+    """
+    start = (target_origin + np.arange(target_n) * target_size - source_origin) / source_size
+    length = target_size / source_size
+    centre = start + length / 2.
+    if method == "nearest":
+        index = np.floor(centre + 1e-9).astype(np.intp).reshape(-1, 1)
+        weight = ((index >= 0) & (index < source_n)).astype(float)
+    elif method == "bilinear":
+        # between the centres of source cells i0 and i0 + 1, clamped to the edge cells
+        position = centre - 0.5
+        first = np.floor(position).astype(np.intp)
+        fraction = position - first
+        index = np.stack([first, first + 1], axis=1)
+        weight = np.stack([1 - fraction, fraction], axis=1)
+        inside = (centre >= 0) & (centre <= source_n)
+        weight[~inside] = 0
+    else:
+        # the overlap of the target cell with every source cell it touches
+        first = np.floor(start + 1e-9).astype(np.intp)
+        k = int(np.ceil(length - 1e-9)) + 1
+        index = first.reshape(-1, 1) + np.arange(k)
+        overlap = np.minimum(start.reshape(-1, 1) + length, index + 1) - np.maximum(start.reshape(-1, 1), index)
+        weight = np.clip(overlap, 0, None) / length
+        weight[(index < 0) | (index >= source_n)] = 0
+    return np.clip(index, 0, source_n - 1), weight
+
+
+def _apply_weights(data, row_index, row_weight, col_index, col_weight):
+    """
+    resamples data [timestep, layer, row, col] with separable (index, weight) arrays
+    """
+    rows = row_weight[:, 0, None] * data[:, :, row_index[:, 0], :]
+    for k in range(1, row_index.shape[1]):
+        rows += row_weight[:, k, None] * data[:, :, row_index[:, k], :]
+    out = col_weight[:, 0] * rows[:, :, :, col_index[:, 0]]
+    for k in range(1, col_index.shape[1]):
+        out += col_weight[:, k] * rows[:, :, :, col_index[:, k]]
+    return out
+
+
+def _sel_dates(stack, datelist, dates):
+    """
+    returns stack on the given dates (dates is datelist as datetime64[D]). A date the
+    stack doesn't have is NaN. If the stack has exactly these dates it is returned as is
+    """
+    source_dates = stack.get_datetime64()
+    if len(source_dates) == len(dates) and np.array_equal(source_dates, dates):
+        return stack
+    index = np.clip(np.searchsorted(source_dates, dates), 0, len(source_dates) - 1)
+    present = source_dates[index] == dates
+    data = np.full((len(dates),) + stack.data.shape[1:], np.nan, dtype=np.result_type(stack.data.dtype, np.float32))
+    data[present] = stack.data[index[present]]
+    out = feature.RasterStack()
+    out.create_sc_stack(data,
+                        datelist,
+                        stack.projection,
+                        stack.calendar,
+                        stack.mbr[0],
+                        stack.mbr[1],
+                        stack.cell_width,
+                        stack.cell_height,
+                        stack.dtype)
+    return out
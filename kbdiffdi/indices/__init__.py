@@ -1,2 +1,4 @@
 from .kbdi import *
-from .ffdi import *
\ No newline at end of file
+from .ffdi import *
+from .parallel import *
+from .streaming import *
@@ -1,4 +1,3 @@
-import copy
 import math
 import datetime
 
@@ -6,8 +5,6 @@ import numpy as np
 
 from kbdiffdi.features import feature
 
-np.warnings.filterwarnings('ignore')
-
 class FFDI(object):
     
     def __init__(self):
@@ -16,23 +13,148 @@ class FFDI(object):
         self.temp =  None
         self.wind = None
         self.rel_hum = None
+
+        # the rain event window after the last calculated day, used to resume with update()
+        self.window = None # a RainEventWindow
+
+        # the floating point type of the outputs (numpy.float64 or numpy.float32)
+        self.dtype = np.float64
         
+    def get_window(self):
+        return self.window
+
+    def set_dtype(self, newdtype, KBDI):
+        """
+        sets the floating point type of the outputs. If newdtype is None,
+        the type of the KBDI data is followed (float32 stays float32)
+        """
+        if newdtype is None:
+            newdtype = np.result_type(np.asarray(KBDI.data).dtype, np.float32)
+        self.dtype = np.dtype(newdtype)
     
-    def fit(self, initKBDI, initprcp, inittemp, initwind, initrelhum):
+    def fit(self, initKBDI, initprcp, inittemp, initwind, initrelhum, dtype=None, active_cells=None):
+        """
+        Parameters:
+        -----------
+        initKBDI: feature.RasterStack or feature.VectorStack
+            Keetch Byram Drought Index
+        initprcp: feature.RasterStack or feature.VectorStack
+            daily precipitation in mm
+        inittemp: feature.RasterStack or feature.VectorStack
+            daily maximum temperature in C
+        initwind: feature.RasterStack or feature.VectorStack
+            daily average wind velocity at 10m in km/hr
+        initrelhum: feature.RasterStack or feature.VectorStack
+            daily relative humidity in %
+        dtype: numpy dtype
+            the floating point type of the outputs. If None, the type of the KBDI data is followed
+        active_cells: numpy ndarray (bool) or True
+            only calculate the cells [layer, row, col] that are True, every other cell is NaN
+            (see feature.RasterStack.get_active_cells()). If True, the cells with any KBDI
+            data are used. The window then only holds the active cells, packed as one row of cells.
+            If None, all cells are calculated
+
+        Returns:
+        --------
+        FFDI: feature.RasterStack or feature.VectorStack
+        DF: feature.RasterStack or feature.VectorStack
+        """
+        if isinstance(inittemp, feature.VectorStack): # the stations are calculated as one row of cells
+            return self.__fit_stations(self.fit, None, dtype, initKBDI, initprcp, inittemp, initwind, initrelhum)
+        if active_cells is not None:
+            if active_cells is True:
+                active_cells = initKBDI.get_active_cells()
+            return self.__fit_active_cells(self.fit, None, dtype, active_cells, initKBDI, initprcp, inittemp, initwind, initrelhum)
+        self.set_dtype(dtype, initKBDI)
         self.KBDI = initKBDI
         self.prcp = initprcp
         self.temp = inittemp
         self.wind = initwind
         self.rel_hum = initrelhum
+        return self.calculate_FFDI()
 
-        x = self.calculate_sig_rain_event()
-        x_lim = self.calc_x_lim()
-        DF = self.griffith_drought_factor(x, x_lim)
-        FFDI = self.forest_fire_danger_index(DF)
+    def update(self, window, newKBDI, newprcp, newtemp, newwind, newrelhum, dtype=None, active_cells=None):
+        """
+        Advances an FFDI calculation by the new days only, starting from the rain event
+        window after the last calculated day (see FFDI.get_window()). The window is
+        advanced in place, so it can be used for the next update.
+
+        Parameters:
+        -----------
+        window: RainEventWindow
+            the rain event window after the last calculated day
+        newKBDI, newprcp, newtemp, newwind, newrelhum: feature.RasterStack or feature.VectorStack
+            the data for the new day(s), see fit()
+        dtype: numpy dtype
+            the floating point type of the outputs. If None, the type of the KBDI data is followed
+        active_cells: numpy ndarray (bool)
+            the active cells the window was calculated with (see fit()), or None
+
+        Returns:
+        --------
+        FFDI: feature.RasterStack or feature.VectorStack
+        DF: feature.RasterStack or feature.VectorStack
+        """
+        if isinstance(newtemp, feature.VectorStack): # the stations are calculated as one row of cells
+            return self.__fit_stations(self.update, window, dtype, newKBDI, newprcp, newtemp, newwind, newrelhum)
+        if active_cells is not None:
+            return self.__fit_active_cells(self.update, window, dtype, active_cells, newKBDI, newprcp, newtemp, newwind, newrelhum)
+        self.set_dtype(dtype, newKBDI)
+        self.KBDI = newKBDI
+        self.prcp = newprcp
+        self.temp = newtemp
+        self.wind = newwind
+        self.rel_hum = newrelhum
+        return self.calculate_FFDI(window)
+
+    def __fit_stations(self, method, window, dtype, KBDI, prcp, temp, wind, rel_hum):
+        """
+        runs fit() or update() (method) for feature.VectorStacks of stations by
+        calculating them as RasterStacks with one row of cells, and returns
+        the FFDI and drought factor as VectorStacks
+        """
+        rasters = [KBDI.as_raster_stack(), prcp.as_raster_stack(), temp.as_raster_stack(), wind.as_raster_stack(), rel_hum.as_raster_stack()]
+        if window is None:
+            out_ffdi, out_df = method(*rasters, dtype=dtype)
+        else:
+            out_ffdi, out_df = method(window, *rasters, dtype=dtype)
+        FFDI = feature.VectorStack()
+        FFDI.create_stack_from_raster(temp, out_ffdi.data)
+        DF = feature.VectorStack()
+        DF.create_stack_from_raster(KBDI, out_df.data)
+        return FFDI, DF
+
+    def __fit_active_cells(self, method, window, dtype, active_cells, KBDI, prcp, temp, wind, rel_hum):
+        """
+        runs fit() or update() (method) for the active cells only, packed as one row
+        of cells, and returns the FFDI and drought factor scattered back to the grid
+        """
+        packed = [stack.pack_active_cells(active_cells) for stack in (KBDI, prcp, temp, wind, rel_hum)]
+        if window is None:
+            out_ffdi, out_df = method(*packed, dtype=dtype)
+        else:
+            out_ffdi, out_df = method(window, *packed, dtype=dtype)
+        return temp.unpack_active_cells(active_cells, out_ffdi.data), KBDI.unpack_active_cells(active_cells, out_df.data)
+
+    def calculate_FFDI(self, window=None):
+        """
+        Calculates the drought factor and FFDI for the data set by fit() or update().
+        If window is None, the calculation starts without any past rain.
+        """
+        x = self.calculate_sig_rain_event(window)
+        # x_lim, the drought factor and the FFDI in one pass (see calc_x_lim, 
+        # griffith_drought_factor and forest_fire_danger_index for the steps)
+        shape = np.shape(self.KBDI.data)
+        df_data, ffdi_data = self.drought_factor_and_ffdi(x.data, self.KBDI.data, self.temp.data, self.wind.data, self.rel_hum.data,
+                                                          np.empty(shape=shape, dtype=self.dtype), np.empty(shape=shape, dtype=self.dtype))
+        DF = feature.RasterStack()
+        DF.create_stack_like(self.KBDI, df_data)
+        FFDI = feature.RasterStack()
+        FFDI.create_stack_like(self.temp, ffdi_data)
         return FFDI, DF
 
 
-    def calculate_sig_rain_event(self):
+    def calculate_sig_rain_event(self, window=None):
         """
         See Finkele et al. 2006 and Lucas 2010 for a detailed explanation. Basically, in order to calculate
         the drought factor, a calculation of "significant rainfall events" during the past
@@ -44,95 +166,67 @@ class FFDI(object):
         days since the day with the largest daily rainfall amount within the rain event.
 
         Precip data should be in millimeters
+
+        Parameters:
+        -----------
+        window: RainEventWindow
+            the window to start from (it is advanced in place). If None, the
+            calculation starts without any past rain. The window is kept as self.window
         """
-        #daysagolist = []
-        #rainsumlist = []
+        if window is None:
+            window = RainEventWindow(self.prcp.data.shape[1:], initdtype=self.dtype)
+        self.window = window
+        x_3d_arr = np.empty(shape=np.shape(self.prcp.data), dtype=self.dtype) # every day's minimised x is written straight into its slice
         n = 0
-        window = 20 # to look at the past 20 days. (20 including the current day. So there will only be a 19 days ago max. today is zero days ago. there is a total of 20 days analyzed though)
-        x_3d_arr = None
         while n < len(self.prcp.data):
-            if n < window:
-                prev_rain_cube = np.array(self.prcp.data[:n+1]) # use all available past data, because there hasn't been 20 days of data yet
-            else:
-                prev_rain_cube = np.array(self.prcp.data[n+1-window:n+1]) # to get the last 20 days # disgusting off by one... :(
-            # now that there is a datastructure holding the previous 20 days of rain data,
-            # iterate through the prevRainCube, and update the sigEvent data to hold
-            # the relevant information for the significant rain event in the past 20 days
-            prev_rain_cube = np.where(prev_rain_cube < 2, 0, prev_rain_cube) # rain events need to have more than 2 mm of precipitation
-            days_ago = np.zeros(shape=(len(prev_rain_cube), len(prev_rain_cube[0]), len(prev_rain_cube[0][0]), len(prev_rain_cube[0][0][0])))
-            rain_sum = np.zeros(shape=(len(prev_rain_cube), len(prev_rain_cube[0]), len(prev_rain_cube[0][0]), len(prev_rain_cube[0][0][0])))
-            running_total = np.zeros(shape=(len(self.prcp.data[0][0]), len(self.prcp.data[0][0][0])))
-            cur_max = np.zeros(shape=(len(self.prcp.data[0][0]), len(self.prcp.data[0][0][0])))
-            cur_max_idx = np.zeros(shape=(len(self.prcp.data[0][0]), len(self.prcp.data[0][0][0])))
-            for layer in range(len(prev_rain_cube)):
-                running_total = running_total + prev_rain_cube[layer]
-                rain_sum[layer] = np.where(prev_rain_cube[layer] == 0, 0, rain_sum[layer])
-                days_ago[layer] = np.where(prev_rain_cube[layer] == 0, len(prev_rain_cube)-layer-1, days_ago[layer])
-
-                # first day of 20
-                if layer == 0 and layer != len(prev_rain_cube)-1:
-                    # a consecutive event, start the tallying
-
-                    running_total = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] != 0), prev_rain_cube[layer], running_total)
-                    cur_max_idx = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] !=0), layer, cur_max_idx) 
-                    cur_max = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] !=0), prev_rain_cube[layer], cur_max)
-
-                    # a single rain event.
-
-                    rain_sum[layer] = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0), running_total, rain_sum[layer])
-                    days_ago[layer] = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0), len(prev_rain_cube)-layer-1, days_ago[layer])
-                    running_total = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0), 0, running_total)
-
-
-                # day in the middle
-                if layer > 0 and layer < len(prev_rain_cube)-1:
-                    # a single rain day.
-
-                    cur_max_idx = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0) & (prev_rain_cube[layer] > cur_max), layer, cur_max_idx)
-                    cur_max = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0) & (prev_rain_cube[layer] > cur_max), prev_rain_cube[layer], cur_max)
-                    rain_sum[layer] = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0), running_total, rain_sum[layer])
-                    days_ago[layer] = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0), len(prev_rain_cube) - cur_max_idx-1,days_ago[layer])
-                    running_total = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0), 0, running_total)
-                    cur_max = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] == 0), 0, cur_max)
-
-
-                    # consecutive and ongoing
-
-                    cur_max_idx = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] != 0) & (prev_rain_cube[layer] > cur_max), layer, cur_max_idx)
-                    cur_max = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] != 0) & (prev_rain_cube[layer] > cur_max), prev_rain_cube[layer], cur_max)
-                    rain_sum[layer] = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] != 0), np.nan, rain_sum[layer])
-                    days_ago[layer] = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer+1] != 0), np.nan, days_ago[layer])
-
-                if layer == len(prev_rain_cube)-1:
-                    cur_max_idx = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer] > cur_max), layer, cur_max_idx)
-                    cur_max = np.where((prev_rain_cube[layer] != 0) & (prev_rain_cube[layer] > cur_max), prev_rain_cube[layer], cur_max)
-                    rain_sum[layer] = running_total
-                    days_ago[layer] = np.where(prev_rain_cube[layer] != 0,len(prev_rain_cube)-cur_max_idx-1,days_ago[layer]) #np.ones(shape=(len(daysAgo[0]),len(daysAgo[0][0]))) * len(prevRainCube)-curMaxIdx-1
-
-            #daysagolist.append(daysAgo)
-            #rainsumlist.append(rainSum)
-            x = self.calc_x(days_ago, rain_sum)
-            if x_3d_arr is None:
-                x_3d_arr = np.array([x])
-            else:
-                x_3d_arr = np.append(x_3d_arr, [x], axis=0)
+            # the window keeps the rain events of the past 20 days up to date as it moves
+            # one day forward, so there is no need to rebuild and rescan all 20 days.
+            days_ago, rain_sum = window.advance(self.prcp.data[n])
+            self.calc_x(days_ago, rain_sum, out=x_3d_arr[n])
             n+=1
-        out = copy.deepcopy(self.prcp)
-        out.data = x_3d_arr #out.set_data(x_3d_arr)
+        out = feature.RasterStack()
+        out.create_stack_like(self.prcp, x_3d_arr)
         return out
 
 
-    def calc_x(self, N, P): # P is rain sum from the significant events method
+    def calc_x(self, N, P, out=None): # P is rain sum from the significant events method
         """
         This follows the process of calculating x values for finding the "most significant rain" event.
         See Holgate et al. (2017), and Finkele et al. (2006)
+
+        x = N^1.3 / (N^1.3 + P - 2) for events with P > 2 mm (an event that peaked today
+        counts as N = 0.8 days ago), and 1 otherwise. x is computed once for every
+        element of the window and then minimised over the window (the first axis).
+
+        Parameters:
+        -----------
+        N: ndarray
+            event age (days since the peak day) of the events in the window
+        P: ndarray
+            event amount (rainfall sum) of the events in the window
+        out: ndarray
+            the array to write the minimised x into. If None, a new array is returned
+
+        Returns:
+        --------
+        out: ndarray
+            the minimised x values
         """
-        data = np.ones(shape=(len(N),len(N[0]),len(N[0][0]),len(N[0][0][0])))
-        data = np.where((N >= 1) & (P > 2), np.power(N, 1.3) / (np.power(N, 1.3) + (P - 2)), data)
-        data = np.where((N == 0) & (P > 2), np.power(0.8, 1.3) / (np.power(0.8, 1.3) + (P - 2)), data)
-        data = np.where((P <= 2), 1, data)
-        data = np.amin(data, axis=0) # now minimize x. These are the values that go in for x in griffith's drought factor equation
-        return data
+        N = np.asarray(N)
+        P = np.asarray(P)
+        if np.issubdtype(N.dtype, np.integer) and N.size > 0 and N.min() >= 0:
+            # whole days: look up N^1.3 instead of raising every element to the power
+            N_term = np.power(np.maximum(np.arange(N.max() + 1), 0.8), 1.3)[N]
+            counts = P > 2
+        else:
+            N_term = np.power(np.where(N == 0, 0.8, N), 1.3)
+            counts = (P > 2) & ((N >= 1) | (N == 0))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            data = np.subtract(P, 2, dtype=float if out is None else out.dtype)
+            data += N_term
+            np.divide(N_term, data, out=data)
+        np.copyto(data, 1, where=~counts)
+        return np.amin(data, axis=0, out=out) # now minimize x. These are the values that go in for x in griffith's drought factor equation
 
     def calc_x_lim(self):
         """
@@ -142,8 +236,8 @@ class FFDI(object):
         the two quantities, namely the previously calculated x, and the limiting function Xlim" Finkele et al. 2006
         """
         out = np.where(self.KBDI.data < 20, 1 / (1 + 0.1135 * self.KBDI.data), 75 / (270.525 - 1.267 * self.KBDI.data))
-        x_lim_arr = copy.deepcopy(self.KBDI)
-        x_lim_arr.data = out #x_lim_arr.set_data(out)
+        x_lim_arr = feature.RasterStack()
+        x_lim_arr.create_stack_like(self.KBDI, out)
         return x_lim_arr
 
     
@@ -168,8 +262,8 @@ class FFDI(object):
         other_term = 10.5 * (1 - np.power(math.e, -(self.KBDI.data + 30) / 40.))
         full_term = other_term * x_term
         data = np.minimum(full_term, 10) # now because 10.5 from above allows for values above, take the minimum of the fullterm and 10. (values can't exceed 10)
-        drought_factor = copy.deepcopy(self.KBDI)
-        drought_factor.data = data #drought_factor.set_data(data)
+        drought_factor = feature.RasterStack()
+        drought_factor.create_stack_like(self.KBDI, data)
         return drought_factor
 
     def forest_fire_danger_index(self, drought_factor):
@@ -192,12 +286,272 @@ class FFDI(object):
         out: STCube
             Daily forest fire danger.
         """
-        drought = np.multiply(0.987, np.log(drought_factor.data))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            drought = np.multiply(0.987, np.log(drought_factor.data))
         humidity = np.multiply(0.0345, self.rel_hum.data)
         temp = np.multiply(0.0338, self.temp.data)
         wind = np.multiply(0.0234, self.wind.data)
 
         data = 2*np.power(math.e, (-0.45 + drought - humidity + temp + wind))
-        out = copy.deepcopy(self.temp)
-        out.data = data #out.set_data(data)
-        return out
\ No newline at end of file
+        out = feature.RasterStack()
+        out.create_stack_like(self.temp, data)
+        return out
+
+    def drought_factor_and_ffdi(self, x, KBDI, temp, wind, rel_hum, df_out=None, ffdi_out=None, block_size=65536):
+        """
+        Calculates x_lim, Griffith's drought factor and the FFDI in one pass over the cells.
+        This gives the same values as calc_x_lim(), griffith_drought_factor() and
+        forest_fire_danger_index() (to rounding), but the cells are processed in blocks
+        with a few small reused buffers instead of full-size temporaries.
+
+        Parameters:
+        -----------
+        x: ndarray
+            the minimised x values (see calculate_sig_rain_event)
+        KBDI: ndarray
+            Keetch Byram Drought Index
+        temp: ndarray
+            daily maximum temperature in C
+        wind: ndarray
+            daily average wind velocity at 10m in km/hr
+        rel_hum: ndarray
+            daily relative humidity in %
+        df_out: ndarray
+            C-contiguous array to write the drought factor into. If None, a new array is made
+            (float32 if KBDI is float32, otherwise float64)
+        ffdi_out: ndarray
+            C-contiguous array to write the FFDI into. If None, a new array is made
+        block_size: int
+            the number of cells processed at a time
+
+        Returns:
+        --------
+        df_out: ndarray
+            the drought factor
+        ffdi_out: ndarray
+            the forest fire danger index
+            (None if df_out or ffdi_out isn't C-contiguous)
+        """
+        shape = np.shape(KBDI)
+        dtype = np.result_type(np.asarray(KBDI).dtype, np.float32)
+        if df_out is None:
+            df_out = np.empty(shape=shape, dtype=dtype)
+        if ffdi_out is None:
+            ffdi_out = np.empty(shape=shape, dtype=dtype)
+        if not (df_out.flags.c_contiguous and ffdi_out.flags.c_contiguous):
+            print("error: df_out and ffdi_out must be C-contiguous")
+            return
+        x = np.ravel(x)
+        KBDI = np.ravel(KBDI)
+        temp = np.ravel(temp)
+        wind = np.ravel(wind)
+        rel_hum = np.ravel(rel_hum)
+        df = df_out.reshape(-1)
+        ffdi = ffdi_out.reshape(-1)
+
+        buf_a = np.empty(min(block_size, len(KBDI)), dtype=df_out.dtype)
+        buf_b = np.empty(len(buf_a), dtype=df_out.dtype)
+        buf_mask = np.empty(len(buf_a), dtype=bool)
+        # a drought factor of 0 or below (an out of range KBDI) has no log, it and NaN inputs give NaN without a warning
+        with np.errstate(divide="ignore", invalid="ignore"):
+            start = 0
+            while start < len(KBDI):
+                stop = min(start + block_size, len(KBDI))
+                a = buf_a[:stop-start]
+                b = buf_b[:stop-start]
+                mask = buf_mask[:stop-start]
+                I = KBDI[start:stop]
+                D = df[start:stop]
+
+                # x_lim = 1 / (1 + 0.1135 * I) if I < 20, otherwise 75 / (270.525 - 1.267 * I)
+                np.multiply(I, 0.1135, out=a)
+                a += 1
+                np.divide(1, a, out=a)
+                np.multiply(I, 1.267, out=b)
+                np.subtract(270.525, b, out=b)
+                np.divide(75, b, out=b)
+                np.less(I, 20, out=mask)
+                np.copyto(b, a, where=mask)
+                # x is the minimum of x and x_lim
+                np.less(x[start:stop], b, out=mask)
+                np.copyto(b, x[start:stop], where=mask)
+
+                # x_term = (41 * x^2 + x) / (40 * x^2 + x + 1)
+                np.multiply(b, b, out=a)
+                np.multiply(a, 40, out=D)
+                D += b
+                D += 1
+                a *= 41
+                a += b
+                a /= D
+                # other_term = 10.5 * (1 - e^(-(I + 30) / 40))
+                np.add(I, 30, out=b)
+                np.negative(b, out=b)
+                b /= 40.
+                np.exp(b, out=b)
+                np.subtract(1, b, out=b)
+                b *= 10.5
+                # drought factor can't exceed 10
+                np.multiply(b, a, out=D)
+                np.minimum(D, 10, out=D)
+
+                # FFDI = 2 * e^(-0.45 + 0.987 * ln(DF) - 0.0345 * H + 0.0338 * T + 0.0234 * V)
+                np.log(D, out=a)
+                a *= 0.987
+                a += -0.45
+                np.multiply(rel_hum[start:stop], 0.0345, out=b)
+                a -= b
+                np.multiply(temp[start:stop], 0.0338, out=b)
+                a += b
+                np.multiply(wind[start:stop], 0.0234, out=b)
+                a += b
+                np.exp(a, out=ffdi[start:stop])
+                ffdi[start:stop] *= 2
+                start = stop
+        return df_out, ffdi_out
+
+
+class RainEventWindow(object):
+
+    def __init__(self, initdayshape, initwindow=20, initthreshold=2, initdtype=np.float64):
+        """
+        A sliding window over the past days of precipitation that keeps track of the
+        rain events inside it (see FFDI.calculate_sig_rain_event). A rain event is a set
+        of consecutive days with rainfall of at least 2 mm. Events are stored by the day
+        they start on (the window start, if the event began before the window did)
+        in a ring of `window` slots, so moving the window one day forward only touches
+        the event that leaves at the back and the event that grows at the front.
+
+        attributes of a RainEventWindow:
+        --------------------------------
+        window: int
+            the number of days in the window (including today)
+        threshold: float
+            daily rainfall below the threshold doesn't count (in mm)
+        day_shape: tuple
+            the shape of one day of data
+        n: int
+            the number of days the window has moved so far
+        rain: numpy ndarray [window, cells]
+            the thresholded rainfall of the days in the window, slot = day % window
+        event_valid: numpy ndarray (bool) [window, cells]
+            does an event start on this slot?
+        event_sum: numpy ndarray [window, cells]
+            the rainfall amount of the event (without NaN days)
+        event_nan: numpy ndarray [window, cells]
+            the number of NaN days in the event. The amount of an event with NaN days is unknown
+        event_peak: numpy ndarray [window, cells]
+            the day (counted from the first day the window saw) with the largest rainfall of the event
+        event_max: numpy ndarray [window, cells]
+            the rainfall on the event's peak day
+        current: numpy ndarray [cells]
+            the start day of the event that was ongoing yesterday, -1 if yesterday was dry
+
+        The rainfall arrays (rain, event_sum, event_max) are of type initdtype.
+        """
+        self.window = initwindow
+        self.threshold = initthreshold
+        self.day_shape = tuple(initdayshape)
+        ncells = int(np.prod(self.day_shape))
+        self.n = 0
+
+        self.rain = np.zeros(shape=(self.window, ncells), dtype=initdtype)
+        self.event_valid = np.zeros(shape=(self.window, ncells), dtype=bool)
+        self.event_sum = np.zeros(shape=(self.window, ncells), dtype=initdtype)
+        self.event_nan = np.zeros(shape=(self.window, ncells), dtype=np.int64)
+        self.event_peak = np.zeros(shape=(self.window, ncells), dtype=np.int64)
+        self.event_max = np.zeros(shape=(self.window, ncells), dtype=initdtype)
+        self.current = np.full(ncells, -1, dtype=np.int64)
+
+    def advance(self, today):
+        """
+        Moves the window one day forward.
+
+        Parameters:
+        ------------
+        today: ndarray
+            today's precipitation (in mm), shaped like one day of data
+
+        Returns:
+        ---------
+        days_ago: ndarray [window, ...]
+            event age N, the number of days since the peak day of every event in the window
+        rain_sum: ndarray [window, ...]
+            event amount P, the rainfall sum of every event in the window (NaN if unknown)
+            Slots without an event have N = 0 and P = 0.
+        """
+        n = self.n
+        slot = n % self.window
+        rain = np.asarray(today, dtype=self.rain.dtype).reshape(-1)
+        rain = np.where(rain < self.threshold, 0, rain) # rain events need to have more than 2 mm of precipitation
+
+        if n >= self.window:
+            self.__drop_oldest_day(slot)
+        self.rain[slot] = rain
+        self.__add_day(slot, rain)
+        self.n += 1
+
+        days_ago = np.where(self.event_valid, n - self.event_peak, 0)
+        rain_sum = np.where(self.event_nan > 0, np.nan, self.event_sum)
+        rain_sum = np.where(self.event_valid, rain_sum, 0)
+        return days_ago.reshape((self.window,) + self.day_shape), rain_sum.reshape((self.window,) + self.day_shape)
+
+    def __drop_oldest_day(self, slot):
+        """
+        the day in the slot leaves the window. An event that starts on it either ends
+        with it or continues on the next day, in which case it's moved to the next slot
+        without the leaving day.
+        """
+        leaving_day = self.n - self.window
+        next_slot = (slot + 1) % self.window
+        cells = np.flatnonzero(self.event_valid[slot] & (self.rain[next_slot] != 0))
+        if len(cells) == 0:
+            return
+        dropped = self.rain[slot, cells]
+        dropped_nan = np.isnan(dropped)
+        self.event_valid[next_slot, cells] = True
+        self.event_sum[next_slot, cells] = self.event_sum[slot, cells] - np.where(dropped_nan, 0, dropped)
+        self.event_nan[next_slot, cells] = self.event_nan[slot, cells] - dropped_nan
+        self.event_peak[next_slot, cells] = self.event_peak[slot, cells]
+        self.event_max[next_slot, cells] = self.event_max[slot, cells]
+        self.current[cells] = np.where(self.current[cells] == leaving_day, leaving_day + 1, self.current[cells])
+
+        # the peak day left the window, so find the largest rainfall among the event's remaining
+        # days. This is the only time the days of an event are looked at again.
+        cells = cells[self.event_peak[next_slot, cells] == leaving_day]
+        if len(cells) == 0:
+            return
+        order = (next_slot + np.arange(self.window - 1)) % self.window # the remaining days, oldest first
+        days = self.rain[order][:, cells]
+        in_event = np.logical_and.accumulate(days != 0, axis=0)
+        days = np.where(in_event & ~np.isnan(days), days, -np.inf)
+        peak = np.argmax(days, axis=0) # the first day with the largest rainfall
+        self.event_peak[next_slot, cells] = leaving_day + 1 + peak
+        self.event_max[next_slot, cells] = days[peak, np.arange(len(cells))]
+
+    def __add_day(self, slot, rain):
+        """
+        today's rain either continues yesterday's event, starts a new event in today's slot, or
+        ends yesterday's event
+        """
+        wet = rain != 0
+        wet_nan = np.isnan(rain)
+        ongoing = wet & (self.current >= 0)
+
+        cells = np.flatnonzero(ongoing)
+        if len(cells) > 0:
+            event_slot = self.current[cells] % self.window
+            today = rain[cells]
+            self.event_sum[event_slot, cells] += np.where(wet_nan[cells], 0, today)
+            self.event_nan[event_slot, cells] += wet_nan[cells]
+            higher = today > self.event_max[event_slot, cells]
+            self.event_max[event_slot[higher], cells[higher]] = today[higher]
+            self.event_peak[event_slot[higher], cells[higher]] = self.n
+
+        new = wet & ~ongoing
+        self.event_valid[slot] = new
+        self.event_sum[slot] = np.where(wet_nan, 0, rain)
+        self.event_nan[slot] = wet_nan
+        self.event_peak[slot] = self.n
+        self.event_max[slot] = np.where(wet_nan, -np.inf, rain)
+        self.current = np.where(new, self.n, np.where(wet, self.current, -1))
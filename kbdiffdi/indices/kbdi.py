@@ -1,4 +1,3 @@
-import copy
 import math
 import datetime
 
@@ -20,6 +19,11 @@ class KBDI(object):
         self.net_rainfall = None # 2d array (raster)
         self.mean_annual_rainfall = None # a 2d array (raster)
 
+        # the carry state after the last calculated day, used to resume with update()
+        self.state = None # a KBDIState
+
+        # the floating point type of the KBDI output (numpy.float64 or numpy.float32)
+        self.dtype = np.float64
 
     def set_temp(self, newtemp):
         self.temp = newtemp
@@ -50,13 +54,108 @@ class KBDI(object):
     def get_mean_annual_rainfall(self):
         return self.mean_annual_rainfall
 
-    def fit(self, inittemp, initprcp, initmeanannualrainfall=None, initdroughtindex=np.array([[[[0]]]])):
+    def get_state(self):
+        return self.state
+
+    def set_dtype(self, newdtype):
+        self.dtype = np.dtype(newdtype)
+
+    def fit(self, inittemp, initprcp, initmeanannualrainfall=None, initdroughtindex=np.array([[[[0]]]]), dtype=None, active_cells=None):
+        """
+        Parameters:
+        ------------
+        inittemp: feature.RasterStack or feature.VectorStack
+            temperature in C
+        initprcp: feature.RasterStack or feature.VectorStack
+            precipitation in mm
+        initmeanannualrainfall: feature.Raster
+            the mean annual rainfall. If None, it's calculated from initprcp
+        initdroughtindex: ndarray
+            the drought index of the day before the first day
+        dtype: numpy dtype
+            the floating point type of the output. If None, the type of the input data is followed
+        active_cells: numpy ndarray (bool) or True
+            only calculate the cells [layer, row, col] that are True, every other cell is NaN
+            (see feature.RasterStack.get_active_cells()). If True, the cells with any
+            temperature and precipitation data are used. The state and the net rainfall
+            then only hold the active cells, packed as one row of cells.
+            If None, all cells are calculated
+
+        Returns:
+        ---------
+        out: feature.RasterStack or feature.VectorStack
+            KBDI
+        """
+        if isinstance(inittemp, feature.VectorStack): # the stations are calculated as one row of cells
+            out = self.fit(inittemp.as_raster_stack(), initprcp.as_raster_stack(), initmeanannualrainfall, np.reshape(initdroughtindex, (1, 1, 1, -1)), dtype)
+            out_kbdi = feature.VectorStack()
+            out_kbdi.create_stack_from_raster(inittemp, out.data)
+            return out_kbdi
+        if active_cells is not None: # calculate the active cells only, packed as one row of cells
+            if active_cells is True:
+                active_cells = inittemp.get_active_cells() & initprcp.get_active_cells()
+            index = np.flatnonzero(active_cells)
+            mean_annual_rainfall = initmeanannualrainfall
+            if mean_annual_rainfall is not None:
+                mean_annual_rainfall = mean_annual_rainfall_raster(np.broadcast_to(mean_annual_rainfall.data, (1,) + active_cells.shape).reshape(-1)[index].reshape(1, 1, 1, -1))
+            drought_index = np.broadcast_to(initdroughtindex, (1,) + active_cells.shape).reshape(-1)[index].reshape(1, 1, 1, -1)
+            out = self.fit(inittemp.pack_active_cells(active_cells), initprcp.pack_active_cells(active_cells), mean_annual_rainfall, drought_index, dtype)
+            return inittemp.unpack_active_cells(active_cells, out.data)
+        if dtype is None: # follow the dtype of the input data (float32 stays float32)
+            dtype = np.result_type(inittemp.data.dtype, np.float32)
+        self.set_dtype(dtype)
         self.set_temp(inittemp)
         self.set_prcp(initprcp)
         self.set_first_drought_index(initdroughtindex)
         self.set_mean_annual_rainfall(initmeanannualrainfall)
         return self.calculate_KBDI()
 
+    def update(self, state, newtemp, newprcp, dtype=None, active_cells=None):
+        """
+        Advances a KBDI calculation by the new days only, starting from the
+        state saved after the last calculated day (see KBDI.get_state() and KBDIState).
+        The state is advanced in place, so it can be saved and used for the next update.
+
+        Parameters:
+        ------------
+        state: KBDIState
+            the state after the last calculated day
+        newtemp: feature.RasterStack or feature.VectorStack
+            temperature (in celsius) for the new day(s). The first day must come
+            after state.date (normally the day after, but like in a full run the
+            days are taken as consecutive even if the record has gaps)
+        newprcp: feature.RasterStack or feature.VectorStack
+            precipitation (in mm) for the new day(s)
+        dtype: numpy dtype
+            the floating point type of the output, numpy.float64 or numpy.float32.
+            If None, the type of the input data is followed
+        active_cells: numpy ndarray (bool)
+            the active cells the state was calculated with (see fit()), or None
+
+        Returns:
+        ---------
+        out: feature.RasterStack or feature.VectorStack
+            KBDI values for the new day(s)
+        """
+        if state.date is not None and newtemp.datelist[0] <= state.date:
+            print("error: the new data must start after the state's date")
+            return
+        if isinstance(newtemp, feature.VectorStack): # the stations are calculated as one row of cells
+            out = self.update(state, newtemp.as_raster_stack(), newprcp.as_raster_stack(), dtype)
+            out_kbdi = feature.VectorStack()
+            out_kbdi.create_stack_from_raster(newtemp, out.data)
+            return out_kbdi
+        if active_cells is not None: # the state holds the active cells only, packed as one row of cells
+            out = self.update(state, newtemp.pack_active_cells(active_cells), newprcp.pack_active_cells(active_cells), dtype)
+            return newtemp.unpack_active_cells(active_cells, out.data)
+        if dtype is None: # follow the dtype of the input data (float32 stays float32)
+            dtype = np.result_type(newtemp.data.dtype, np.float32)
+        self.set_dtype(dtype)
+        self.set_temp(newtemp)
+        self.set_prcp(newprcp)
+        self.set_mean_annual_rainfall(mean_annual_rainfall_raster(state.mean_annual_rainfall))
+        return self.calculate_KBDI(state)
+
     def cut_first_slice(self): # cut the first slice of the temp and prcp data. Only initialize with the 1st KBDI
         self.temp.setdata(self.temp.data[1:])
         self.temp.datelist = self.temp.datelist[1:]
@@ -64,65 +163,131 @@ class KBDI(object):
         self.prcp.datelist = self.prcp.datelist[1:]
     
 
-    def calculate_net_rainfall(self):
-        threshold = 5.08 # 0.20 * 25.4 # convert inches to mm. NOTE: some literature uses 5 mm instead of 5.08
+    def calculate_net_rainfall(self, state=None, start_days=None):
+        """
+        Calculates the net (effective) rainfall for every day in the prcp data.
+
+        Rain that falls on consecutive days is treated as a single rain event and
+        the 0.20 inch (5.08 mm) threshold is only subtracted once per event. This is a
+        single pass through time: the running total, consecutive-day and already-subtracted
+        state is carried from one day to the next and each day is written straight
+        into a preallocated output cube.
+
+        Parameters:
+        -----------
+        state: KBDIState
+            the carry state to start from. Its running_total, consec,
+            already_subtracted and prcp are advanced in place.
+            If None, the calculation starts without any rain event
+        start_days: dict
+            {day index: cells} of the cells whose records start on a later day
+            (see calculate_start_days()). Their rain event state is reset on that day
 
-        #out = Bob.STCube(self.prcp.y,self.prcp.x,self.prcp.h,self.prcp.w,self.prcp.s,self.prcp.d)
-        net_rainfall = np.zeros(shape=(len(self.prcp.data), len(self.prcp.data[0]), len(self.prcp.data[0][0]), len(self.prcp.data[0][0][0]))) # netRainfall
+        Returns:
+        ---------
+        None
+        """
+        if start_days is None:
+            start_days = {}
+        daily_prcp = self.prcp.data
+        net_rainfall = np.zeros(shape=daily_prcp.shape, dtype=self.dtype) # netRainfall
 
         #variables for the calculation
-        daily_prcp = copy.deepcopy(self.prcp.data) # the precipitation data
-        running_total = np.zeros(shape=(1, len(self.prcp.data[0]), len(self.prcp.data[0][0]))) # a running total for continuous rain days
-        consec = np.zeros(shape=(len(self.prcp.data[0]), len(self.prcp.data[0][0])), dtype=bool) # which cells see consecutive rainfall?
-        already_subtracted = np.zeros(shape=(len(self.prcp.data[0]), len(self.prcp.data[0][0])), dtype=bool) # has the 0.20 threshold been met and 0.20 subtracted?
+        if state is None:
+            running_total = np.zeros(shape=daily_prcp.shape[1:], dtype=self.dtype) # a running total for continuous rain days
+            consec = np.zeros(shape=daily_prcp.shape[1:], dtype=bool) # which cells see consecutive rainfall?
+            already_subtracted = np.zeros(shape=daily_prcp.shape[1:], dtype=bool) # has the 0.20 threshold been met and 0.20 subtracted?
+            yesterday = None # no rain known before the first day, consec stays False
+        else:
+            running_total = state.running_total
+            consec = state.consec
+            already_subtracted = state.already_subtracted
+            yesterday = state.prcp
 
-        n=0
+        n = 0
         while n < len(daily_prcp):
-            running_total += daily_prcp[n]
-            # if dailyPrcp[n] == 0: 
-            net_rainfall[n] = np.where(daily_prcp[n] == 0, 0, net_rainfall[n])
-            running_total = np.where(daily_prcp[n] == 0, 0, running_total)
-            already_subtracted = np.where(daily_prcp[n] == 0, False, already_subtracted)
-
             if n > 0:
-                # if dailyPrcp[n] > 0 and dailyPrcp[n-1] > 0
-                consec = np.where((daily_prcp[n] > 0) & (daily_prcp[n-1] > 0), True, False)
-
-            #if dailyPrcp[n] > 0 and consec and alreadySubtracted:
-            net_rainfall[n] = np.where((daily_prcp[n] > 0) & (consec == True) and (already_subtracted == True), daily_prcp[n], net_rainfall[n])
-            running_total = np.where((daily_prcp[n] > 0) & (consec == True) and (already_subtracted == True), 0, running_total)
-
-            #if dailyPrcp[n] > 0.20 and consec and not alreadySubtracted:
-            net_rainfall[n] = np.where((daily_prcp[n] > threshold) & (consec == True) & (already_subtracted == False), running_total - threshold, net_rainfall[n])
-            already_subtracted = np.where((daily_prcp[n] > threshold) & (consec == True) & (already_subtracted == False), True, already_subtracted)
-            running_total = np.where((daily_prcp[n] > threshold) & (consec == True) & (already_subtracted == False), 0, running_total)
+                yesterday = daily_prcp[n-1]
+            if n in start_days: # no rain event before the record starts
+                running_total.reshape(-1)[start_days[n]] = 0
+                consec.reshape(-1)[start_days[n]] = False
+                already_subtracted.reshape(-1)[start_days[n]] = False
+            self.net_rainfall_step(daily_prcp[n], yesterday, running_total, consec, already_subtracted, net_rainfall[n])
+            n+=1
+        if state is not None and len(daily_prcp) > 0:
+            state.prcp = daily_prcp[-1].copy()
+        net_rain = feature.RasterStack()
+        net_rain.create_stack_like(self.prcp, net_rainfall)
+        self.net_rainfall = net_rain
 
-            # if dailyPrcp[n] > 0.20 and not consec:
-            net_rainfall[n] = np.where((daily_prcp[n] > threshold) & (consec == False), daily_prcp[n] - threshold, net_rainfall[n])
-            already_subtracted = np.where((daily_prcp[n] > threshold) & (consec == False), True, already_subtracted)
-            running_total = np.where((daily_prcp[n] > threshold) & (consec == False), 0, running_total)
+    def net_rainfall_step(self, today, yesterday, running_total, consec, already_subtracted, out):
+        """
+        Advances the net rainfall state machine by one day. running_total, consec and
+        already_subtracted are updated in place and today's net rainfall is written to out.
 
-            # if dailyPrcp[n] < 0.20 and not consec:
-            net_rainfall[n] = np.where((daily_prcp[n] < threshold) & (consec == False), 0, net_rainfall[n])
+        Parameters:
+        ------------
+        today: ndarray
+            today's precipitation (in mm)
+        yesterday: ndarray or None
+            yesterday's precipitation (in mm). If None, consec is left unchanged
+        running_total: ndarray
+            a running total for continuous rain days
+        consec: ndarray (bool)
+            which cells see consecutive rainfall?
+        already_subtracted: ndarray (bool)
+            has the 0.20 threshold been met and 0.20 subtracted?
+        out: ndarray
+            today's net rainfall is written into this array
 
-            #if dailyPrcp[n] < 0.20 and consec and runningTotal <= 0.20 and not alreadySubtracted:
-            net_rainfall[n] = np.where((daily_prcp[n] < threshold) & (consec == True) & (running_total <= threshold) & (already_subtracted == False), 0, net_rainfall[n])
+        Returns:
+        ---------
+        None
+        """
+        threshold = 5.08 # 0.20 * 25.4 # convert inches to mm. NOTE: some literature uses 5 mm instead of 5.08
 
-            #if dailyPrcp[n] < 0.20 and consec and runningTotal > 0.20:
-            net_rainfall[n] = np.where((daily_prcp[n] < threshold) & (consec == True) & (running_total > threshold), running_total - threshold, net_rainfall[n])
-            already_subtracted = np.where((daily_prcp[n] < threshold) & (consec == True) & (running_total > threshold), True, already_subtracted)
-            running_total = np.where((daily_prcp[n] < threshold) & (consec == True) & (running_total > threshold), 0, running_total)
-            n+=1
-        net_rain = feature.RasterStack()
-        net_rain.create_sc_stack(net_rainfall,
-                                self.prcp.datelist,
-                                None,
-                                "standard",
-                                0,
-                                0,
-                                1,
-                                -1) 
-        self.net_rainfall = net_rain
+        running_total += today
+        if yesterday is not None:
+            # if dailyPrcp[n] > 0 and dailyPrcp[n-1] > 0
+            np.logical_and(today > 0, yesterday > 0, out=consec)
+        above = today > threshold
+        out.fill(0)
+
+        # if dailyPrcp[n] > 0 and consec and alreadySubtracted:
+        #     the threshold was already taken from this event, all of today's rain counts
+        whole_day = consec & already_subtracted
+        np.copyto(out, today, where=whole_day)
+
+        # if dailyPrcp[n] > 0.20 and not consec:
+        #     a new event that meets the threshold on its first day
+        new_event = np.greater(above, consec) # above & ~consec
+        np.subtract(today, threshold, out=out, where=new_event)
+
+        # if dailyPrcp[n] > 0.20 and consec and not alreadySubtracted:
+        # if dailyPrcp[n] < 0.20 and consec and runningTotal > 0.20:
+        #     an ongoing event whose running total has just met the threshold
+        event_total = np.greater(running_total, threshold)
+        np.logical_and(event_total, today < threshold, out=event_total)
+        np.logical_or(event_total, above, out=event_total)
+        subtract_total = np.greater(consec, already_subtracted) # consec & ~already_subtracted
+        np.logical_and(subtract_total, event_total, out=subtract_total)
+        np.subtract(running_total, threshold, out=out, where=subtract_total)
+
+        # if dailyPrcp[n] == 0 the event is over and already_subtracted is reset
+        dry = today == 0
+        np.greater(already_subtracted, dry, out=already_subtracted) # already_subtracted & ~dry
+        already_subtracted |= new_event
+        already_subtracted |= subtract_total
+
+        # the running total restarts after a dry day and whenever net rainfall was taken from it,
+        # except on a heavy day of an ongoing event, which keeps accumulating
+        reset = np.greater(subtract_total, above, out=subtract_total) # subtract_total & ~above
+        reset |= whole_day
+        reset |= new_event
+        reset |= dry
+        np.copyto(running_total, 0, where=reset)
+        # every other case (a light day without an event, a light day whose event
+        # hasn't reached the threshold yet, a day of exactly 0.20) has zero net rainfall
     
 
     def get_net_rainfall(self):
@@ -133,7 +298,18 @@ class KBDI(object):
     def calculate_mean_annual_rainfall(self):
         """
         Calculates a mean annual rainfall value for each cell in the input data.
-        It is assumed that the data is daily data without missing values and starts on January 1st.
+        It is assumed that the data is daily data sorted by date.
+
+        The yearly totals are found with one group-by-year reduction over the
+        time axis, the rain data is not copied. The rules are:
+            - only complete calendar years count. A year is complete when every
+              one of its days (365 or 366) is in the data, so a partial first or
+              last year is left out.
+            - a year with any NaN day in a cell is left out for that cell.
+            - if there isn't a single complete year in the data, the mean annual
+              rainfall is extrapolated from the mean daily rainfall of the available
+              (not NaN) days: mean daily rainfall * 365.25
+            - a cell without any usable year is NaN
 
         Parameters:
         -----------
@@ -141,44 +317,13 @@ class KBDI(object):
 
         Returns:
         ---------
-        out: ndarray
-            A 2d array holding a mean annual rainfall value for 
-            every cell in the input prcp data
+        None
         """
-        raindata = copy.deepcopy(self.prcp.data)
-        dates = self.prcp.datelist
-        running_total = 0
-        yearly_sums = None
-        n = 0
-        cur_year = dates[n].year
-        while n < len(dates):
-            if dates[n].year != cur_year: # we've hit a new year. 1. store the running total in the yearlySums and restart the running total
-                if yearly_sums is None:
-                    yearly_sums = np.array([running_total])
-                else:
-                    yearly_sums = np.append(yearly_sums, [running_total], axis=0)
-                cur_year = dates[n].year
-                running_total = raindata[n]
-            else:
-                running_total += raindata[n]
-            n+=1
-        # make sure to include the last year of data. The while condition doesn't    
-        if dates[n-1].month == 12 and dates[n-1] == 31: 
-            yearly_sums = np.append(yearly_sums, [running_total], axis=0)
-        annual_mean = np.mean(yearly_sums, axis=0)
-        mean_rain = feature.Raster(np.array([annual_mean]),
-                                    {0: 0},
-                                   datetime.datetime(1976, 7, 4),
-                                   None,
-                                   "standard",
-                                   "mean annual rainfall",
-                                   0,
-                                   0,
-                                   1,
-                                   -1)
-        self.mean_annual_rainfall = mean_rain
+        annual_rainfall = AnnualRainfall()
+        annual_rainfall.add(self.prcp.data, self.prcp.get_datetime64())
+        annual_mean = annual_rainfall.mean()
+        self.mean_annual_rainfall = mean_annual_rainfall_raster(np.array([annual_mean]))
 
-    
     def calculate_ET(self, prev_KBDI, prev_temp):
         """
         Calculates the ET based on equation 17 in appendix A from Keetch and Byram 1968.
@@ -197,54 +342,410 @@ class KBDI(object):
                 daily evapotranspiration
         """
         numerator = (203.2 - prev_KBDI) * (0.968 * np.exp(0.0875 * prev_temp + 1.5552) - 8.30)
-        denominator = 1 + 10.88 * np.exp(-0.001736 * self.get_mean_annual_rainfall().data)
+        denominator = self.calculate_ET_denominator()
         ET = 0.001 * (numerator / denominator)
         return ET
 
+    def calculate_ET_denominator(self):
+        """
+        The denominator of equation 17 only depends on the mean annual rainfall,
+        so it is the same for every day of the calculation.
 
-    def calculate_KBDI(self):
+        Returns:
+        ---------
+            denominator: ndarray
+                1 + 10.88 * exp(-0.001736 * mean annual rainfall)
+        """
+        return 1 + 10.88 * np.exp(-0.001736 * self.get_mean_annual_rainfall().data)
+
+    def calculate_temp_factor(self, temp, out=None):
+        """
+        The temperature term of equation 17, 0.968 * exp(0.0875 * temp + 1.5552) - 8.30.
+        It doesn't depend on yesterday's KBDI, so it can be computed for all days at once.
+
+        Parameters:
+        ------------
+            temp: ndarray
+                daily temperature (in celsius)
+            out: ndarray
+                the array to write the result into. May be temp itself
+
+        Returns:
+        ---------
+            out: ndarray
+        """
+        out = np.multiply(temp, 0.0875, out=out)
+        out += 1.5552
+        np.exp(out, out=out)
+        out *= 0.968
+        out -= 8.30
+        return out
+
+
+    def initial_state(self):
+        """
+        Creates the KBDIState for the day before the first day of the input data:
+        the first drought index, no ongoing rain event, and the mean annual rainfall.
+        """
+        shape = self.prcp.data.shape[1:]
+        first_kbdi = np.broadcast_to(self.get_first_KBDI().data, (1,) + shape)[0].astype(self.dtype)
+        state = KBDIState(first_kbdi,
+                          np.zeros(shape=shape, dtype=self.dtype),
+                          np.zeros(shape=shape, dtype=bool),
+                          np.zeros(shape=shape, dtype=bool),
+                          None,
+                          self.get_mean_annual_rainfall().data,
+                          self.get_first_KBDI().datelist[0],
+                          first_kbdi,
+                          np.zeros(shape=shape, dtype=bool))
+        return state
+
+    def calculate_start_days(self, state):
+        """
+        Finds the days the records of cells start on: the first day with temperature and
+        precipitation of every cell whose record hasn't started yet. A cell is NaN until
+        its record starts and then starts from the first drought index, like every cell
+        does on the first day. So stations with different date ranges can share one stack
+        (see input_output.load_csv_directory()). A missing day after the record started
+        makes the KBDI NaN from then on, as before.
+
+        Parameters:
+        ------------
+        state: KBDIState
+            the state of the day before the first day. Its started is advanced in place
+
+        Returns:
+        ---------
+        start_days: dict
+            {day index: numpy ndarray of the flat indices of the cells starting on that day}
+        """
+        temp = self.temp.data
+        prcp = self.prcp.data
+        start_days = {}
+        waiting = ~np.broadcast_to(state.started, temp.shape[1:]).reshape(-1)
+        start = 0
+        while start < len(temp) and waiting.any(): # a block of days at a time, to keep the temporaries small
+            stop = min(start + 256, len(temp))
+            valid = ~(np.isnan(temp[start:stop]) | np.isnan(prcp[start:stop]))
+            cells = np.flatnonzero(waiting)
+            valid = valid.reshape(stop - start, -1)[:, cells]
+            has_data = valid.any(axis=0)
+            cells = cells[has_data]
+            first_days = valid[:, has_data].argmax(axis=0)
+            for day in np.unique(first_days):
+                start_days[start + int(day)] = cells[first_days == day]
+            waiting[cells] = False
+            start = stop
+        state.started = ~waiting.reshape(temp.shape[1:])
+        return start_days
+
+    def calculate_KBDI(self, state=None):
         """
         prcp must be in mm
         temp must be in C
         
         Parameters:
         ------------
-        initialDroughtIndex: float or int
-            the initial value to set the first drought index
+        state: KBDIState
+            the state to resume from (see update()). If None, the calculation starts
+            from the first drought index. The state is advanced in place and
+            kept as self.state
             
         Returns:
         ---------
         out: STCube
             data structure holding KBDI values
         """
-        if self.mean_annual_rainfall is None: # set the mean annual rainfall if not set yet
-            self.calculate_mean_annual_rainfall()
+        if state is None:
+            if self.mean_annual_rainfall is None: # set the mean annual rainfall if not set yet
+                self.calculate_mean_annual_rainfall()
+            state = self.initial_state()
+        start_days = self.calculate_start_days(state)
         #self.cutFirstSlice() # to clip the first layer from the temp and prcp data. 
-        self.calculate_net_rainfall()  
-        #netRainfall[0], temp[0], prcp[0]. netRainfall[0] is the first day, self.firstKBDI is yesterday's KBDI
+        self.calculate_net_rainfall(state, start_days)  
+        #netRainfall[0], temp[0], prcp[0]. netRainfall[0] is the first day, state.kbdi is yesterday's KBDI
         
-        kb_cube = np.ones(shape=(len(self.temp.data), len(self.temp.data[0]), len(self.temp.data[0][0]), len(self.temp.data[0][0][0])))
-
-        prev_KBDI = self.get_first_KBDI()
-        prev_kbdi_data = prev_KBDI.data
+        # the per cell and per day invariants of the recurrence are computed once, up front.
+        # The temperature term is written straight into the output cube, which is
+        # then overwritten day by day with the KBDI.
+        kb_cube = np.empty(shape=self.temp.data.shape, dtype=self.dtype)
+        self.calculate_temp_factor(self.temp.data, out=kb_cube)
+        day_shape = kb_cube.shape[1:]
+        denominator = np.broadcast_to(self.calculate_ET_denominator(), (1,) + day_shape)[0].astype(self.dtype)
+        ET = np.empty(shape=day_shape, dtype=self.dtype)
+
+        prev_kbdi_data = state.kbdi
+        first_kbdi = np.ascontiguousarray(np.broadcast_to(state.first_kbdi, day_shape))
         
         n = 0
-        while n < len(self.temp.data):
-            # today's ET requires yesterday's KBDI, yesterday's temp, and mean annual rainfall. 
-            ET = self.calculate_ET(prev_kbdi_data, self.temp.data[n]) 
+        while n < len(kb_cube):
+            KBDI = kb_cube[n]
+            if n in start_days: # cells whose records start today start from the first drought index
+                prev_kbdi_data = prev_kbdi_data.copy()
+                prev_kbdi_data.reshape(-1)[start_days[n]] = first_kbdi.reshape(-1)[start_days[n]]
+            # today's ET requires yesterday's KBDI, the temperature term, and mean annual rainfall. 
+            np.subtract(203.2, prev_kbdi_data, out=ET)
+            ET *= KBDI # the temperature term
+            ET /= denominator
+            ET *= 0.001
             # KBDI for today is calculated based on yesterday's KBDI, ET, and yesterday's effective prcp (net rainfall)  
-            KBDI = prev_kbdi_data + ET - self.net_rainfall.data[n]  # output is a 2d array
-            KBDI = np.where(KBDI < 0, 0, KBDI) # KBDI values can't be negative
-            kb_cube[n] = KBDI # set kb_cube to today's KBDI, this then becomes yesterday's KBDI at the next iteration 
-            prev_kbdi_data = KBDI # prev_KBDI.set_data(KBDI)
+            np.add(prev_kbdi_data, ET, out=KBDI)
+            KBDI -= self.net_rainfall.data[n]
+            np.copyto(KBDI, 0, where=KBDI < 0) # KBDI values can't be negative
+            prev_kbdi_data = KBDI # today's KBDI becomes yesterday's KBDI at the next iteration
             n+=1
+        if n > 0:
+            state.kbdi = kb_cube[n-1].copy()
+            state.date = self.temp.datelist[n-1]
+        self.state = state
         out_kbdi = feature.RasterStack()
-        out_kbdi.create_sc_stack(kb_cube,
-                                      self.temp.datelist,
-                                      None,
-                                      "standard",
-                                      0,
-                                      0,
-                                      1,
-                                      -1)
-        return out_kbdi
\ No newline at end of file
+        out_kbdi.create_stack_like(self.temp, kb_cube)
+        return out_kbdi
+
+
+class KBDIState(object):
+
+    def __init__(self, initkbdi, initrunningtotal, initconsec, initalreadysubtracted, initprcp, initmeanannualrainfall, initdate=None, initfirstkbdi=None, initstarted=None):
+        """
+        everything needed to resume a KBDI calculation after the last calculated day.
+        It can be saved to and loaded from a .npz file.
+
+        attributes of a KBDIState:
+        --------------------------
+        kbdi: numpy ndarray
+            yesterday's KBDI
+        running_total: numpy ndarray
+            the running total of the ongoing rain event
+        consec: numpy ndarray (bool)
+            which cells saw consecutive rainfall yesterday
+        already_subtracted: numpy ndarray (bool)
+            has the 0.20 threshold already been subtracted from the ongoing rain event
+        prcp: numpy ndarray or None
+            yesterday's precipitation (None before the first day)
+        mean_annual_rainfall: numpy ndarray
+            the mean annual rainfall for every cell
+        date: python datetime
+            the date of yesterday's KBDI
+        first_kbdi: numpy ndarray
+            the first drought index, a cell whose record starts later starts from it
+            (see KBDI.calculate_start_days()). 0 if not given
+        started: numpy ndarray (bool)
+            which cells' records have started. If not given, the cells with a KBDI
+        """
+        self.kbdi = _float_array(initkbdi)
+        self.running_total = _float_array(initrunningtotal)
+        self.consec = np.array(initconsec, dtype=bool)
+        self.already_subtracted = np.array(initalreadysubtracted, dtype=bool)
+        if initprcp is None:
+            self.prcp = None
+        else:
+            self.prcp = _float_array(initprcp)
+        self.mean_annual_rainfall = _float_array(initmeanannualrainfall)
+        self.date = initdate
+        if initfirstkbdi is None:
+            self.first_kbdi = np.zeros(self.kbdi.shape, dtype=self.kbdi.dtype)
+        else:
+            self.first_kbdi = _float_array(initfirstkbdi)
+        if initstarted is None:
+            self.started = ~np.isnan(self.kbdi)
+        else:
+            self.started = np.array(initstarted, dtype=bool)
+
+    def save(self, filename):
+        """
+        saves the state to a .npz file
+        """
+        if self.prcp is None:
+            prcp = np.full(self.running_total.shape, np.nan) # no rain known, the same as None
+        else:
+            prcp = self.prcp
+        np.savez(filename,
+                 kbdi=self.kbdi,
+                 running_total=self.running_total,
+                 consec=self.consec,
+                 already_subtracted=self.already_subtracted,
+                 prcp=prcp,
+                 mean_annual_rainfall=self.mean_annual_rainfall,
+                 date=np.array(self.date, dtype="datetime64[us]"),
+                 first_kbdi=self.first_kbdi,
+                 started=self.started)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        loads a state saved with KBDIState.save()
+        """
+        with np.load(filename) as saved:
+            date = saved["date"].astype(datetime.datetime)
+            return cls(saved["kbdi"],
+                       saved["running_total"],
+                       saved["consec"],
+                       saved["already_subtracted"],
+                       saved["prcp"],
+                       saved["mean_annual_rainfall"],
+                       date,
+                       saved["first_kbdi"] if "first_kbdi" in saved.files else None,
+                       saved["started"] if "started" in saved.files else None)
+
+    def __str__(self):
+        return(str(type(self)) + " "
+               + "date: " + str(self.date) + " "
+               + "shape: " + str(self.kbdi.shape))
+
+    def __repr__(self):
+        return(str(type(self)) + " "
+               + "date: " + str(self.date) + " "
+               + "shape: " + str(self.kbdi.shape))
+
+
+class AnnualRainfall(object):
+
+    def __init__(self):
+        """
+        accumulates the yearly rainfall totals of daily rain data that comes in one or more
+        consecutive time chunks, and gives the mean annual rainfall following the rules of
+        KBDI.calculate_mean_annual_rainfall()
+        Every year is summed with one reduction once all of its days are seen, so the
+        totals don't depend on where the chunks split the years: the mean annual
+        rainfall of a record is the same for any chunking of it.
+
+        attributes of an AnnualRainfall:
+        --------------------------------
+        years: list
+            numpy datetime64[Y] of every year seen so far
+        year_sums: list
+            the rainfall total of every year seen so far (a NaN day makes it NaN)
+        year_rain_sums: list
+            the rainfall total of the not NaN days of every year seen so far
+        year_valid_days: list
+            the number of not NaN days of every year seen so far
+        year_days: list
+            the number of days seen of every year
+        year_starts: list
+            the first date (numpy datetime64[D]) seen of every year
+        last_year: numpy ndarray
+            the days seen of the last year, it is summed again when the next chunk continues it
+        """
+        self.years = []
+        self.year_sums = []
+        self.year_rain_sums = []
+        self.year_valid_days = []
+        self.year_days = []
+        self.year_starts = []
+        self.last_year = None
+
+    def add(self, raindata, dates):
+        """
+        adds the next chunk of daily rain data. The year boundaries are found from the
+        date axis and every year of the chunk is summed with one reduction call.
+
+        parameters:
+        ------------
+        raindata: numpy ndarray
+            daily rainfall [timestep, ...]. Only the days of its last year are copied
+        dates: numpy ndarray
+            the datetime64[D] date of every timestep
+        """
+        if len(dates) == 0:
+            return
+        years = dates.astype("datetime64[Y]")
+        starts = np.flatnonzero(np.concatenate(([True], years[1:] != years[:-1])))
+        stops = np.append(starts[1:], len(dates))
+        i = 0
+        while i < len(starts):
+            days = raindata[starts[i]:stops[i]]
+            if i == 0 and len(self.years) > 0 and self.years[-1] == years[0]: # the chunk continues the last year
+                days = np.concatenate((self.last_year, days))
+                self.year_days[-1] += stops[0] - starts[0]
+            else:
+                self.years.append(years[starts[i]])
+                self.year_sums.append(None)
+                self.year_rain_sums.append(None)
+                self.year_valid_days.append(None)
+                self.year_days.append(stops[i] - starts[i])
+                self.year_starts.append(dates[starts[i]])
+            self.year_sums[-1], self.year_rain_sums[-1], self.year_valid_days[-1] = _year_totals(days)
+            if i == len(starts) - 1:
+                self.last_year = np.array(days)
+            i+=1
+
+    def complete_years(self):
+        """
+        returns a boolean array, True for every year that has all of its days
+        """
+        years = np.array(self.years, dtype="datetime64[Y]")
+        first_days = years.astype("datetime64[D]")
+        days_in_year = ((years + 1).astype("datetime64[D]") - first_days).astype(int)
+        return (np.array(self.year_days, dtype=int) == days_in_year) & (np.array(self.year_starts, dtype="datetime64[D]") == first_days)
+
+    def mean(self):
+        """
+        returns the mean annual rainfall of every cell
+        """
+        complete = self.complete_years()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if np.any(complete):
+                yearly_sums = np.array(self.year_sums)[complete]
+                valid = ~np.isnan(yearly_sums)
+                annual_mean = _sum_years(np.where(valid, yearly_sums, 0)) / valid.sum(axis=0)
+            else:
+                annual_mean = _sum_years(self.year_rain_sums) / np.sum(self.year_valid_days, axis=0) * 365.25
+        return annual_mean
+
+
+def mean_annual_rainfall_raster(data):
+    """
+    returns a feature.Raster holding mean annual rainfall data, as used by KBDI
+    """
+    mean_rain = feature.Raster(data,
+                                {0: 0},
+                               datetime.datetime(1976, 7, 4),
+                               None,
+                               "standard",
+                               "mean annual rainfall",
+                               0,
+                               0,
+                               1,
+                               -1)
+    return mean_rain
+
+
+def _year_totals(days):
+    """
+    returns the rainfall total, the total of the not NaN days and the number of
+    not NaN days of the days of a year, summed the same way for any chunking
+    """
+    days = np.ascontiguousarray(days)
+    valid = ~np.isnan(days)
+    return _sum_days(days), _sum_days(np.where(valid, days, 0)), np.sum(valid, axis=0)
+
+
+def _sum_days(days):
+    """
+    returns the sum over the days (the first axis), adding one day after the other
+    like a running total for any number of cells. np.add.reduce does that for a
+    C-contiguous block of more than one cell, but sums a single cell pairwise
+    """
+    if days[0].size == 1:
+        return np.add.accumulate(days, axis=0)[-1]
+    return np.add.reduce(days, axis=0)
+
+
+def _sum_years(yearly):
+    """
+    returns the sum over the years (the first axis). Every cell is summed pairwise
+    like numpy sums a single cell, so a cell gives the same sum on its own or in a grid
+    """
+    yearly = np.asarray(yearly)
+    return np.add.reduce(np.ascontiguousarray(np.moveaxis(yearly, 0, -1)), axis=-1)
+
+
+def _float_array(data):
+    """
+    returns a copy of data as a floating point array. float32 and float64 data keep
+    their type, anything else becomes float64
+    """
+    data = np.asarray(data)
+    if np.issubdtype(data.dtype, np.floating):
+        return np.array(data)
+    return np.array(data, dtype=float)
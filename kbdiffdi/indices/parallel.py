@@ -0,0 +1,222 @@
+import os
+import weakref
+from concurrent import futures
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from kbdiffdi.features import feature
+from kbdiffdi.indices import kbdi
+from kbdiffdi.indices import ffdi
+
+class ParallelKBDIFFDI(object):
+
+    def __init__(self, initworkers=None, inittilesize=(64, 64)):
+        """
+        Computes KBDI, the drought factor and FFDI for a large grid on a pool of processes.
+        Every cell is independent, so the grid is split into spatial tiles and each
+        tile is run through KBDI -> drought factor -> FFDI by a worker. The input and output
+        cubes live in shared memory, so the workers read their tile and write their
+        results in place and no cube is ever pickled. The inputs are copied into shared
+        memory once and freed when the workers are done; the returned stacks are backed
+        by the output segments themselves, which are freed once the stacks are gone.
+
+        attributes:
+        -----------
+        workers: int
+            the number of worker processes (default: the number of CPUs)
+        tile_size: tuple
+            (rows, cols) of a tile
+        """
+        self.workers = initworkers
+        self.tile_size = inittilesize
+
+    def set_workers(self, newworkers):
+        self.workers = newworkers
+
+    def set_tile_size(self, newtilesize):
+        self.tile_size = newtilesize
+
+    def get_tiles(self, nrows, ncols):
+        """
+        returns a list of [row_start, row_stop, col_start, col_stop] tiles covering the grid
+        """
+        tile_rows, tile_cols = self.tile_size
+        tiles = []
+        for row in range(0, nrows, tile_rows):
+            for col in range(0, ncols, tile_cols):
+                tiles.append([row, min(row + tile_rows, nrows), col, min(col + tile_cols, ncols)])
+        return tiles
+
+    def fit(self, inittemp, initprcp, initwind, initrelhum, initmeanannualrainfall=None, initdroughtindex=np.array([[[[0]]]])):
+        """
+        Parameters:
+        ------------
+        inittemp: feature.RasterStack
+            daily temperature in C
+        initprcp: feature.RasterStack
+            daily precipitation in mm
+        initwind: feature.RasterStack
+            daily wind speed in km/hr
+        initrelhum: feature.RasterStack
+            daily relative humidity in %
+        initmeanannualrainfall: feature.Raster
+            the mean annual rainfall. If None, it's calculated from initprcp
+        initdroughtindex: ndarray
+            the drought index of the day before the first day
+
+        Returns:
+        ---------
+        KBDI: feature.RasterStack
+        FFDI: feature.RasterStack
+        DF: feature.RasterStack
+        """
+        shape = np.shape(inittemp.data)
+        day_shape = (1,) + shape[1:]
+        if initmeanannualrainfall is None: # calculated on the whole grid, a tile of one cell would sum its years in another order
+            KBDI = kbdi.KBDI()
+            KBDI.set_prcp(initprcp)
+            KBDI.calculate_mean_annual_rainfall()
+            initmeanannualrainfall = KBDI.get_mean_annual_rainfall()
+
+        shared = {}
+        try:
+            specs = {}
+            for key, stack in [("temp", inittemp), ("prcp", initprcp), ("wind", initwind), ("rel_hum", initrelhum)]:
+                shared[key] = SharedArray(shape, np.asarray(stack.data).dtype)
+                shared[key].array[...] = stack.data
+            for key, data in [("mean_annual_rainfall", np.asarray(initmeanannualrainfall.data)), ("drought_index", np.asarray(initdroughtindex))]:
+                shared[key] = SharedArray(day_shape, data.dtype)
+                shared[key].array[...] = np.broadcast_to(data, day_shape)
+            for key in ["kbdi", "df", "ffdi"]:
+                shared[key] = SharedArray(shape, np.result_type(np.asarray(inittemp.data).dtype, np.float32))
+            for key in shared:
+                specs[key] = shared[key].spec()
+            grid = (inittemp.datelist, inittemp.projection, inittemp.calendar, inittemp.mbr[0], inittemp.mbr[1], inittemp.cell_width, inittemp.cell_height)
+            tiles = self.get_tiles(shape[2], shape[3])
+
+            workers = self.workers or os.cpu_count() or 1
+            if workers == 1:
+                _init_worker(specs, grid)
+                try:
+                    for tile in tiles:
+                        _run_tile(tile)
+                finally:
+                    _release_worker()
+            else:
+                with futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs, grid)) as pool:
+                    list(pool.map(_run_tile, tiles)) # raises the error of a failed tile
+
+            # the inputs are freed before the outputs are handed over, and the outputs are not copied
+            for key in ["temp", "prcp", "wind", "rel_hum", "mean_annual_rainfall", "drought_index"]:
+                shared.pop(key).release()
+            out = []
+            for key, parent in [("kbdi", inittemp), ("ffdi", inittemp), ("df", inittemp)]:
+                stack = feature.RasterStack()
+                stack.create_stack_like(parent, shared.pop(key).detach())
+                out.append(stack)
+        finally:
+            for key in shared:
+                shared[key].release()
+        return out[0], out[1], out[2]
+
+
+class SharedArray(object):
+
+    def __init__(self, initshape, initdtype, initname=None):
+        """
+        a numpy array backed by a multiprocessing.shared_memory segment. If initname is None,
+        a new segment is created, otherwise the existing segment is attached.
+        """
+        self.shape = tuple(initshape)
+        self.dtype = np.dtype(initdtype)
+        nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        if initname is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=initname)
+            self.owner = False
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def spec(self):
+        """
+        what another process needs to attach the segment
+        """
+        return (self.shm.name, self.shape, self.dtype.str)
+
+    def release(self):
+        """
+        frees the segment. The array and any view on it must not be used afterwards
+        """
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def detach(self):
+        """
+        hands the array over to the caller. The segment's name is removed right away,
+        but the segment stays mapped until the array and every view on it are gone.
+        Closing it earlier would leave the array pointing at unmapped memory.
+
+        returns:
+        ---------
+        out: ndarray
+            the array backed by the segment
+        """
+        array = self.array
+        self.array = None
+        if self.owner:
+            self.shm.unlink()
+        # views on the array keep the array itself as their base, so it dies last
+        weakref.finalize(array, self.shm.close)
+        return array
+
+
+# the shared arrays of a worker process and the input stacks on them, set by _init_worker
+_worker_arrays = {}
+_worker_stacks = {}
+
+def _init_worker(specs, grid):
+    """
+    attaches the shared arrays and makes a stack on the whole grid of every input,
+    without copying: a tile of it is then a view (see feature.RasterStack.sel_bbox())
+    """
+    datelist, projection, calendar, x, y, cell_width, cell_height = grid
+    _worker_arrays.clear()
+    _worker_stacks.clear()
+    for key in specs:
+        name, shape, dtype = specs[key]
+        _worker_arrays[key] = SharedArray(shape, dtype, name)
+    for key in ["temp", "prcp", "wind", "rel_hum"]:
+        _worker_stacks[key] = feature.RasterStack()
+        _worker_stacks[key].create_sc_stack(_worker_arrays[key].array, datelist, projection, calendar, x, y, cell_width, cell_height, initcopy=False)
+
+def _release_worker():
+    _worker_stacks.clear()
+    for key in _worker_arrays:
+        _worker_arrays[key].release()
+    _worker_arrays.clear()
+
+def _run_tile(tile):
+    """
+    runs KBDI -> drought factor -> FFDI for one tile [row_start, row_stop, col_start, col_stop]
+    and writes the results into shared memory
+    """
+    rows = slice(tile[0], tile[1])
+    cols = slice(tile[2], tile[3])
+    stacks = {}
+    for key in _worker_stacks:
+        grid = _worker_stacks[key]
+        stacks[key] = grid.sel_bbox(grid.mbr[0] + tile[2] * grid.cell_width,
+                                    grid.mbr[1] + tile[0] * grid.cell_height,
+                                    grid.mbr[0] + (tile[3] - 1) * grid.cell_width,
+                                    grid.mbr[1] + (tile[1] - 1) * grid.cell_height)
+    mean_annual_rainfall = kbdi.mean_annual_rainfall_raster(_worker_arrays["mean_annual_rainfall"].array[:, :, rows, cols])
+    drought_index = _worker_arrays["drought_index"].array[:, :, rows, cols]
+    KBDI = kbdi.KBDI().fit(stacks["temp"], stacks["prcp"], mean_annual_rainfall, drought_index)
+    FFDI, DF = ffdi.FFDI().fit(KBDI, stacks["prcp"], stacks["temp"], stacks["wind"], stacks["rel_hum"])
+    _worker_arrays["kbdi"].array[:, :, rows, cols] = KBDI.data
+    _worker_arrays["df"].array[:, :, rows, cols] = DF.data
+    _worker_arrays["ffdi"].array[:, :, rows, cols] = FFDI.data
@@ -0,0 +1,158 @@
+import numpy as np
+
+from kbdiffdi.features import feature
+from kbdiffdi.indices import kbdi
+from kbdiffdi.indices import ffdi
+
+class StreamingKBDIFFDI(object):
+
+    def __init__(self):
+        """
+        Computes KBDI, the drought factor and FFDI one time chunk (for example one year)
+        at a time, so only one chunk of the inputs and outputs has to be in memory.
+        The KBDI recurrence state (KBDIState) and the past days of rain events for the FFDI
+        window (RainEventWindow) are carried across the chunk edges, so the output is the
+        same as a full run over the whole record.
+
+        attributes:
+        -----------
+        kbdi_state: kbdi.KBDIState
+            the KBDI state after the last chunk
+        window: ffdi.RainEventWindow
+            the rain event window after the last chunk
+        """
+        self.kbdi_state = None
+        self.window = None
+
+    def get_kbdi_state(self):
+        return self.kbdi_state
+
+    def get_window(self):
+        return self.window
+
+    def mean_annual_rainfall(self, prcp_chunks):
+        """
+        Calculates the mean annual rainfall from a stream of precipitation chunks, with the
+        rules of KBDI.calculate_mean_annual_rainfall(). A full run gets the mean annual
+        rainfall from the whole record, so for the same result a streaming run needs
+        it before the first chunk. This is a cheap first pass over the precipitation only.
+        The result is exactly the one of a full run, whatever the chunk size.
+
+        Parameters:
+        ------------
+        prcp_chunks: iterable
+            feature.RasterStacks of daily precipitation in mm, consecutive in time
+
+        Returns:
+        ---------
+        out: feature.Raster
+            the mean annual rainfall
+        """
+        annual_rainfall = kbdi.AnnualRainfall()
+        for prcp in prcp_chunks:
+            prcp.load() # a chunk of a lazy stack is only read now
+            annual_rainfall.add(prcp.data, prcp.get_datetime64())
+        return kbdi.mean_annual_rainfall_raster(np.array([annual_rainfall.mean()]))
+
+    def fit(self, chunks, initmeanannualrainfall, initdroughtindex=np.array([[[[0]]]])):
+        """
+        A generator that yields the results chunk by chunk.
+
+        Parameters:
+        ------------
+        chunks: iterable
+            (temp, prcp, wind, rel_hum) tuples of feature.RasterStacks, consecutive in time.
+            temp in C, prcp in mm, wind in km/hr and rel_hum in %
+        initmeanannualrainfall: feature.Raster
+            the mean annual rainfall of the whole record (see mean_annual_rainfall())
+        initdroughtindex: ndarray
+            the drought index of the day before the first day
+
+        Yields:
+        ---------
+        KBDI: feature.RasterStack
+        FFDI: feature.RasterStack
+        DF: feature.RasterStack
+            the results for the days of one chunk
+        """
+        self.kbdi_state = None
+        self.window = None
+        for temp, prcp, wind, rel_hum in chunks:
+            for stack in (temp, prcp, wind, rel_hum):
+                stack.load() # a chunk of a lazy stack is only read now
+            KBDI = kbdi.KBDI()
+            if self.kbdi_state is None:
+                out_kbdi = KBDI.fit(temp, prcp, initmeanannualrainfall, initdroughtindex)
+            else:
+                out_kbdi = KBDI.update(self.kbdi_state, temp, prcp)
+            if out_kbdi is None: # the chunk doesn't follow the last one
+                return
+            self.kbdi_state = KBDI.get_state()
+
+            FFDI = ffdi.FFDI()
+            if self.window is None:
+                out_ffdi, out_df = FFDI.fit(out_kbdi, prcp, temp, wind, rel_hum)
+            else:
+                out_ffdi, out_df = FFDI.update(self.window, out_kbdi, prcp, temp, wind, rel_hum)
+            self.window = FFDI.get_window()
+            yield out_kbdi, out_ffdi, out_df
+
+    def fit_to_memmap(self, temp, prcp, wind, rel_hum, kbdi_filename, ffdi_filename, df_filename, initmeanannualrainfall=None, initdroughtindex=np.array([[[[0]]]]), chunk_days=365):
+        """
+        Computes KBDI, FFDI and the drought factor for stacks that may be larger than
+        memory (for example memory-mapped stacks, see feature.RasterStack.open_memmap_stack(),
+        or lazily read NetCDF variables, see utilities.netcdf.load_netcdf())
+        and writes the results into memory-mapped RasterStack files. The inputs are read
+        and the outputs are written one time chunk at a time.
+
+        Parameters:
+        ------------
+        temp: feature.RasterStack
+            temperature in C
+        prcp: feature.RasterStack
+            precipitation in mm
+        wind: feature.RasterStack
+            wind speed in km/hr
+        rel_hum: feature.RasterStack
+            relative humidity in %
+        kbdi_filename, ffdi_filename, df_filename: str
+            the RasterStack files the KBDI, FFDI and drought factor are written to
+        initmeanannualrainfall: feature.Raster
+            the mean annual rainfall. If None, it is calculated from prcp with
+            an extra pass over the precipitation (see mean_annual_rainfall()), the
+            results are then bit-identical to a full run as well
+        initdroughtindex: ndarray
+            the drought index of the day before the first day
+        chunk_days: int
+            the number of days per chunk
+
+        Returns:
+        ---------
+        KBDI: feature.RasterStack
+        FFDI: feature.RasterStack
+        DF: feature.RasterStack
+            the memory-mapped results
+        """
+        if initmeanannualrainfall is None:
+            initmeanannualrainfall = self.mean_annual_rainfall(prcp.get_time_chunks(chunk_days))
+        outputs = []
+        for filename in (kbdi_filename, ffdi_filename, df_filename):
+            out = feature.RasterStack()
+            out.create_memmap_stack(filename, temp.data.shape, temp.datelist, temp.projection, temp.calendar,
+                                    temp.mbr[0], temp.mbr[1], temp.cell_width, temp.cell_height)
+            outputs.append(out)
+        out_kbdi, out_ffdi, out_df = outputs
+        chunks = zip(temp.get_time_chunks(chunk_days),
+                     prcp.get_time_chunks(chunk_days),
+                     wind.get_time_chunks(chunk_days),
+                     rel_hum.get_time_chunks(chunk_days))
+        start = 0
+        for KBDI, FFDI, DF in self.fit(chunks, initmeanannualrainfall, initdroughtindex):
+            stop = start + len(KBDI.data)
+            out_kbdi.data[start:stop] = KBDI.data
+            out_ffdi.data[start:stop] = FFDI.data
+            out_df.data[start:stop] = DF.data
+            start = stop
+        for out in outputs:
+            out.flush()
+        return out_kbdi, out_ffdi, out_df
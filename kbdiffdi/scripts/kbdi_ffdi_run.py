@@ -20,6 +20,12 @@ def __parse_args():
                         dest='output_filename',
                         required=True,
                         type=str)
+    parser.add_argument('-c',
+                        '--cache',
+                        dest='cache',
+                        action='store_true',
+                        default=False,
+                        help='keep the parsed input in a .kbdiffdi_cache directory next to it, so the next run skips parsing')
     parser.add_argument('-v',
                         '--verbose',
                         dest='verbose',
@@ -31,6 +37,7 @@ def __parse_args():
         print("------------ User Input ----------------")
         print('input file:\t' + args.input_filename)
         print('output file:\t' + args.output_filename)
+        print('cache:\t\t' + str(args.cache))
         print()
 
     return args
@@ -55,9 +62,12 @@ def __check_args(args):
 
     return args_are_good
 
-def run_kbdi_ffdi(input_filename, output_filename):
+def run_kbdi_ffdi(input_filename, output_filename, use_cache=False):
     print('[INFO] reading input')
-    rain, temp, relhum, wind = input_output.load_csv(input_filename)
+    input_cache = None
+    if use_cache:
+        input_cache = cache.InputCache()
+    rain, temp, relhum, wind = input_output.load_csv(input_filename, cache=input_cache)
     
     print("[INFO] computing KBDI")
     kbdi = indices.KBDI()
@@ -86,7 +96,7 @@ def main():
     args = __parse_args()
 
     if __check_args(args):
-        run_kbdi_ffdi(args.input_filename, args.output_filename)
+        run_kbdi_ffdi(args.input_filename, args.output_filename, args.cache)
 
     tot_sec = time.time() - start_time
     minutes = int(tot_sec // 60)
@@ -1,3 +1,5 @@
 from .conversion import *
 from .input_output import *
-from .plotter import *
\ No newline at end of file
+from .plotter import *
+from .cache import *
+from .netcdf import *
\ No newline at end of file
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+
+class InputCache(object):
+
+    def __init__(self, initdirectory=None, initmaxbytes=1 << 30):
+        """
+        An on-disk cache of parsed input files, so a file that was parsed before is
+        read back as binary arrays instead of being parsed again.
+        An entry is a .npy file per parsed array (read back memory-mapped) and a .json
+        file with the source's path, size, modification time and content hash. An entry
+        is used when the size and modification time of the source still match, or
+        when they don't but its content hash does (a copied or touched file).
+        When the cache grows over maxbytes, the least recently used entries are removed.
+        A cache can be shared by threads (see input_output.load_csv_directory()), a cache
+        directory by processes. If the cache fails, the file is parsed as if there was none.
+
+        attributes:
+        -----------
+        directory: str
+            the cache directory. If None, a .kbdiffdi_cache directory next to every source file
+        max_bytes: int
+            the largest total size of the entries in a cache directory
+        lock: threading.RLock
+            serialises the stores and evictions of the threads using the cache
+        """
+        self.directory = initdirectory
+        self.max_bytes = initmaxbytes
+        self.lock = threading.RLock()
+
+    def set_directory(self, newdirectory):
+        self.directory = newdirectory
+
+    def set_max_bytes(self, newmaxbytes):
+        self.max_bytes = newmaxbytes
+
+    def get_directory(self, filename):
+        """
+        returns the cache directory of a source file
+        """
+        if self.directory is None:
+            return os.path.join(os.path.dirname(os.path.abspath(filename)), ".kbdiffdi_cache")
+        return self.directory
+
+    def get_entry(self, filename):
+        """
+        returns the path (without extension) of the cache entry of a source file
+        """
+        path = os.path.abspath(filename)
+        key = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.get_directory(filename), os.path.basename(path) + "-" + key)
+
+    def load(self, filename, parser):
+        """
+        returns the parsed arrays of a source file, from the cache if the source
+        didn't change, else from parser(filename), which are then cached
+
+        parameters:
+        ------------
+        filename: str
+            the source file
+        parser: function
+            parser(filename) returns the parsed arrays of the file as a tuple of numpy ndarrays
+        returns:
+        ---------
+        arrays: tuple
+            the parsed arrays. Arrays read from the cache are read-only memory maps
+        """
+        try:
+            arrays = self.lookup(filename)
+        except OSError as error:
+            print("error: could not read the cache entry of " + str(filename) + ", parsing it: " + str(error))
+            arrays = None
+        if arrays is None:
+            arrays = tuple(parser(filename))
+            try:
+                self.store(filename, arrays)
+            except OSError as error:
+                print("error: could not cache " + str(filename) + ": " + str(error))
+        return arrays
+
+    def lookup(self, filename):
+        """
+        returns the cached arrays of a source file, or None if there is no valid entry
+        """
+        entry = self.get_entry(filename)
+        try:
+            with open(entry + ".json", "r") as metadatafile:
+                metadata = json.load(metadatafile)
+        except (OSError, ValueError):
+            return None
+        stat = os.stat(filename)
+        if metadata["size"] != stat.st_size:
+            return None
+        if metadata["mtime_ns"] != stat.st_mtime_ns:
+            if metadata["sha1"] != _content_hash(filename):
+                return None
+            metadata["mtime_ns"] = stat.st_mtime_ns # the same content, a touched or copied file
+            _write_json(entry + ".json", metadata)
+        try:
+            arrays = tuple(np.load(entry + "." + str(index) + ".npy", mmap_mode="r") for index in range(metadata["narrays"]))
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(entry + ".json") # the last use, for the eviction
+        except FileNotFoundError: # evicted meanwhile, the open memory maps stay valid
+            pass
+        return arrays
+
+    def store(self, filename, arrays):
+        """
+        caches the parsed arrays of a source file and removes the least recently used
+        entries if the cache directory is then larger than max_bytes
+        """
+        entry = self.get_entry(filename)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        stat = os.stat(filename)
+        with self.lock:
+            for index, array in enumerate(arrays):
+                # written under a temporary name first, so a reader never sees half an array
+                tmpname = _tmp_name(entry + "." + str(index))
+                with open(tmpname, "wb") as arrayfile:
+                    np.save(arrayfile, np.asarray(array))
+                os.replace(tmpname, entry + "." + str(index) + ".npy")
+            metadata = {"path": os.path.abspath(filename),
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "sha1": _content_hash(filename),
+                        "narrays": len(arrays)}
+            _write_json(entry + ".json", metadata) # the entry is valid once its .json exists
+            self.evict(os.path.dirname(entry))
+
+    def evict(self, directory):
+        """
+        removes the least recently used entries of a cache directory until
+        its total size is at most max_bytes. The .tmp files and the entries without
+        a .json younger than a minute are being written (by another process) and are
+        left alone, files removed meanwhile by another process are skipped.
+        """
+        with self.lock:
+            entries = {}
+            sizes = {}
+            for name in os.listdir(directory):
+                if name.endswith(".tmp"):
+                    continue
+                stat = _stat(os.path.join(directory, name))
+                if stat is None:
+                    continue
+                entries.setdefault(_entry_name(name), []).append(name)
+                sizes[name] = stat
+            total = sum(stat.st_size for stat in sizes.values())
+            # an entry without a .json is a store that didn't finish: one that failed goes first,
+            # one that is still being written is kept
+            last_use = {}
+            now = time.time()
+            for entry in entries:
+                if entry + ".json" in entries[entry]:
+                    last_use[entry] = sizes[entry + ".json"].st_mtime
+                elif now - max(sizes[name].st_mtime for name in entries[entry]) > 60:
+                    last_use[entry] = -1
+            for entry in sorted(last_use, key=last_use.get):
+                if total <= self.max_bytes:
+                    break
+                # the .json goes first, it invalidates the entry
+                for name in sorted(entries[entry], key=lambda name: not name.endswith(".json")):
+                    total -= sizes[name].st_size
+                    _remove(os.path.join(directory, name))
+
+    def clear(self, filename):
+        """
+        removes the cache entry of a source file
+        """
+        entry = self.get_entry(filename)
+        directory = os.path.dirname(entry)
+        if not os.path.isdir(directory):
+            return
+        with self.lock:
+            for name in os.listdir(directory):
+                if name.startswith(os.path.basename(entry) + "."):
+                    _remove(os.path.join(directory, name))
+
+
+def _content_hash(filename):
+    """
+    returns the sha1 hex digest of a file's content
+    """
+    content_hash = hashlib.sha1()
+    with open(filename, "rb") as sourcefile:
+        for block in iter(lambda: sourcefile.read(1 << 20), b""):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def _entry_name(name):
+    """
+    returns the entry of a (not .tmp) file in a cache directory: its name without
+    the .json or .<index>.npy extension
+    """
+    if name.endswith(".json"):
+        return name[:-len(".json")]
+    if name.endswith(".npy"):
+        name = name[:-len(".npy")]
+    return name.rsplit(".", 1)[0]
+
+
+def _tmp_name(filename):
+    """
+    returns a temporary name for filename that no other process or thread writes to
+    """
+    return filename + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp"
+
+
+def _stat(path):
+    """
+    returns os.stat(path), or None if the file is gone
+    """
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _remove(path):
+    """
+    removes a file if it is still there
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_json(filename, metadata):
+    tmpname = _tmp_name(filename)
+    with open(tmpname, "w") as metadatafile:
+        json.dump(metadata, metadatafile)
+    os.replace(tmpname, filename)
@@ -1,6 +1,9 @@
 import os
-import csv
+import re
+import glob
+import gzip
 import datetime
+from concurrent import futures
 
 import numpy as np
 # from osgeo import gdal
@@ -10,12 +13,25 @@ import numpy as np
 from kbdiffdi.utilities import conversion
 from kbdiffdi.features import feature
 
-def load_csv(filename):
+def load_csv(filename, dtype=np.float64, cache=None):
     """
+    Reads a station csv. The date (YYYYMMDD), rainfall, temperature, relative humidity
+    and wind speed columns are found from the header (see csv_layout()), so both
+    the Knysna.csv and the George.csv/PortElizabeth.csv layouts can be read. Only these
+    columns are parsed, straight to numbers. If the header doesn't name them, the
+    date is read from column 1 and the inputs from columns 2 - 5. Blank values are NaN
+    and rows without a date are skipped.
+
     Parameters:
     ------------
     filename: str
         the full path and filename of the input csv
+    dtype: numpy dtype
+        the dtype policy of the returned stacks. numpy.float32 halves the memory
+        and KBDI and FFDI then also calculate in float32
+    cache: cache.InputCache
+        if given, the parsed columns are kept in this cache and read back from it
+        as long as the file doesn't change
 
     Returns:
     --------
@@ -30,62 +46,313 @@ def load_csv(filename):
         NOTE: it expects to read wind data in meters per second from the
           input csv. The wind values are converted to kilometers per hour
     """
-    indata = np.loadtxt(filename, dtype=str, delimiter=",")
-    datelist = []
-    out_rainfall = indata[1:,2].astype(float).reshape(-1,1,1,1)
-    out_temp = indata[1:,3].astype(float).reshape(-1,1,1,1)
-    out_rel_hum = indata[1:,4].astype(float).reshape(-1,1,1,1)
-    out_wind = indata[1:,5].astype(float).reshape(-1,1,1,1)
-    for row in indata[1:]:
-        datelist.append(datetime.datetime(year=int(row[1][:4]),month=int(row[1][4:6]),day=int(row[1][6:]))) # append the datetime ob
+    datelist, indata = read_station(filename, cache)
     # create the featureStacks
     rain = feature.RasterStack()
-    rain.create_sc_stack(out_rainfall, datelist, None, "standard", 0, 0, 1, -1)
+    rain.create_sc_stack(indata[:,0].reshape(-1,1,1,1), datelist, None, "standard", 0, 0, 1, -1, dtype)
     temp = feature.RasterStack()
-    temp.create_sc_stack(out_temp, datelist, None, "standard", 0, 0, 1, -1)
+    temp.create_sc_stack(indata[:,1].reshape(-1,1,1,1), datelist, None, "standard", 0, 0, 1, -1, dtype)
     relhum = feature.RasterStack()
-    relhum.create_sc_stack(out_rel_hum, datelist, None, "standard", 0, 0, 1, -1)
+    relhum.create_sc_stack(indata[:,2].reshape(-1,1,1,1), datelist, None, "standard", 0, 0, 1, -1, dtype)
     wind = feature.RasterStack()
-    wind.create_sc_stack(out_wind, datelist, None, "standard", 0, 0, 1, -1)
+    wind.create_sc_stack(indata[:,3].reshape(-1,1,1,1), datelist, None, "standard", 0, 0, 1, -1, dtype)
     conversion.mpers_to_kmperh(wind)
     return rain, temp, relhum, wind
 
-def write_kbdi(inputfilename, outputfilename, KBDIobject):
-    kbdi = KBDIobject.data.flatten()
-    with open(inputfilename, "r") as inputcsv:
-        with open(outputfilename, "w", newline="") as outputcsv:
-            reader = csv.reader(inputcsv, delimiter=",")
-            writer = csv.writer(outputcsv, delimiter=",")
-            index = 0
-            firstRow = True
-            for row in reader:
-                if firstRow:
-                    firstRow = False
-                    row.extend(["KBDI"])
-                else:
-                    row.extend([kbdi[index]])
-                    index+=1
-                writer.writerow(row)
-
-def write_csv(inputfilename, outputfilename, KBDIobject=None, FFDIobject=None, DFobject=None):
-    if KBDIobject:
-        kbdi = KBDIobject.data.flatten()
-    if FFDIobject:
-        ffdi = FFDIobject.data.flatten()
-    if DFobject:
-        df = DFobject.data.flatten()
-    with open(inputfilename, "r") as inputcsv:
-        with open(outputfilename, "w", newline="") as outputcsv:
-            reader = csv.reader(inputcsv, delimiter=",")
-            writer = csv.writer(outputcsv, delimiter=",")
-            index = 0
-            firstRow = True
-            for row in reader:
-                if firstRow:
-                    firstRow = False
-                    row.extend(["KBDI", "DF", "FFDI"])
+def read_station(filename, cache=None):
+    """
+    reads the dates and inputs of a station csv (see load_csv())
+
+    Parameters:
+    ------------
+    filename: str
+        the full path and filename of the input csv
+    cache: cache.InputCache
+        if given, the file is only parsed if the cache doesn't hold it yet
+
+    Returns:
+    --------
+    dates: numpy ndarray
+        the dates as datetime64[D]
+    values: numpy ndarray
+        float64 [day, 4]: rainfall (mm), temperature (C), relative humidity (%)
+        and wind speed (m/s, as read)
+    """
+    if cache is not None:
+        return cache.load(filename, _parse_station)
+    return _parse_station(filename)
+
+def _parse_station(filename):
+    """
+    parses the dates and inputs of a station csv, see read_station()
+    """
+    with open(filename, "r", encoding="latin-1") as inputcsv:
+        header = inputcsv.readline()
+    layout = csv_layout(header)
+    if layout is None: # the columns used before the layout was read from the header
+        layout = {"date": 1, "rain": 2, "temp": 3, "rel_hum": 4, "wind": 5}
+    usecols = [layout["date"], layout["rain"], layout["temp"], layout["rel_hum"], layout["wind"]]
+    try:
+        # numpy's C parser, reads the columns straight to numbers
+        indata = np.loadtxt(filename, dtype=np.float64, delimiter=",", skiprows=1, usecols=usecols, encoding="latin-1", ndmin=2)
+    except ValueError:
+        # blank values or short rows, read them as NaN
+        indata = _read_columns(filename, usecols)
+    indata = indata[~np.isnan(indata[:,0])]
+    return yyyymmdd_to_datetime64(indata[:,0].astype(np.int64)), indata[:,1:]
+
+def load_csv_directory(directory, pattern="*.csv", dtype=np.float64, workers=None, cache=None):
+    """
+    Reads every station csv in a directory (see load_csv()) into VectorStacks, so
+    KBDI and FFDI calculate all stations in one call. The files are read on a pool
+    of threads. The stations are aligned on the union of their dates, a station is
+    NaN on the dates its file doesn't have. The KBDI of a station starts on its first
+    date (see KBDI.calculate_start_days()), but a gap in its record makes it NaN from
+    then on, where a run on its own file takes the rows around the gap as consecutive days.
+
+    Parameters:
+    ------------
+    directory: str
+        the directory of the station csv files
+    pattern: str
+        the glob pattern of the station files in the directory
+    dtype: numpy dtype
+        the dtype policy of the returned stacks
+    workers: int
+        the number of threads reading files (default: see concurrent.futures.ThreadPoolExecutor)
+    cache: cache.InputCache
+        if given, the parsed files are kept in this cache (see load_csv())
+
+    Returns:
+    --------
+    rain, temp, relhum, wind: feature.VectorStack
+        as returned by load_csv(), with a station per file. The names of the stations
+        are the file names, their geoms the [longitude, latitude] found in the
+        station description (NaN if it has none)
+    """
+    filenames = sorted(glob.glob(os.path.join(directory, pattern)))
+    if len(filenames) == 0:
+        print("error: no files matching " + pattern + " in " + directory)
+        return None
+    with futures.ThreadPoolExecutor(workers) as executor:
+        stations = list(executor.map(read_station, filenames, [cache] * len(filenames)))
+    dates = np.unique(np.concatenate([station_dates for station_dates, values in stations])) # the union, sorted
+    data = np.full((4, len(dates), len(filenames)), np.nan)
+    for index, (station_dates, values) in enumerate(stations):
+        data[:, np.searchsorted(dates, station_dates), index] = values.T
+    names = [os.path.basename(filename) for filename in filenames]
+    geoms = [_station_coordinates(filename) for filename in filenames]
+    out = []
+    for values in data:
+        stack = feature.VectorStack()
+        stack.create_stack(values, dates, None, "standard", geoms, names, dtype)
+        out.append(stack)
+    rain, temp, relhum, wind = out
+    conversion.mpers_to_kmperh(wind)
+    return rain, temp, relhum, wind
+
+def write_csv_directory(inputdirectory, outputdirectory, KBDIobject=None, FFDIobject=None, DFobject=None, precision=None, compress=False, workers=None, cache=None):
+    """
+    writes a csv per station of VectorStacks made by load_csv_directory(): the station's
+    input csv with its KBDI, DF and FFDI columns appended (see write_csv()), under the
+    same file name in outputdirectory
+
+    Parameters:
+    ------------
+    inputdirectory: str
+        the directory the stations were read from
+    outputdirectory: str
+        the directory the station files are written to, it must not be the inputdirectory
+    KBDIobject, FFDIobject, DFobject: feature.VectorStack
+        the results of all stations
+    precision: int
+        the number of decimals written (see write_csv())
+    compress: bool
+        if True, the files are gzip compressed and .gz is added to their names
+    workers: int
+        the number of threads writing files
+    cache: cache.InputCache
+        the cache the stations were read with (see load_csv_directory()), so
+        their dates aren't parsed again
+
+    Returns:
+    --------
+    None
+    """
+    if os.path.abspath(inputdirectory) == os.path.abspath(outputdirectory):
+        print("error: the output directory must not be the input directory")
+        return
+    names = []
+    objects = []
+    for name, obj in [("KBDI", KBDIobject), ("DF", DFobject), ("FFDI", FFDIobject)]:
+        if obj is not None:
+            names.append(name)
+            objects.append(obj)
+    if len(objects) == 0:
+        print("error: there are no results to write")
+        return
+    dates = objects[0].get_datetime64()
+
+    def write_station(index):
+        filename = objects[0].names[index]
+        inputfilename = os.path.join(inputdirectory, filename)
+        outputfilename = os.path.join(outputdirectory, filename + (".gz" if compress else ""))
+        station_dates = read_station(inputfilename, cache)[0]
+        rows = np.searchsorted(dates, station_dates)
+        columns = [obj.data[rows, index] for obj in objects]
+        write_columns(inputfilename, outputfilename, names, columns, precision)
+
+    with futures.ThreadPoolExecutor(workers) as executor:
+        list(executor.map(write_station, range(objects[0].nstations)))
+
+def csv_layout(header):
+    """
+    returns the column index of every input in a station csv header, as a dict with
+    the keys "date", "rain", "temp", "rel_hum" and "wind", or None if one isn't found.
+    The date column is called "Date" or "yyyymmdd", the other columns are found by
+    "rain", "temp", "humidity" and "wind" in their names (case insensitive)
+    """
+    names = [name.strip().lower() for name in header.split(",")]
+    layout = {}
+    for index, name in enumerate(names):
+        if name in ("date", "yyyymmdd"):
+            key = "date"
+        elif "rain" in name:
+            key = "rain"
+        elif name.startswith("temp"):
+            key = "temp"
+        elif "humidity" in name:
+            key = "rel_hum"
+        elif "wind" in name:
+            key = "wind"
+        else:
+            continue
+        layout.setdefault(key, index)
+    if len(layout) != 5:
+        return None
+    return layout
+
+def yyyymmdd_to_datetime64(yyyymmdd):
+    """
+    returns YYYYMMDD integers as a numpy datetime64[D] array, in one go
+    """
+    yyyymmdd = np.asarray(yyyymmdd, dtype=np.int64)
+    months = (yyyymmdd // 10000 - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (yyyymmdd // 100 % 100 - 1)
+    return months.astype("datetime64[D]") + (yyyymmdd % 100 - 1)
+
+def _read_columns(filename, usecols):
+    """
+    reads the usecols columns of a csv (without its header) as a float64 array,
+    blank values and values missing from short rows are NaN
+    """
+    with open(filename, "r", encoding="latin-1") as inputcsv:
+        rows = [line.rstrip("\r\n").split(",") for line in inputcsv.readlines()[1:]]
+    columns = []
+    for col in usecols:
+        column = np.array([row[col].strip() if col < len(row) else "" for row in rows])
+        columns.append(np.where(column == "", "nan", column).astype(np.float64))
+    return np.stack(columns, axis=1).reshape(-1, len(usecols))
+
+def write_kbdi(inputfilename, outputfilename, KBDIobject, precision=None, block_rows=65536):
+    """
+    writes the input csv with a KBDI column appended, see write_csv()
+    """
+    write_columns(inputfilename, outputfilename, ["KBDI"], [KBDIobject.data], precision, block_rows)
+
+def write_csv(inputfilename, outputfilename, KBDIobject=None, FFDIobject=None, DFobject=None, precision=None, block_rows=65536):
+    """
+    writes the input csv with KBDI, DF and FFDI columns appended to its rows.
+    Only the given objects are written, in the order KBDI, DF, FFDI.
+
+    Parameters:
+    ------------
+    inputfilename: str
+        the csv the objects were calculated from (see load_csv())
+    outputfilename: str
+        the output csv. If it ends with .gz, the output is gzip compressed
+    KBDIobject, FFDIobject, DFobject: feature.RasterStack or feature.VectorStack
+        the results, one value per row with a date of the input csv (the rows read
+        by load_csv()). The rows without a date are left out
+    precision: int
+        the number of decimals written. If None, the shortest text that reads back
+        as the same value is written
+    block_rows: int
+        the number of rows formatted and written at once
+
+    Returns:
+    --------
+    None
+    """
+    names = []
+    columns = []
+    for name, obj in [("KBDI", KBDIobject), ("DF", DFobject), ("FFDI", FFDIobject)]:
+        if obj is not None:
+            names.append(name)
+            columns.append(obj.data)
+    write_columns(inputfilename, outputfilename, names, columns, precision, block_rows)
+
+def write_columns(inputfilename, outputfilename, names, columns, precision=None, block_rows=65536):
+    """
+    writes the input csv with a column per data array appended to its rows (see write_csv()).
+    The input rows with a date are copied as they are, the values are formatted a block of rows
+    at a time with a single string format and written in large chunks.
+    """
+    columns = [np.asarray(column).reshape(-1) for column in columns]
+    with open(inputfilename, "r", encoding="latin-1", newline="") as inputcsv:
+        rows = inputcsv.read().splitlines()
+    header, rows = rows[0], rows[1:]
+    rows = _dated_rows(header, rows) # the rows load_csv() reads
+    for name, column in zip(names, columns):
+        if len(column) != len(rows):
+            print("error: " + name + " has " + str(len(column)) + " values but " + inputfilename + " has " + str(len(rows)) + " rows")
+            return
+    if precision is None:
+        value_format = "%s"
+    else:
+        value_format = "%." + str(int(precision)) + "f"
+    row_format = "%s" + ("," + value_format) * len(columns) + "\r\n"
+    with _open_output(outputfilename) as outputcsv:
+        outputcsv.write(",".join([header] + names) + "\r\n")
+        for start in range(0, len(rows), block_rows):
+            stop = min(start + block_rows, len(rows))
+            items = [None] * ((stop - start) * (len(columns) + 1))
+            items[0::len(columns) + 1] = rows[start:stop]
+            for index, column in enumerate(columns):
+                if precision is None:
+                    items[index + 1::len(columns) + 1] = column[start:stop].astype(str).tolist()
                 else:
-                    row.extend([kbdi[index],df[index],ffdi[index]])
-                    index+=1
-                writer.writerow(row)
-                    
\ No newline at end of file
+                    items[index + 1::len(columns) + 1] = column[start:stop].tolist()
+            outputcsv.write((row_format * (stop - start)) % tuple(items))
+
+def _dated_rows(header, rows):
+    """
+    returns the rows of a station csv that have a date, found like in load_csv()
+    """
+    layout = csv_layout(header)
+    date = 1 if layout is None else layout["date"]
+    dated = []
+    for row in rows:
+        fields = row.split(",", date + 1)
+        if date < len(fields) and fields[date].strip() != "":
+            dated.append(row)
+    return dated
+
+def _open_output(outputfilename):
+    """
+    opens a text file for writing with a large buffer, gzip compressed if the name ends with .gz
+    """
+    if outputfilename.endswith(".gz"):
+        return gzip.open(outputfilename, "wt", encoding="latin-1", newline="")
+    return open(outputfilename, "w", encoding="latin-1", newline="", buffering=1 << 20)
+
+def _station_coordinates(filename):
+    """
+    returns [longitude, latitude] of a station, found as "latitude longitude"
+    (like -34.0590 23.0910) in the first lines of its csv, or [NaN, NaN]
+    """
+    with open(filename, "r", encoding="latin-1") as inputcsv:
+        text = inputcsv.readline() + inputcsv.readline()
+    match = re.search(r"(-?\d+\.\d+)\s+(-?\d+\.\d+)", text)
+    if match is None:
+        return [np.nan, np.nan]
+    return [float(match.group(2)), float(match.group(1))]
@@ -0,0 +1,315 @@
+import datetime
+
+import numpy as np
+
+from kbdiffdi.features import feature
+
+# netCDF4 is optional, it's only imported when a NetCDF file is read or written
+
+class NetCDFArray(object):
+
+    def __init__(self, initvariable, initfliprows=False, initselection=None):
+        """
+        A lazily read [timestep, layer, row, col] view on a NetCDF variable
+        of shape [time, y, x] or [time, layer, y, x]. Slicing it with slices gives a
+        NetCDFArray of the selection without reading anything, numpy.asarray() and
+        indexing with an integer read the selection from the file, only the file
+        chunks it covers are read and decompressed.
+        Masked (fill) values are NaN.
+
+        attributes:
+        -----------
+        variable: netCDF4.Variable
+            the variable (or an object with a shape, a dtype and a __getitem__
+            that reads basic slices like one, for example a numpy masked array)
+        flip_rows: bool
+            True if the y coordinate of the variable increases with the row (south to
+            north), the rows are then reversed so the first row is the northern one
+        selection: list
+            a range per axis [timestep, layer, row, col]: the variable's indices in the view
+            (the row indices before the flip)
+        shape: tuple
+            the shape of the view
+        dtype: numpy dtype
+            the floating point type the values are read as
+        """
+        self.variable = initvariable
+        self.flip_rows = initfliprows
+        shape = tuple(initvariable.shape)
+        if len(shape) == 3: # no layer dimension
+            shape = (shape[0], 1) + shape[1:]
+        if initselection is None:
+            initselection = [range(n) for n in shape]
+        self.selection = initselection
+        self.shape = tuple(len(axis) for axis in self.selection)
+        self.ndim = 4
+        if hasattr(initvariable, "scale_factor") or hasattr(initvariable, "add_offset"):
+            self.dtype = np.dtype(np.float64) # unpacked by netCDF4 as float64
+        else:
+            self.dtype = np.result_type(initvariable.dtype, np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(index is Ellipsis for index in key):
+            position = [index is Ellipsis for index in key].index(True)
+            key = key[:position] + (slice(None),) * (4 - len(key) + 1) + key[position + 1:]
+        key = key + (slice(None),) * (4 - len(key))
+        if len(key) != 4:
+            raise IndexError("too many indices for a [timestep, layer, row, col] array")
+        if not all(isinstance(index, (slice, int, np.integer)) for index in key):
+            return np.asarray(self)[key] # advanced indexing reads the whole view first
+        selection = []
+        squeeze = []
+        for axis, index in enumerate(key):
+            if isinstance(index, slice):
+                selection.append(self.selection[axis][index])
+            else:
+                position = self.selection[axis][index] # raises IndexError if out of range
+                selection.append(range(position, position + 1))
+                squeeze.append(axis)
+        view = NetCDFArray(self.variable, self.flip_rows, selection)
+        if len(squeeze) == 0:
+            return view
+        return np.asarray(view).squeeze(axis=tuple(squeeze))
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.read()
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+    def read(self):
+        """
+        reads the view from the file: the smallest block of the variable holding
+        the selection is read, then the selection is taken from it
+        """
+        if 0 in self.shape:
+            return np.empty(self.shape, dtype=self.dtype)
+        nrows = self.variable.shape[-2]
+        indices = []
+        for axis, selection in enumerate(self.selection):
+            index = np.asarray(selection)
+            if axis == 2 and self.flip_rows:
+                index = nrows - 1 - index
+            indices.append(index)
+        block = tuple(slice(int(index.min()), int(index.max()) + 1) for index in indices)
+        if len(self.variable.shape) == 3:
+            data = self.variable[block[0], block[2], block[3]]
+            data = np.ma.expand_dims(data, 1)
+        else:
+            data = self.variable[block]
+        data = np.ma.filled(np.ma.asarray(data).astype(self.dtype), np.nan)
+        if any(not _is_block(index) for index in indices):
+            data = data[np.ix_(*[index - index.min() for index in indices])]
+        return data
+
+    def __repr__(self):
+        return(str(type(self)) + " "
+               + "variable: " + str(getattr(self.variable, "name", "")) + " "
+               + "shape: " + str(self.shape))
+
+
+def load_netcdf(filename, variable, time_name=None, y_name=None, x_name=None):
+    """
+    opens a variable of a NetCDF-4 or classic NetCDF file as a lazily read
+    RasterStack (see feature.RasterStack.create_lazy_stack()). Only the parts of the
+    variable that are used are read, so a stack larger than memory can be calculated
+    a time chunk at a time (see indices.StreamingKBDIFFDI). The file stays open
+    as long as the stack uses it. Requires the netCDF4 package.
+
+    The variable must be [time, y, x] or [time, layer, y, x] on a regular grid,
+    with CF coordinate variables: a time with units like "days since 1970-01-01"
+    and a calendar, and the x and y of the cell centres. The projection is the
+    crs_wkt or spatial_ref of the variable's grid_mapping, if it has one.
+
+    Parameters:
+    ------------
+    filename: str
+        the full path and filename of the NetCDF file
+    variable: str
+        the name of the variable
+    time_name, y_name, x_name: str
+        the names of the time, y and x coordinate variables. If None, the
+        names of the variable's first, second to last and last dimensions
+
+    Returns:
+    --------
+    out: feature.RasterStack
+        the lazily read variable, or None if it can't be read
+    """
+    netCDF4 = _import_netcdf4()
+    if netCDF4 is None:
+        return None
+    dataset = netCDF4.Dataset(filename, "r")
+    if variable not in dataset.variables:
+        print("error: " + str(filename) + " does not have a variable " + str(variable))
+        dataset.close()
+        return None
+    var = dataset.variables[variable]
+    if len(var.dimensions) not in (3, 4):
+        print("error: the variable must be [time, y, x] or [time, layer, y, x]")
+        dataset.close()
+        return None
+    time_var = dataset.variables[time_name or var.dimensions[0]]
+    y = np.asarray(dataset.variables[y_name or var.dimensions[-2]][:], dtype=np.float64)
+    x = np.asarray(dataset.variables[x_name or var.dimensions[-1]][:], dtype=np.float64)
+    cell_width = _grid_spacing(x, 1.)
+    cell_height = _grid_spacing(y, -1.)
+    if cell_width is None or cell_height is None:
+        print("error: the x and y coordinates of " + str(variable) + " are not a regular grid")
+        dataset.close()
+        return None
+    if cell_width < 0:
+        print("error: the x coordinate of " + str(variable) + " must increase with the column")
+        dataset.close()
+        return None
+    flip_rows = cell_height > 0 # the rows go from south to north
+    cell_height = -abs(cell_height)
+    calendar = getattr(time_var, "calendar", "standard")
+    try:
+        dates = netCDF4.num2date(time_var[:], time_var.units, calendar,
+                                 only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    except ValueError:
+        print("error: the times of " + str(variable) + " can't be python datetimes (calendar: " + str(calendar) + ")")
+        dataset.close()
+        return None
+    datelist = [datetime.datetime(date.year, date.month, date.day, date.hour, date.minute, date.second) for date in np.ravel(dates)]
+    projection = None
+    grid_mapping = getattr(var, "grid_mapping", None)
+    if grid_mapping is not None and grid_mapping in dataset.variables:
+        crs = dataset.variables[grid_mapping]
+        projection = getattr(crs, "crs_wkt", getattr(crs, "spatial_ref", None))
+    stack = feature.RasterStack()
+    stack.create_lazy_stack(NetCDFArray(var, flip_rows),
+                            datelist,
+                            projection,
+                            calendar,
+                            float(np.min(x)) - cell_width / 2.,
+                            float(np.max(y)) - cell_height / 2.,
+                            cell_width,
+                            cell_height)
+    return stack
+
+def write_netcdf(filename, stacks, chunk_days=365, chunk_cells=(128, 128), complevel=4):
+    """
+    writes RasterStacks on the same grid and dates as the variables of a NetCDF-4 file:
+    compressed (zlib with shuffle) and chunked for reading a time chunk of the whole
+    grid, with CF time, y and x coordinates (the cell centres). The stacks are
+    written a time chunk at a time, so memory-mapped or lazily read stacks are
+    never read as a whole. Requires the netCDF4 package.
+
+    Parameters:
+    ------------
+    filename: str
+        the full path and filename of the NetCDF file. An existing file is overwritten
+    stacks: dict
+        {variable name: feature.RasterStack}, for example {"KBDI": out_kbdi, "FFDI": out_ffdi}
+    chunk_days: int
+        the number of days of a file chunk, and of the time chunks written at once
+    chunk_cells: tuple
+        the (rows, cols) of a file chunk
+    complevel: int
+        the zlib compression level, 1 (fastest) to 9 (smallest)
+
+    Returns:
+    --------
+    None
+    """
+    netCDF4 = _import_netcdf4()
+    if netCDF4 is None:
+        return
+    names = list(stacks)
+    first = stacks[names[0]]
+    for name in names[1:]:
+        stack = stacks[name]
+        if stack.data.shape != first.data.shape or stack.mbr != first.mbr or stack.datelist != first.datelist:
+            print("error: " + str(name) + " is not on the same grid and dates as " + str(names[0]))
+            return
+    dataset = netCDF4.Dataset(filename, "w", format="NETCDF4")
+    try:
+        dataset.Conventions = "CF-1.8"
+        dataset.createDimension("time", None)
+        if first.nlayers > 1:
+            dataset.createDimension("layer", first.nlayers)
+        dataset.createDimension("y", first.nrows)
+        dataset.createDimension("x", first.ncols)
+
+        time = dataset.createVariable("time", "f8", ("time",))
+        time.standard_name = "time"
+        time.axis = "T"
+        time.units = "days since 1970-01-01 00:00:00"
+        time.calendar = first.calendar or "standard"
+        time[:] = (np.array(first.datelist, dtype="datetime64[s]") - np.datetime64("1970-01-01T00:00:00", "s")) / np.timedelta64(1, "D")
+        y = dataset.createVariable("y", "f8", ("y",))
+        y.axis = "Y"
+        y.long_name = "y coordinate of the cell centre"
+        y[:] = first.mbr[1] + (np.arange(first.nrows) + 0.5) * first.cell_height
+        x = dataset.createVariable("x", "f8", ("x",))
+        x.axis = "X"
+        x.long_name = "x coordinate of the cell centre"
+        x[:] = first.mbr[0] + (np.arange(first.ncols) + 0.5) * first.cell_width
+        if first.projection is not None:
+            crs = dataset.createVariable("crs", "i4")
+            crs.crs_wkt = str(first.projection)
+            crs.spatial_ref = str(first.projection)
+
+        if first.nlayers > 1:
+            dimensions = ("time", "layer", "y", "x")
+            chunksizes = (min(chunk_days, first.nsteps), 1, min(chunk_cells[0], first.nrows), min(chunk_cells[1], first.ncols))
+        else:
+            dimensions = ("time", "y", "x")
+            chunksizes = (min(chunk_days, first.nsteps), min(chunk_cells[0], first.nrows), min(chunk_cells[1], first.ncols))
+        chunksizes = tuple(max(size, 1) for size in chunksizes)
+        variables = {}
+        for name in names:
+            dtype = np.result_type(stacks[name].data.dtype, np.float32)
+            var = dataset.createVariable(name, dtype, dimensions, zlib=True, complevel=complevel, shuffle=True,
+                                         chunksizes=chunksizes, fill_value=dtype.type(np.nan))
+            if first.projection is not None:
+                var.grid_mapping = "crs"
+            variables[name] = var
+        for start in range(0, first.nsteps, chunk_days):
+            stop = min(start + chunk_days, first.nsteps)
+            for name in names:
+                data = np.asarray(stacks[name].data[start:stop])
+                if first.nlayers == 1:
+                    data = data[:, 0]
+                variables[name][start:stop] = data
+    finally:
+        dataset.close()
+
+
+def _import_netcdf4():
+    """
+    returns the netCDF4 module, or None (with an error) if it isn't installed
+    """
+    try:
+        import netCDF4
+    except ImportError:
+        print("error: reading and writing NetCDF files requires the netCDF4 package (pip install netCDF4)")
+        return None
+    return netCDF4
+
+
+def _grid_spacing(coordinate, default):
+    """
+    returns the spacing of a regular coordinate, default for a single value
+    or None if the coordinate isn't regular
+    """
+    if len(coordinate) < 2:
+        return default
+    steps = np.diff(coordinate)
+    if not np.allclose(steps, steps[0], rtol=1e-6, atol=0):
+        return None
+    return float(steps[0])
+
+
+def _is_block(index):
+    """
+    returns True if index is a range of consecutive increasing indices
+    """
+    return len(index) < 2 or bool(np.all(np.diff(index) == 1))
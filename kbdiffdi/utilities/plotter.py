@@ -5,14 +5,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 def timeseries(input_feature, start=None, end=None, save_fig_dir=None):
-    if start is None:
-        start = input_feature.datelist[0]
-    if end is None or end == input_feature.datelist[-1]:
-        y = input_feature.datelist[input_feature.datelist.index(start):]
-        x = input_feature.data[input_feature.datelist.index(start):].flatten()
-    else:
-        y = input_feature.datelist[input_feature.datelist.index(start):input_feature.datelist.index(end)+1]
-        x = input_feature.data[input_feature.datelist.index(start):input_feature.datelist.index(end)+1].flatten()
+    time_slice = input_feature.get_time_slice(start, end)
+    y = input_feature.get_datetime64()[time_slice]
+    x = input_feature.data[time_slice].flatten()
     plt.figure(figsize=(20, 8))
     plt.xlabel("Date")
     plt.grid(True)
@@ -38,6 +38,7 @@ setuptools.setup(
     url="https://github.com/jwarndt/kbdi_ffdi",
     packages=setuptools.find_packages(),
     install_requires=required_packages,
+    extras_require={"netcdf": ["netCDF4>=1.5.4"]}, # reading and writing gridded NetCDF data
     classifiers=(
         "Programming Language :: Python",
         'Development Status :: 3 - Alpha',
@@ -0,0 +1,46 @@
+import os
+import shutil
+
+import numpy as np
+
+from kbdiffdi.utilities import cache
+from kbdiffdi.utilities import input_output
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "kbdiffdi", "data")
+
+
+def test_load_reads_back_the_parsed_arrays(tmp_path):
+    source = str(tmp_path / "Knysna.csv")
+    shutil.copy(os.path.join(DATA, "Knysna.csv"), source)
+    inputcache = cache.InputCache(str(tmp_path / "cache"))
+    parsed = input_output.read_station(source)
+    stored = input_output.read_station(source, inputcache)
+    cached = input_output.read_station(source, inputcache)
+    assert isinstance(cached[1], np.memmap)
+    for expected, first, second in zip(parsed, stored, cached):
+        np.testing.assert_array_equal(expected, first)
+        np.testing.assert_array_equal(expected, second)
+
+
+def test_evict_keeps_the_cache_under_max_bytes(tmp_path):
+    inputcache = cache.InputCache(str(tmp_path / "cache"), 1)
+    for name in ["George.csv", "Knysna.csv"]:
+        shutil.copy(os.path.join(DATA, name), str(tmp_path / name))
+        input_output.read_station(str(tmp_path / name), inputcache)
+    # only the last entry is left, it is larger than max_bytes on its own
+    names = os.listdir(str(tmp_path / "cache"))
+    assert all(name.startswith("Knysna.csv-") for name in names)
+
+
+def test_shared_cache_over_max_bytes_in_threads(tmp_path):
+    stations = tmp_path / "stations"
+    stations.mkdir()
+    for copy in range(8):
+        shutil.copy(os.path.join(DATA, "Knysna.csv"), str(stations / ("Knysna" + str(copy) + ".csv")))
+    expected = input_output.load_csv_directory(str(stations))
+    for run in range(5):
+        inputcache = cache.InputCache(str(tmp_path / "cache"), 200000) # a couple of entries
+        out = input_output.load_csv_directory(str(stations), workers=8, cache=inputcache)
+        for stack, expected_stack in zip(out, expected):
+            np.testing.assert_array_equal(stack.data, expected_stack.data)
+    assert not any(name.endswith(".tmp") for name in os.listdir(str(tmp_path / "cache")))
@@ -0,0 +1,213 @@
+import datetime
+
+import numpy as np
+
+from kbdiffdi.features import feature
+
+
+def make_raster(day, x=0, y=10, size=10):
+    return feature.Raster(np.ones((1, size, size)), {}, datetime.datetime(2000, 1, day), None, "standard", None, x, y, 1, -1)
+
+
+def make_stack(ndays=3):
+    stack = feature.RasterStack()
+    for day in range(1, ndays + 1):
+        stack.append_STFeature(make_raster(day))
+    return stack
+
+
+def test_append_STFeature():
+    stack = make_stack(5)
+    assert stack.data.shape == (5, 1, 10, 10)
+    assert len(stack.datelist) == 5
+    assert stack.mbrlist.shape == (5, 4)
+
+
+def test_create_stack_like_does_not_share_append_buffers():
+    parent = make_stack()
+    child = feature.RasterStack()
+    child.create_stack_like(parent, parent.data * 2)
+    child.append_STFeature(make_raster(4))
+    parent.append_STFeature(make_raster(4, x=1, y=9, size=9))
+
+    assert list(child.mbrlist[-1]) == [0, 10, 9, 1]
+    assert list(parent.mbrlist[-1]) == [1, 9, 9, 1]
+    assert np.all(child.data[:3] == 2)
+    assert np.all(child.data[3] == 1)
+    assert np.all(parent.data[:3] == 1)
+
+
+def test_feature_metadata_is_shared_and_dropped_when_unused():
+    first = make_raster(1)
+    second = make_raster(2)
+    assert first.metadata is second.metadata
+    first.set_projection("unused projection")
+    key = ("unused projection", "standard", 1, -1)
+    assert key in feature.FeatureMetadata.records
+    del first
+    assert key not in feature.FeatureMetadata.records
+
+
+def make_grid(ndays=10, nrows=4, ncols=5):
+    datelist = [datetime.datetime(2000, 1, 1) + datetime.timedelta(days=day) for day in range(ndays)]
+    stack = feature.RasterStack()
+    stack.create_sc_stack(np.arange(ndays * nrows * ncols, dtype=float).reshape(ndays, 1, nrows, ncols), datelist, None, "standard", 100, 50, 10, -10)
+    return stack
+
+
+def test_memmap_stack_round_trip(tmp_path):
+    stack = make_grid()
+    filename = str(tmp_path / "stack.rs")
+    stack.save_memmap(filename)
+    opened = feature.RasterStack()
+    opened.open_memmap_stack(filename)
+    assert isinstance(opened.data, np.memmap)
+    np.testing.assert_array_equal(opened.data, stack.data)
+    assert opened.datelist == stack.datelist
+    assert opened.mbr == stack.mbr
+    assert (opened.cell_width, opened.cell_height) == (10, -10)
+
+
+def test_create_memmap_stack_writes_to_the_file(tmp_path):
+    stack = make_grid()
+    filename = str(tmp_path / "stack.rs")
+    created = feature.RasterStack()
+    created.create_memmap_stack(filename, stack.data.shape, stack.datelist, None, "standard", 100, 50, 10, -10, np.float32)
+    assert not created.data.any()
+    created.data[3] = 7
+    created.flush()
+    opened = feature.RasterStack()
+    opened.open_memmap_stack(filename)
+    assert opened.data.dtype == np.float32
+    assert np.all(opened.data[3] == 7) and not opened.data[4].any()
+    assert opened.mbr == stack.mbr
+
+
+def test_open_memmap_stack_rejects_other_files(tmp_path, capsys):
+    filename = str(tmp_path / "other.rs")
+    with open(filename, "wb") as f:
+        f.write(b"not a stack")
+    feature.RasterStack().open_memmap_stack(filename)
+    assert "error" in capsys.readouterr().out
+
+
+def test_datetime64_axis_follows_the_datelist():
+    stack = make_stack(3)
+    np.testing.assert_array_equal(stack.get_datetime64(), np.array(["2000-01-01", "2000-01-02", "2000-01-03"], dtype="datetime64[D]"))
+    assert stack.get_datetime64() is stack.get_datetime64()
+    stack.append_STFeature(make_raster(5))
+    assert stack.get_datetime64()[-1] == np.datetime64("2000-01-05")
+    assert list(stack.get_days()) == [1, 2, 3, 5]
+    assert list(stack.get_days_of_year()) == [1, 2, 3, 5]
+    assert list(stack.get_months()) == [1, 1, 1, 1] and list(stack.get_years()) == [2000] * 4
+
+
+def test_get_date_index_with_gaps(capsys):
+    stack = make_stack(3)
+    stack.append_STFeature(make_raster(5))
+    assert stack.get_date_index("2000-01-02") == 1
+    assert stack.get_date_index(datetime.date(2000, 1, 5)) == 3
+    assert stack.get_date_index("2000-01-04") is None
+    assert "error" in capsys.readouterr().out
+    assert stack.get_time_slice("2000-01-02", "2000-01-04") == slice(1, 3)
+
+
+def test_sel_time_is_a_view():
+    stack = make_grid()
+    view = stack.sel_time("2000-01-03", datetime.datetime(2000, 1, 5))
+    assert np.shares_memory(view.data, stack.data)
+    np.testing.assert_array_equal(view.data, stack.data[2:5])
+    assert [date.day for date in view.datelist] == [3, 4, 5]
+    assert view.start.day == 3 and view.end.day == 5
+    assert stack.sel_time("2001-01-01") is None
+
+
+def test_sel_bbox_is_a_view_with_its_own_mbr(capsys):
+    stack = make_grid()
+    view = stack.sel_bbox(110, 40, 130, 30)
+    assert np.shares_memory(view.data, stack.data)
+    np.testing.assert_array_equal(view.data, stack.data[:, :, 1:3, 1:4])
+    assert view.mbr == [110, 40, 130, 30]
+    assert stack.mbr == [100, 50, 140, 20]
+    assert stack.sel_bbox(500, 40, 600, 30) is None
+    assert "error" in capsys.readouterr().out
+
+
+def test_get_time_chunks_cover_the_stack():
+    stack = make_grid()
+    chunks = list(stack.get_time_chunks(4))
+    assert [len(chunk.data) for chunk in chunks] == [4, 4, 2]
+    np.testing.assert_array_equal(np.concatenate([chunk.data for chunk in chunks]), stack.data)
+    assert sum([chunk.datelist for chunk in chunks], []) == stack.datelist
+
+
+def test_create_stack_from_features_matches_appending():
+    for sizes in [[(0, 10, 10)] * 3, [(0, 10, 10), (2, 8, 5), (1, 12, 4)]]:
+        features = [make_raster(day + 1, x, y, size) for day, (x, y, size) in enumerate(sizes)]
+        appended = feature.RasterStack()
+        for raster in features:
+            appended.append_STFeature(raster)
+        stack = feature.RasterStack()
+        stack.create_stack_from_features(list(features))
+        np.testing.assert_array_equal(stack.data, appended.data)
+        assert stack.mbr == appended.mbr
+        assert stack.sc == (len(set(sizes)) == 1)
+
+
+def test_vector_stack_from_point_features(capsys):
+    def point(day, x, value):
+        return feature.Vector(np.array([value]), {}, datetime.datetime(2000, 1, day), None, "standard", None, {"type": "Point", "coordinates": [x, 5]})
+    stack = feature.VectorStack()
+    stack.create_stack_from_features([point(2, 1, 4.), point(1, 3, 2.), point(1, 1, 1.)])
+    np.testing.assert_array_equal(stack.data, [[1, 2], [4, np.nan]])
+    np.testing.assert_array_equal(stack.geoms, [[1, 5], [3, 5]])
+    assert [date.day for date in stack.datelist] == [1, 2]
+    assert stack.mbr == [1, 5, 3, 5]
+    raster = stack.as_raster_stack()
+    assert raster.data.shape == (2, 1, 1, 2)
+    back = feature.VectorStack()
+    back.create_stack_from_raster(stack, raster.data * 2)
+    np.testing.assert_array_equal(back.data, stack.data * 2)
+    assert back.geoms is stack.geoms
+    feature.VectorStack().create_stack(np.zeros((2, 3)), stack.datelist, None, "standard", stack.geoms)
+    assert "error" in capsys.readouterr().out
+
+
+def test_vector_stack_station_names(capsys):
+    stack = feature.VectorStack()
+    stack.create_stack(np.zeros((1, 2)), [datetime.datetime(2000, 1, 1)], None, "standard", [[0, 0], [1, 1]], ["a", "b"])
+    assert stack.get_station_index("b") == 1
+    assert stack.get_station_index("c") is None
+    assert "error" in capsys.readouterr().out
+
+
+def test_create_stack_like_shares_the_attributes():
+    parent = make_grid()
+    child = feature.RasterStack()
+    data = np.zeros(parent.data.shape)
+    child.create_stack_like(parent, data)
+    assert child.data is data
+    assert child.datelist is parent.datelist
+    assert child.mbr == parent.mbr and child.cell_height == parent.cell_height
+    parent.append_STFeature(feature.Raster(np.ones((1, 4, 5)), {}, datetime.datetime(2000, 1, 11), None, "standard", None, 100, 50, 10, -10))
+    assert len(child.datelist) == 10 and len(parent.datelist) == 11
+
+
+def test_former_feature_attributes_can_be_assigned(capsys):
+    raster = make_raster(1)
+    other = make_raster(2)
+    raster.projection = "EPSG:32734"
+    raster.calendar = "gregorian"
+    raster.cell_width = 2
+    raster.cell_height = -2
+    assert (raster.projection, raster.calendar, raster.cell_width, raster.cell_height) == ("EPSG:32734", "gregorian", 2, -2)
+    assert (other.projection, other.calendar, other.cell_width, other.cell_height) == (None, "standard", 1, -1)
+    raster.mbr = [4, 30, 22, 12]
+    assert (raster.x, raster.y) == (4, 30)
+    assert raster.mbr == [4, 30, 22, 12]
+    raster.mbr = [0, 0, 1, 1]
+    assert "error" in capsys.readouterr().out
+    assert raster.mbr == [4, 30, 22, 12]
+    raster.source = "station.csv"
+    assert raster.source == "station.csv"
+    assert not hasattr(feature.Raster, "set_mbr")
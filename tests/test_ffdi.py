@@ -0,0 +1,127 @@
+import os
+import sys
+import warnings
+import subprocess
+
+import numpy as np
+
+from kbdiffdi.features import feature
+from kbdiffdi.indices import kbdi
+from kbdiffdi.indices import ffdi
+from kbdiffdi.utilities import input_output
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "kbdiffdi", "data")
+
+
+def test_importing_ffdi_leaves_the_warning_filters_alone():
+    code = "import warnings, numpy; filters = list(warnings.filters); import kbdiffdi.indices.ffdi; print(warnings.filters == filters)"
+    assert subprocess.check_output([sys.executable, "-c", code]).strip() == b"True"
+
+
+def test_fit_does_not_warn_on_out_of_range_inputs():
+    # PortElizabeth.csv has implausible temperatures that drive KBDI out of its range
+    rain, temp, relhum, wind = input_output.load_csv(os.path.join(DATA, "PortElizabeth.csv"))
+    out_kbdi = kbdi.KBDI().fit(temp, rain)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        out_ffdi, out_df = ffdi.FFDI().fit(out_kbdi, rain, temp, wind, relhum)
+    assert np.isnan(out_ffdi.data).any()
+
+
+def test_drought_factor_and_ffdi_matches_the_separate_steps():
+    rain, temp, relhum, wind = input_output.load_csv(os.path.join(DATA, "Knysna.csv"))
+    out_kbdi = kbdi.KBDI().fit(temp, rain)
+    FFDI = ffdi.FFDI()
+    out_ffdi, out_df = FFDI.fit(out_kbdi, rain, temp, wind, relhum)
+    x = FFDI.calculate_sig_rain_event()
+    drought_factor = FFDI.griffith_drought_factor(x, FFDI.calc_x_lim())
+    np.testing.assert_allclose(out_df.data, drought_factor.data, rtol=1e-12)
+    np.testing.assert_allclose(out_ffdi.data, FFDI.forest_fire_danger_index(drought_factor).data, rtol=1e-12)
+
+
+def test_drought_factor_and_ffdi_needs_contiguous_outputs(capsys):
+    KBDI = np.zeros((10, 1, 1, 2))
+    out = np.empty((10, 1, 1, 4))[..., ::2]
+    assert ffdi.FFDI().drought_factor_and_ffdi(KBDI, KBDI, KBDI, KBDI, KBDI, out, np.empty_like(KBDI)) is None
+    assert "error" in capsys.readouterr().out
+
+
+def test_stations_in_a_vector_stack_match_separate_runs():
+    stations = [input_output.load_csv(os.path.join(DATA, "Knysna.csv")), input_output.load_csv(os.path.join(DATA, "Plett.csv"))]
+    datelist = stations[0][0].datelist
+    n = min(len(stations[0][0].data), len(stations[1][0].data))
+    vector_stacks = []
+    for column in range(4):
+        stack = feature.VectorStack()
+        stack.create_stack(np.concatenate([station[column].data[:n].reshape(-1, 1) for station in stations], axis=1), datelist[:n], None, "standard", [[0, 0], [1, 0]])
+        vector_stacks.append(stack)
+    rain, temp, relhum, wind = vector_stacks
+    out_kbdi = kbdi.KBDI().fit(temp, rain)
+    out_ffdi, out_df = ffdi.FFDI().fit(out_kbdi, rain, temp, wind, relhum)
+    assert isinstance(out_kbdi, feature.VectorStack) and isinstance(out_ffdi, feature.VectorStack)
+    for index, (rain, temp, relhum, wind) in enumerate(stations):
+        rain, temp, relhum, wind = [raster_stack(stack.data[:n], datelist[:n]) for stack in (rain, temp, relhum, wind)]
+        expected_kbdi = kbdi.KBDI().fit(temp, rain)
+        expected_ffdi, expected_df = ffdi.FFDI().fit(expected_kbdi, rain, temp, wind, relhum)
+        np.testing.assert_array_equal(out_kbdi.data[:, index], expected_kbdi.data.ravel())
+        np.testing.assert_array_equal(out_df.data[:, index], expected_df.data.ravel())
+        np.testing.assert_array_equal(out_ffdi.data[:, index], expected_ffdi.data.ravel())
+
+
+def raster_stack(data, datelist):
+    stack = feature.RasterStack()
+    stack.create_sc_stack(data, datelist, None, "standard", 0, 0, 1, -1)
+    return stack
+
+
+def test_active_cells_only_is_identical_to_all_cells():
+    rain, temp, relhum, wind = input_output.load_csv(os.path.join(DATA, "Knysna.csv"))
+    rng = np.random.default_rng(0)
+    stacks = []
+    for stack in (rain, temp, relhum, wind):
+        data = stack.data * rng.uniform(0.8, 1.2, (1, 1, 3, 4))
+        data[:, :, 0, 1:3] = np.nan # sea
+        stacks.append(raster_stack(data, stack.datelist))
+    rain, temp, relhum, wind = stacks
+    expected_kbdi = kbdi.KBDI().fit(temp, rain)
+    expected_ffdi, expected_df = ffdi.FFDI().fit(expected_kbdi, rain, temp, wind, relhum)
+    out_kbdi = kbdi.KBDI().fit(temp, rain, active_cells=True)
+    out_ffdi, out_df = ffdi.FFDI().fit(out_kbdi, rain, temp, wind, relhum, active_cells=True)
+    assert out_kbdi.get_active_cells().sum() == 10
+    np.testing.assert_array_equal(out_kbdi.data, expected_kbdi.data)
+    np.testing.assert_array_equal(out_df.data, expected_df.data)
+    np.testing.assert_array_equal(out_ffdi.data, expected_ffdi.data)
+
+
+def test_float32_inputs_run_in_float32():
+    stations = input_output.load_csv(os.path.join(DATA, "Knysna.csv"))
+    rain, temp, relhum, wind = [raster_stack(stack.data.astype(np.float32), stack.datelist) for stack in stations]
+    out_kbdi = kbdi.KBDI().fit(temp, rain)
+    out_ffdi, out_df = ffdi.FFDI().fit(out_kbdi, rain, temp, wind, relhum)
+    assert out_kbdi.data.dtype == out_df.data.dtype == out_ffdi.data.dtype == np.float32
+    rain, temp, relhum, wind = stations
+    expected_kbdi = kbdi.KBDI().fit(temp, rain)
+    expected_ffdi, expected_df = ffdi.FFDI().fit(expected_kbdi, rain, temp, wind, relhum)
+    np.testing.assert_allclose(out_kbdi.data, expected_kbdi.data, rtol=0, atol=1e-3)
+    np.testing.assert_allclose(out_df.data, expected_df.data, rtol=0, atol=0.01)
+    np.testing.assert_allclose(out_ffdi.data, expected_ffdi.data, rtol=1e-3, atol=0)
+    assert kbdi.KBDI().fit(temp, rain, dtype=np.float32).data.dtype == np.float32
+
+
+def test_fit_and_update_is_identical_to_a_full_fit():
+    stations = input_output.load_csv(os.path.join(DATA, "Knysna.csv"))
+    rain, temp, relhum, wind = stations
+    out_kbdi = kbdi.KBDI().fit(temp, rain)
+    expected_ffdi, expected_df = ffdi.FFDI().fit(out_kbdi, rain, temp, wind, relhum)
+    FFDI = ffdi.FFDI()
+    parts = [[], []]
+    for start, stop in [(0, 15), (15, 16), (16, 3000), (3000, None)]:
+        rain, temp, relhum, wind, KBDI = [raster_stack(stack.data[start:stop], stack.datelist[start:stop]) for stack in stations + (out_kbdi,)]
+        if start == 0:
+            out_ffdi, out_df = FFDI.fit(KBDI, rain, temp, wind, relhum)
+        else:
+            out_ffdi, out_df = ffdi.FFDI().update(FFDI.get_window(), KBDI, rain, temp, wind, relhum)
+        parts[0].append(out_ffdi.data)
+        parts[1].append(out_df.data)
+    np.testing.assert_array_equal(np.concatenate(parts[0]), expected_ffdi.data)
+    np.testing.assert_array_equal(np.concatenate(parts[1]), expected_df.data)
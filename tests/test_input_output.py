@@ -0,0 +1,129 @@
+import os
+import gzip
+import shutil
+
+import numpy as np
+
+from kbdiffdi.indices import kbdi
+from kbdiffdi.utilities import cache
+from kbdiffdi.utilities import input_output
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "kbdiffdi", "data")
+
+HEADER = "Station,Date,Rain (mm),Temp (C),Humidity (%),Wind (m/s)\r\n"
+
+
+def write_station(filename, rows):
+    with open(filename, "w", newline="") as stationcsv:
+        stationcsv.write(HEADER)
+        for row in rows:
+            stationcsv.write(row + "\r\n")
+
+
+def test_load_csv_reads_both_layouts():
+    for name in ["Knysna.csv", "George.csv"]:
+        rain, temp, relhum, wind = input_output.load_csv(os.path.join(DATA, name))
+        assert rain.data.shape == temp.data.shape == relhum.data.shape == wind.data.shape
+        assert len(rain.datelist) == len(rain.data)
+        assert not np.isnan(temp.data).all()
+
+
+def test_load_csv_blank_values_and_rows_without_a_date(tmp_path):
+    filename = str(tmp_path / "station.csv")
+    write_station(filename, ["a,20000101,1.5,20,50,2", "a,20000102,,21,51,3", "a,,,,,", "a,20000103,0,22,52,4"])
+    rain, temp, relhum, wind = input_output.load_csv(filename)
+    np.testing.assert_array_equal(rain.data.ravel(), [1.5, np.nan, 0])
+    np.testing.assert_array_equal(wind.data.ravel(), np.array([2, 3, 4]) * 3.6)
+    assert [date.day for date in rain.datelist] == [1, 2, 3]
+
+
+def test_write_columns(tmp_path):
+    filename = str(tmp_path / "station.csv")
+    write_station(filename, ["a,20000101,1.5,20,50,2", "a,20000102,0,21,51,3"])
+    input_output.write_columns(filename, str(tmp_path / "out.csv"), ["KBDI", "FFDI"], [np.array([1.25, 2.]), np.array([3., 0.1])])
+    with open(str(tmp_path / "out.csv"), newline="") as outputcsv:
+        assert outputcsv.read() == HEADER[:-2] + ",KBDI,FFDI\r\na,20000101,1.5,20,50,2,1.25,3.0\r\na,20000102,0,21,51,3,2.0,0.1\r\n"
+    input_output.write_columns(filename, str(tmp_path / "out.csv.gz"), ["KBDI"], [np.array([1.25, 2.])], precision=1)
+    with gzip.open(str(tmp_path / "out.csv.gz"), "rt", newline="") as outputcsv:
+        assert outputcsv.read().splitlines()[1:] == ["a,20000101,1.5,20,50,2,1.2", "a,20000102,0,21,51,3,2.0"]
+
+
+def test_write_csv_skips_rows_without_a_date(tmp_path):
+    filename = str(tmp_path / "station.csv")
+    write_station(filename, ["a,20000101,1.5,20,50,2", "a,,,,,", "a,20000102,0,21,51,3", ""])
+    rain, temp, relhum, wind = input_output.load_csv(filename)
+    out = kbdi.KBDI().fit(temp, rain)
+    input_output.write_csv(filename, str(tmp_path / "out.csv"), out)
+    with open(str(tmp_path / "out.csv"), newline="") as outputcsv:
+        rows = outputcsv.read().splitlines()
+    assert len(rows) == 3
+    assert rows[2].startswith("a,20000102,0,21,51,3,")
+
+
+def test_load_and_write_csv_directory(tmp_path):
+    stations = tmp_path / "stations"
+    stations.mkdir()
+    write_station(str(stations / "a.csv"), ["a,20000101,1.5,20,50,2", "a,20000102,0,21,51,3", "a,20000103,7,25,40,3"])
+    write_station(str(stations / "b.csv"), ["b,20000102,0,19,50,2", "b,,,,,", "b,20000103,2,22,45,1"])
+    inputcache = cache.InputCache(str(tmp_path / "cache"))
+    rain, temp, relhum, wind = input_output.load_csv_directory(str(stations), cache=inputcache)
+    assert temp.names == ["a.csv", "b.csv"]
+    assert np.isnan(temp.data[0, 1])
+    out = kbdi.KBDI().fit(temp, rain)
+    output = tmp_path / "output"
+    output.mkdir()
+    input_output.write_csv_directory(str(stations), str(output), out, cache=inputcache)
+    for index, name in enumerate(["a.csv", "b.csv"]):
+        rain, temp, relhum, wind = input_output.load_csv(str(stations / name))
+        with open(str(output / name), newline="") as outputcsv:
+            rows = outputcsv.read().splitlines()[1:]
+        assert len(rows) == len(temp.data)
+        written = np.array([float(row.rsplit(",", 1)[1]) for row in rows])
+        np.testing.assert_array_equal(written, out.data[np.searchsorted(out.get_datetime64(), temp.get_datetime64()), index])
+
+
+def test_write_csv_directory_without_results(tmp_path, capsys):
+    input_output.write_csv_directory(str(tmp_path), str(tmp_path / "output"))
+    assert "error" in capsys.readouterr().out
+
+
+def test_load_csv_directory_matches_load_csv(tmp_path):
+    for name in ["Knysna.csv", "Plett.csv"]:
+        shutil.copy(os.path.join(DATA, name), str(tmp_path / name))
+    rain, temp, relhum, wind = input_output.load_csv_directory(str(tmp_path))
+    dates = temp.get_datetime64()
+    for index, name in enumerate(temp.names):
+        station = input_output.load_csv(str(tmp_path / name))
+        rows = np.searchsorted(dates, station[1].get_datetime64())
+        for stack, station_stack in zip((rain, temp, relhum, wind), station):
+            np.testing.assert_array_equal(stack.data[rows, index], station_stack.data.ravel())
+
+
+def test_load_csv_finds_the_columns_by_header_name(tmp_path):
+    filename = str(tmp_path / "station.csv")
+    with open(filename, "w", newline="") as stationcsv:
+        stationcsv.write("Wind Speed (m/s),Rel Humidity (%),Station,Temp (C),Date,Rainfall (mm)\r\n")
+        stationcsv.write("2,50,a,20,20000101,1.5\r\n3,51,a,21,20000102,0\r\n")
+    rain, temp, relhum, wind = input_output.load_csv(filename)
+    np.testing.assert_array_equal(rain.data.ravel(), [1.5, 0])
+    np.testing.assert_array_equal(temp.data.ravel(), [20, 21])
+    np.testing.assert_array_equal(relhum.data.ravel(), [50, 51])
+    np.testing.assert_array_equal(wind.data.ravel(), np.array([2, 3]) * 3.6)
+
+
+def test_csv_layout():
+    assert input_output.csv_layout("Station,Time,Date,Rainfall (mm) (24 hours),Temp (? C),Rel Humidity (%),Wind Speed (m/s) ") == {"date": 2, "rain": 3, "temp": 4, "rel_hum": 5, "wind": 6}
+    assert input_output.csv_layout("a,b,c,d,e,f") is None
+
+
+def test_yyyymmdd_to_datetime64():
+    np.testing.assert_array_equal(input_output.yyyymmdd_to_datetime64([19970101, 20000229, 20241231]),
+                                  np.array(["1997-01-01", "2000-02-29", "2024-12-31"], dtype="datetime64[D]"))
+
+
+def test_write_columns_with_the_wrong_number_of_values(tmp_path, capsys):
+    filename = str(tmp_path / "station.csv")
+    write_station(filename, ["a,20000101,1.5,20,50,2", "a,20000102,0,21,51,3"])
+    input_output.write_columns(filename, str(tmp_path / "out.csv"), ["KBDI"], [np.array([1.25])])
+    assert "error" in capsys.readouterr().out
+    assert not (tmp_path / "out.csv").exists()
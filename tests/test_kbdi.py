@@ -0,0 +1,146 @@
+import os
+import sys
+
+import numpy as np
+
+from kbdiffdi.features import feature
+from kbdiffdi.indices import kbdi
+from kbdiffdi.indices import streaming
+from kbdiffdi.utilities import input_output
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "kbdiffdi", "data")
+
+# the original net rainfall loop is kept in the benchmark, the kernel is checked against it
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from bench_net_rainfall import legacy_net_rainfall
+
+
+def load_knysna():
+    rain, temp, relhum, wind = input_output.load_csv(os.path.join(DATA, "Knysna.csv"))
+    return rain, temp
+
+
+def sub_stack(stack, start, stop=None):
+    out = feature.RasterStack()
+    out.create_sc_stack(stack.data[start:stop], stack.datelist[start:stop], None, "standard", 0, 0, 1, -1)
+    return out
+
+
+def test_net_rainfall_matches_the_baseline_loop():
+    rain, temp = load_knysna()
+    rng = np.random.default_rng(0)
+    # dry days, light days, days of exactly the threshold and heavy days in every order
+    grid = rng.choice([0, 0, 0, 1., 2.5, 5.08, 6., 20.], size=(2000, 1, 6, 7))
+    for data in [rain.data, grid]:
+        prcp = feature.RasterStack()
+        prcp.create_sc_stack(data, rain.datelist[:len(data)], None, "standard", 0, 0, 1, -1)
+        KBDI = kbdi.KBDI()
+        KBDI.set_prcp(prcp)
+        KBDI.calculate_net_rainfall()
+        np.testing.assert_array_equal(KBDI.get_net_rainfall().data, legacy_net_rainfall(data))
+
+
+def test_missing_day_makes_the_kbdi_nan_from_then_on():
+    rain, temp = load_knysna()
+    temp.data[100] = np.nan
+    out = kbdi.KBDI().fit(temp, rain)
+    assert not np.isnan(out.data[:100]).any()
+    assert np.isnan(out.data[100:]).all()
+
+
+def test_record_starting_later_starts_from_the_first_drought_index():
+    rain, temp = load_knysna()
+    mean_annual_rainfall = kbdi.mean_annual_rainfall_raster(np.array([[[[800.]]]]))
+    expected = kbdi.KBDI().fit(sub_stack(temp, 50), sub_stack(rain, 50), mean_annual_rainfall)
+    temp.data[:50] = np.nan
+    out = kbdi.KBDI().fit(temp, rain, mean_annual_rainfall)
+    assert np.isnan(out.data[:50]).all()
+    np.testing.assert_array_equal(out.data[50:], expected.data)
+
+
+def test_fit_and_updates_are_identical_to_a_full_fit():
+    rain, temp = load_knysna()
+    full = kbdi.KBDI()
+    expected = full.fit(temp, rain)
+    KBDI = kbdi.KBDI()
+    out = [KBDI.fit(sub_stack(temp, 0, 1000), sub_stack(rain, 0, 1000), full.get_mean_annual_rainfall()).data]
+    for start, stop in [(1000, 1001), (1001, 4000), (4000, None)]:
+        out.append(kbdi.KBDI().update(KBDI.get_state(), sub_stack(temp, start, stop), sub_stack(rain, start, stop)).data)
+    np.testing.assert_array_equal(np.concatenate(out), expected.data)
+
+
+def test_update_starts_a_record_that_starts_in_the_new_days():
+    rain, temp = load_knysna()
+    temp.data[:500] = np.nan
+    mean_annual_rainfall = kbdi.mean_annual_rainfall_raster(np.array([[[[800.]]]]))
+    expected = kbdi.KBDI().fit(temp, rain, mean_annual_rainfall)
+    KBDI = kbdi.KBDI()
+    first = KBDI.fit(sub_stack(temp, 0, 365), sub_stack(rain, 0, 365), mean_annual_rainfall)
+    rest = kbdi.KBDI().update(KBDI.get_state(), sub_stack(temp, 365), sub_stack(rain, 365))
+    np.testing.assert_array_equal(np.concatenate([first.data, rest.data]), expected.data)
+
+
+def test_state_save_and_load(tmp_path):
+    rain, temp = load_knysna()
+    KBDI = kbdi.KBDI()
+    KBDI.fit(sub_stack(temp, 0, 1000), sub_stack(rain, 0, 1000))
+    filename = str(tmp_path / "state.npz")
+    KBDI.get_state().save(filename)
+    state = kbdi.KBDIState.load(filename)
+    for name in ["kbdi", "running_total", "consec", "already_subtracted", "prcp", "mean_annual_rainfall", "first_kbdi", "started"]:
+        np.testing.assert_array_equal(getattr(state, name), getattr(KBDI.get_state(), name))
+    assert state.date == KBDI.get_state().date
+
+
+def test_streaming_starts_a_record_in_a_later_chunk():
+    rain, temp = load_knysna()
+    temp.data[:400] = np.nan
+    mean_annual_rainfall = kbdi.mean_annual_rainfall_raster(np.array([[[[800.]]]]))
+    expected = kbdi.KBDI().fit(temp, rain, mean_annual_rainfall)
+    chunks = [(sub_stack(temp, start, start + 365), sub_stack(rain, start, start + 365),
+               sub_stack(rain, start, start + 365), sub_stack(rain, start, start + 365))
+              for start in range(0, len(temp.data), 365)]
+    out = [KBDI.data for KBDI, FFDI, DF in streaming.StreamingKBDIFFDI().fit(chunks, mean_annual_rainfall)]
+    np.testing.assert_array_equal(np.concatenate(out), expected.data)
+
+
+def test_mean_annual_rainfall_of_a_cell_alone_or_in_a_grid():
+    rain, temp = load_knysna()
+    data = np.random.default_rng(0).gamma(0.3, 5., (len(rain.data), 1, 2, 3))
+    grid = feature.RasterStack()
+    grid.create_sc_stack(data, rain.datelist, None, "standard", 0, 0, 1, -1)
+    KBDI = kbdi.KBDI()
+    KBDI.set_prcp(grid)
+    KBDI.calculate_mean_annual_rainfall()
+    for row in range(2):
+        for col in range(3):
+            cell = kbdi.KBDI()
+            cell.set_prcp(grid.sel_bbox(col, -row, col, -row))
+            cell.calculate_mean_annual_rainfall()
+            assert cell.get_mean_annual_rainfall().data.ravel()[0] == KBDI.get_mean_annual_rainfall().data[0, 0, row, col]
+
+
+def mean_annual_rainfall(data, first_day):
+    dates = np.arange(first_day, len(data), dtype="datetime64[D]")
+    prcp = feature.RasterStack()
+    prcp.create_sc_stack(data, list(dates.astype(object)), None, "standard", 0, 0, 1, -1)
+    KBDI = kbdi.KBDI()
+    KBDI.set_prcp(prcp)
+    KBDI.calculate_mean_annual_rainfall()
+    return KBDI.get_mean_annual_rainfall().data.ravel()
+
+
+def test_mean_annual_rainfall_rules():
+    # 2000-07-01 to 2003-03-31: only 2001 and 2002 are complete
+    ndays = (np.datetime64("2003-04-01") - np.datetime64("2000-07-01")).astype(int)
+    data = np.ones((ndays, 1, 1, 3))
+    data[:, 0, 0, 1] = 2
+    data[300, 0, 0, 1] = np.nan # a day of 2001 is missing, only 2002 counts
+    data[:, 0, 0, 2] = np.nan
+    data[:184] = 100 # the partial first year is left out
+    np.testing.assert_array_equal(mean_annual_rainfall(data, "2000-07-01"), [365, 730, np.nan])
+    # without a complete year, the mean daily rainfall of the valid days is extrapolated
+    data = np.ones((200, 1, 1, 2))
+    data[:100, 0, 0, 1] = np.nan
+    data[100:, 0, 0, 1] = 3
+    np.testing.assert_array_equal(mean_annual_rainfall(data, "2001-03-01"), [365.25, 3 * 365.25])
@@ -0,0 +1,133 @@
+import sys
+import datetime
+
+import numpy as np
+import pytest
+
+from kbdiffdi.features import feature
+from kbdiffdi.utilities import netcdf
+
+
+class StubVariable(object):
+    """ reads like a netCDF4 variable: a shape, a dtype and basic slicing to a masked array """
+
+    def __init__(self, data, scale_factor=None):
+        self.data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        if scale_factor is not None:
+            self.scale_factor = scale_factor
+        self.reads = []
+
+    def __getitem__(self, key):
+        self.reads.append(key)
+        return self.data[key]
+
+
+def make_variable(ntimes=6, nrows=4, ncols=5, nlayers=None):
+    shape = (ntimes, nrows, ncols) if nlayers is None else (ntimes, nlayers, nrows, ncols)
+    data = np.ma.masked_array(np.arange(np.prod(shape), dtype=np.float32).reshape(shape))
+    data[(0,) * len(shape)] = np.ma.masked
+    return StubVariable(data)
+
+
+def test_netcdf_array_reads_only_when_asked():
+    variable = make_variable()
+    array = netcdf.NetCDFArray(variable)
+    assert array.shape == (6, 1, 4, 5) and array.dtype == np.float32 and len(array) == 6
+    view = array[1:4, :, 1:3, 1:4]
+    assert isinstance(view, netcdf.NetCDFArray) and view.shape == (3, 1, 2, 3)
+    assert variable.reads == []
+    np.testing.assert_array_equal(np.asarray(view), variable.data.data[1:4, None, 1:3, 1:4])
+    assert variable.reads == [(slice(1, 4), slice(1, 3), slice(1, 4))]
+    assert np.isnan(np.asarray(array)[0, 0, 0, 0])
+
+
+def test_netcdf_array_ellipsis():
+    variable = make_variable()
+    array = netcdf.NetCDFArray(variable)
+    expected = variable.data.data[:, None]
+    assert array[..., 1:3].shape == (6, 1, 4, 2)
+    np.testing.assert_array_equal(np.asarray(array[..., 1:3]), expected[..., 1:3])
+    np.testing.assert_array_equal(np.asarray(array[2:4, ..., 1]), expected[2:4, ..., 1])
+    np.testing.assert_array_equal(array[3, ...], expected[3])
+
+
+def test_netcdf_array_slices_of_slices():
+    variable = make_variable(10, 6, 7)
+    array = netcdf.NetCDFArray(variable)
+    expected = variable.data.data[:, None]
+    view = array[2:9][1:6, :, 1:][::2, :, :, 2:5]
+    np.testing.assert_array_equal(np.asarray(view), expected[2:9][1:6, :, 1:][::2, :, :, 2:5])
+    np.testing.assert_array_equal(np.asarray(array[-3:, :, ::-1]), expected[-3:, :, ::-1])
+
+
+def test_netcdf_array_integers_squeeze_their_axes():
+    variable = make_variable(nlayers=2)
+    array = netcdf.NetCDFArray(variable)
+    assert array.shape == (6, 2, 4, 5)
+    np.testing.assert_array_equal(array[2, 1], variable.data.data[2, 1])
+    np.testing.assert_array_equal(array[:, 0, 1, 2], variable.data.data[:, 0, 1, 2])
+    np.testing.assert_array_equal(array[1:3][-1, :, 3], variable.data.data[2, :, 3])
+    with pytest.raises(IndexError):
+        array[6]
+    with pytest.raises(IndexError):
+        array[0, 0, 0, 0, 0]
+
+
+def test_netcdf_array_flips_south_to_north_rows():
+    variable = make_variable()
+    array = netcdf.NetCDFArray(variable, True)
+    flipped = variable.data.data[:, None, ::-1]
+    np.testing.assert_array_equal(np.asarray(array[1:, :, :2]), flipped[1:, :, :2])
+    np.testing.assert_array_equal(array[2, 0, 0], flipped[2, 0, 0])
+    np.testing.assert_array_equal(np.asarray(array[:, :, 1::2, 1:3]), flipped[:, :, 1::2, 1:3])
+    assert variable.reads[-1] == (slice(0, 6), slice(0, 3), slice(1, 3))
+
+
+def test_netcdf_array_reads_the_block_around_scattered_indices():
+    variable = make_variable(10, 6, 7)
+    array = netcdf.NetCDFArray(variable)
+    np.testing.assert_array_equal(np.asarray(array[1:8:3, :, ::5, 6:1:-2]), variable.data.data[1:8:3, None, ::5, 6:1:-2])
+    assert variable.reads[-1] == (slice(1, 8), slice(0, 6), slice(2, 7))
+
+
+def test_netcdf_array_empty_selection_and_scaled_variables():
+    array = netcdf.NetCDFArray(make_variable())
+    assert np.asarray(array[3:3]).shape == (0, 1, 4, 5)
+    scaled = StubVariable(np.ma.masked_array(np.zeros((2, 2, 2), dtype=np.int16)), scale_factor=0.1)
+    assert netcdf.NetCDFArray(scaled).dtype == np.float64
+    assert np.asarray(netcdf.NetCDFArray(scaled), dtype=np.float32).dtype == np.float32
+
+
+def test_lazy_stack_stays_lazy_until_loaded():
+    variable = make_variable()
+    stack = feature.RasterStack()
+    datelist = [datetime.datetime(2000, 1, day) for day in range(1, 7)]
+    stack.create_lazy_stack(netcdf.NetCDFArray(variable), datelist, None, "standard", 0, 4, 1, -1)
+    assert stack.is_lazy()
+    view = stack.sel_time("2000-01-02", "2000-01-03").sel_bbox(1, 3, 2, 2)
+    assert view.is_lazy()
+    view.load()
+    assert not view.is_lazy()
+    np.testing.assert_array_equal(view.data[:, 0], variable.data.data[1:3, 1:3, 1:3])
+
+
+def test_without_netcdf4(tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "netCDF4", None)
+    assert netcdf.load_netcdf(str(tmp_path / "in.nc"), "KBDI") is None
+    assert "netCDF4" in capsys.readouterr().out
+
+
+def test_write_and_load_netcdf(tmp_path):
+    pytest.importorskip("netCDF4")
+    datelist = [datetime.datetime(2000, 1, day) for day in range(1, 7)]
+    stack = feature.RasterStack()
+    stack.create_sc_stack(np.random.default_rng(0).random((6, 1, 4, 5)), datelist, None, "standard", 100, 50, 10, -10)
+    filename = str(tmp_path / "out.nc")
+    netcdf.write_netcdf(filename, {"KBDI": stack}, chunk_days=4)
+    loaded = netcdf.load_netcdf(filename, "KBDI")
+    assert loaded.is_lazy()
+    np.testing.assert_array_equal(np.asarray(loaded.data), stack.data)
+    assert loaded.datelist == datelist
+    assert loaded.mbr == stack.mbr
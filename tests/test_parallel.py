@@ -0,0 +1,60 @@
+import gc
+
+import numpy as np
+
+from kbdiffdi.features import feature
+from kbdiffdi.indices import kbdi
+from kbdiffdi.indices import ffdi
+from kbdiffdi.indices import parallel
+
+
+def make_inputs(ndays=400, nrows=9, ncols=7):
+    rng = np.random.default_rng(0)
+    shape = (ndays, 1, nrows, ncols)
+    season = np.cos(np.arange(ndays) * 2 * np.pi / 365.25).reshape(-1, 1, 1, 1)
+    datelist = list(np.arange("2000-01-01", ndays, dtype="datetime64[D]").astype(object))
+    stacks = []
+    for data in [22 + 6 * season + rng.normal(0, 3, shape), rng.gamma(0.3, 5., shape), rng.gamma(2., 8., shape), rng.uniform(10, 100, shape)]:
+        stack = feature.RasterStack()
+        stack.create_sc_stack(data, datelist, None, "standard", 0, 0, 1, -1)
+        stacks.append(stack)
+    return stacks
+
+
+def test_parallel_fit_is_identical_to_a_serial_fit():
+    temp, prcp, wind, relhum = make_inputs()
+    expected_kbdi = kbdi.KBDI().fit(temp, prcp)
+    expected_ffdi, expected_df = ffdi.FFDI().fit(expected_kbdi, prcp, temp, wind, relhum)
+    for workers in [1, 2]:
+        out_kbdi, out_ffdi, out_df = parallel.ParallelKBDIFFDI(workers, (4, 3)).fit(temp, prcp, wind, relhum)
+        np.testing.assert_array_equal(out_kbdi.data, expected_kbdi.data)
+        np.testing.assert_array_equal(out_df.data, expected_df.data)
+        np.testing.assert_array_equal(out_ffdi.data, expected_ffdi.data)
+
+
+def test_parallel_outputs_outlive_the_fit():
+    temp, prcp, wind, relhum = make_inputs(40, 3, 3)
+    out_kbdi = parallel.ParallelKBDIFFDI(1).fit(temp, prcp, wind, relhum)[0]
+    view = out_kbdi.data[-1]
+    expected = view.copy()
+    del out_kbdi
+    gc.collect()
+    np.testing.assert_array_equal(view, expected)
+
+
+def test_tiles_are_views_with_the_grid_of_the_inputs(monkeypatch):
+    temp, prcp, wind, relhum = make_inputs(40, 5, 4)
+    for stack in (temp, prcp, wind, relhum):
+        stack.create_sc_stack(stack.data, stack.datelist, "EPSG:32734", "standard", 500, 900, 10, -10)
+    tiles = []
+    fit = kbdi.KBDI.fit
+    def recording_fit(self, inittemp, *args, **kwargs):
+        tiles.append((inittemp.mbr, inittemp.projection, inittemp.calendar, inittemp.data.flags.owndata))
+        return fit(self, inittemp, *args, **kwargs)
+    monkeypatch.setattr(kbdi.KBDI, "fit", recording_fit)
+    out_kbdi = parallel.ParallelKBDIFFDI(1, (3, 3)).fit(temp, prcp, wind, relhum)[0]
+    assert tiles == [([500, 900, 520, 880], "EPSG:32734", "standard", False),
+                     ([530, 900, 530, 880], "EPSG:32734", "standard", False),
+                     ([500, 870, 520, 860], "EPSG:32734", "standard", False),
+                     ([530, 870, 530, 860], "EPSG:32734", "standard", False)]
+    assert out_kbdi.mbr == temp.mbr and out_kbdi.projection == "EPSG:32734"
@@ -0,0 +1,79 @@
+import datetime
+
+import numpy as np
+
+from kbdiffdi.features import feature
+from kbdiffdi.features import regrid
+
+
+def make_stack(data, x=0, y=0, cell_size=1, first_day=1):
+    datelist = [datetime.datetime(2000, 1, first_day + day) for day in range(len(data))]
+    stack = feature.RasterStack()
+    stack.create_sc_stack(data, datelist, None, "standard", x, y, cell_size, -cell_size)
+    return stack
+
+
+def test_average_coarsens_by_block_averages():
+    data = np.random.default_rng(0).random((3, 1, 4, 6))
+    target = make_stack(np.zeros((1, 1, 2, 3)), cell_size=2)
+    out = regrid.Regridder().regrid(make_stack(data), target)
+    np.testing.assert_allclose(out.data, data.reshape(3, 1, 2, 2, 3, 2).mean(axis=(3, 5)))
+    assert out.mbr == target.mbr
+    assert out.datelist == make_stack(data).datelist
+
+
+def test_average_leaves_nan_cells_out():
+    data = np.arange(4.).reshape(1, 1, 2, 2)
+    data[0, 0, 0, 0] = np.nan
+    out = regrid.Regridder().regrid(make_stack(data), make_stack(np.zeros((1, 1, 1, 1)), cell_size=2))
+    assert out.data[0, 0, 0, 0] == 2
+    data[:] = np.nan
+    out = regrid.Regridder().regrid(make_stack(data), make_stack(np.zeros((1, 1, 1, 1)), cell_size=2))
+    assert np.isnan(out.data).all()
+
+
+def test_nearest_refines_by_repeating_cells():
+    data = np.arange(6.).reshape(1, 1, 2, 3)
+    out = regrid.Regridder("nearest").regrid(make_stack(data, cell_size=2), make_stack(np.zeros((1, 1, 4, 6))))
+    np.testing.assert_array_equal(out.data, data.repeat(2, axis=2).repeat(2, axis=3))
+
+
+def test_bilinear_keeps_a_linear_field():
+    cols = np.arange(6.)
+    data = np.broadcast_to(cols, (1, 1, 4, 6))
+    target = make_stack(np.zeros((1, 1, 2, 2)), x=1, y=-1, cell_size=2)
+    out = regrid.Regridder("bilinear").regrid(make_stack(data), target)
+    np.testing.assert_allclose(out.data[0, 0], [[1.5, 3.5], [1.5, 3.5]])
+
+
+def test_weights_are_cached_per_grid_pair():
+    regridder = regrid.Regridder()
+    source = make_stack(np.zeros((1, 1, 4, 4)))
+    target = make_stack(np.zeros((1, 1, 2, 2)), cell_size=2)
+    assert regridder.get_weights(source, target) is regridder.get_weights(source, target)
+    assert len(regridder.weights) == 1
+    regridder.clear()
+    assert regridder.weights == {}
+
+
+def test_regrid_between_projections(capsys):
+    source = make_stack(np.zeros((1, 1, 2, 2)))
+    target = make_stack(np.zeros((1, 1, 2, 2)))
+    source.set_projection("EPSG:4326")
+    target.set_projection("EPSG:32734")
+    assert regrid.Regridder().regrid(source, target) is None
+    assert "error" in capsys.readouterr().out
+
+
+def test_align_uses_the_common_dates():
+    first = make_stack(np.ones((4, 1, 4, 4)))
+    second = make_stack(np.full((4, 1, 2, 2), 2.), cell_size=2, first_day=3)
+    out = regrid.Regridder("nearest").align([first, second])
+    for stack in out:
+        assert stack.data.shape == (2, 1, 4, 4)
+        assert [date.day for date in stack.datelist] == [3, 4]
+    assert np.all(out[1].data == 2)
+    datelist = [datetime.datetime(2000, 1, day) for day in range(1, 7)]
+    out = regrid.Regridder("nearest").align([first, second], datelist=datelist)
+    assert np.isnan(out[1].data[:2]).all() and np.isnan(out[0].data[4:]).all()
+    assert np.all(out[0].data[:4] == 1)
@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+
+from kbdiffdi.features import feature
+from kbdiffdi.indices import kbdi
+from kbdiffdi.indices import ffdi
+from kbdiffdi.indices import streaming
+from kbdiffdi.utilities import input_output
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "kbdiffdi", "data")
+
+
+def test_streaming_mean_annual_rainfall_is_the_same_for_any_chunking():
+    rain, temp, relhum, wind = input_output.load_csv(os.path.join(DATA, "Knysna.csv"))
+    data = np.random.default_rng(0).gamma(0.3, 5., (len(rain.data), 1, 20, 30))
+    prcp = feature.RasterStack()
+    prcp.create_sc_stack(data, rain.datelist, None, "standard", 0, 0, 1, -1)
+    KBDI = kbdi.KBDI()
+    KBDI.set_prcp(prcp)
+    KBDI.calculate_mean_annual_rainfall()
+    for chunk_days in [1, 100, 365, 1000]:
+        out = streaming.StreamingKBDIFFDI().mean_annual_rainfall(prcp.get_time_chunks(chunk_days))
+        np.testing.assert_array_equal(out.data, KBDI.get_mean_annual_rainfall().data)
+
+
+def test_fit_to_memmap_is_identical_to_a_full_run(tmp_path):
+    rain, temp, relhum, wind = input_output.load_csv(os.path.join(DATA, "Knysna.csv"))
+    expected_kbdi = kbdi.KBDI().fit(temp, rain)
+    expected_ffdi, expected_df = ffdi.FFDI().fit(expected_kbdi, rain, temp, wind, relhum)
+    for chunk_days in [100, 365]:
+        out_kbdi, out_ffdi, out_df = streaming.StreamingKBDIFFDI().fit_to_memmap(
+            temp, rain, wind, relhum,
+            str(tmp_path / ("kbdi" + str(chunk_days))),
+            str(tmp_path / ("ffdi" + str(chunk_days))),
+            str(tmp_path / ("df" + str(chunk_days))),
+            chunk_days=chunk_days)
+        np.testing.assert_array_equal(out_kbdi.data, expected_kbdi.data)
+        np.testing.assert_array_equal(out_df.data, expected_df.data)
+        np.testing.assert_array_equal(out_ffdi.data, expected_ffdi.data)